@@ -0,0 +1,563 @@
+# Reproducible packaging benchmark for packRunningJava.py and packMavenProject.py.
+#
+# Generates a synthetic classpath (many jars, deep exploded class directories, duplicated jars)
+# and a fake JDK and Maven whose jcmd/jlink/java/jdeps/mvn print realistic output after a
+# configurable delay, then runs the packers against them and reports per-stage timings and
+# throughput. Everything runs offline in a temporary directory; Linux only.
+#
+# Usage:
+#   python benchPackaging.py                      # default sizes
+#   python benchPackaging.py --jars 4000 --json bench.json
+#   python benchPackaging.py --compare old.json   # compare with a run from another commit
+
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_PID = str(os.getpid())  # perf-data discovery only lists live processes
+FAKE_MAIN_CLASS = "com.example.bench.Main"
+FAKE_JAR_NAME = "bench-app-1.0.0.jar"
+FAKE_MODULES = [
+    "java.base", "java.compiler", "java.datatransfer", "java.desktop", "java.instrument", "java.logging",
+    "java.management", "java.management.rmi", "java.naming", "java.net.http", "java.prefs", "java.rmi",
+    "java.scripting", "java.se", "java.security.jgss", "java.security.sasl", "java.smartcardio", "java.sql",
+    "java.sql.rowset", "java.transaction.xa", "java.xml", "java.xml.crypto", "jdk.attach", "jdk.charsets",
+    "jdk.crypto.cryptoki", "jdk.crypto.ec", "jdk.dynalink", "jdk.httpserver", "jdk.jcmd", "jdk.jdeps",
+    "jdk.jfr", "jdk.jlink", "jdk.localedata", "jdk.management", "jdk.management.agent", "jdk.naming.dns",
+    "jdk.net", "jdk.unsupported", "jdk.zipfs",
+]
+
+# One script serves as every fake tool; it dispatches on its own file name.
+# State (classpath, delays, sizes) comes from the JSON file named by FAKE_JVM_STATE.
+FAKE_TOOL_SOURCE = r'''
+import json, os, sys, time, zipfile
+
+tool = os.path.basename(sys.argv[0])
+with open(os.environ["FAKE_JVM_STATE"]) as f:
+    state = json.load(f)
+time.sleep(state["delays"].get(tool, 0))
+args = sys.argv[1:]
+
+if tool == "jcmd":
+    if not args or args == ["-l"]:
+        print(f"{state['pid']} {state['main_class']} {' '.join(state['args'])}")
+        print(f"{os.getpid()} jdk.jcmd/sun.tools.jcmd.JCmd -l")
+    elif args[1:] == ["VM.command_line"]:
+        print(f"{state['pid']}:")
+        print(f"VM Arguments:")
+        print(f"jvm_args: {' '.join(state['jvm_args'])}")
+        print(f"java_command: {state['main_class']} {' '.join(state['args'])}")
+        print(f"java_class_path (initial): {os.pathsep.join(state['classpath'])}")
+        print("Launcher Type: SUN_STANDARD")
+    elif args[1:] == ["VM.flags"]:
+        print(f"{state['pid']}:")
+        print(" ".join(state["flags"]))
+    elif args[1:] == ["VM.flags", "-all"]:
+        print(f"{state['pid']}:")
+        for flag in state["flags"]:
+            name, _, value = flag[4:].lstrip("+-").partition("=")
+            value = value or ("true" if flag[4] == "+" else "false")
+            origin = "command line" if flag in state["jvm_args"] or name in ("InitialHeapSize", "MaxHeapSize") else "ergonomic"
+            print(f"     intx {name:<40} = {value:<40} {{product}} {{{origin}}}")
+        for name, value in state["default_flags"].items():
+            print(f"     intx {name:<40} = {value:<40} {{product}} {{default}}")
+    elif args[1:] == ["VM.system_properties"]:
+        print(f"{state['pid']}:")
+        print("#" + time.ctime())
+        print(f"java.class.path={os.pathsep.join(state['classpath'])}")
+        print("java.vm.name=OpenJDK 64-Bit Server VM")
+        print("java.version=22.0.1")
+    elif args[1:] == ["VM.class_hierarchy", "-i"]:
+        print(f"{state['pid']}:")
+        print("java.lang.Object/null")
+        for i, name in enumerate(state["loaded_classes"]):
+            print(f"|--{name}/0x{0x800c01000 + i * 0x40:016x}")
+    else:
+        print(f"{state['pid']}:")
+elif tool == "java":
+    if "--list-modules" in args:
+        for module in state["modules"]:
+            print(f"{module}@22.0.1")
+    else:
+        print('openjdk version "22.0.1" 2024-04-16', file=sys.stderr)
+elif tool == "jdeps":
+    print("java.base,java.logging,java.sql")
+elif tool == "jlink":
+    output = args[args.index("--output") + 1]
+    os.makedirs(os.path.join(output, "bin"))
+    os.makedirs(os.path.join(output, "lib", "server"))
+    with open(os.path.join(output, "lib", "modules"), "wb") as f:
+        f.write(os.urandom(state["jre_bytes"]))
+    with open(os.path.join(output, "lib", "server", "libjvm.so"), "wb") as f:
+        f.write(os.urandom(state["jre_bytes"] // 2))
+    with open(os.path.join(output, "release"), "w") as f:
+        f.write('JAVA_VERSION="22.0.1"\n')
+    java = os.path.join(output, "bin", "java")
+    with open(java, "w") as f:
+        f.write("#!/bin/sh\necho started\n")
+    os.chmod(java, 0o755)
+elif tool == "mvn" and "dependency:build-classpath" in args:
+    # Compile changed sources only, as Maven's incremental compiler does, and write the classpath,
+    # for the project itself or every module of a reactor; relative output files are per module
+    output_file = next(arg.split("=", 1)[1] for arg in args if arg.startswith("-Dmdep.outputFile="))
+    module_dirs = []
+    for dir_path, dir_names, file_names in os.walk("."):
+        dir_names[:] = [name for name in dir_names if name not in ("target", "src")]
+        if "pom.xml" in file_names:
+            module_dirs.append(dir_path)
+    for module_dir in module_dirs:
+        source_root = os.path.join(module_dir, "src", "main", "java")
+        for dir_path, _, file_names in os.walk(source_root):
+            for file_name in file_names:
+                source = os.path.join(dir_path, file_name)
+                target = os.path.join(module_dir, "target", "classes", os.path.relpath(source, source_root))[:-5] + ".class"
+                if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, "wb") as f:
+                        f.write(os.urandom(256) + bytes(768))
+        module_output_file = os.path.join(module_dir, output_file)
+        os.makedirs(os.path.dirname(module_output_file), exist_ok=True)
+        with open(module_output_file, "w") as f:
+            f.write(os.pathsep.join(entry for entry in state["classpath"] if entry.endswith(".jar")))
+    print("[INFO] BUILD SUCCESS")
+elif tool == "mvn":
+    os.makedirs("target", exist_ok=True)
+    with zipfile.ZipFile(os.path.join("target", state["jar_name"]), "w", zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\r\n\r\n")
+        for i in range(state["fat_jar_entries"]):
+            jar.writestr(f"com/example/gen/C{i}.class", os.urandom(512))
+    print("[INFO] BUILD SUCCESS")
+'''
+
+
+# Deterministic pseudo-random bytes that compress like class files (partly repetitive)
+def class_bytes(rng: random.Random, size: int) -> bytes:
+    header = b"\xca\xfe\xba\xbe\x00\x00\x00\x42"
+    body = rng.randbytes(size // 2)
+    return header + body + body[: size - len(body) - len(header)]
+
+
+def write_jar(path: str, rng: random.Random, entries: int, entry_size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\r\n\r\n")
+        for i in range(entries):
+            jar.writestr(f"{os.path.basename(path)[:-4].replace('-', '/')}/C{i}.class", class_bytes(rng, entry_size))
+
+
+# Synthetic classpath: jars in a fake local Maven repository, duplicates of some of them in a lib
+# folder, and exploded class directories with deep package trees
+def generate_classpath(root: str, args: argparse.Namespace) -> list[str]:
+    rng = random.Random(args.seed)
+    classpath = []
+    for i in range(args.jars):
+        jar = os.path.join(root, "m2", f"group{i % 50}", f"artifact{i}", "1.0", f"artifact{i}-1.0.jar")
+        write_jar(jar, rng, args.classes_per_jar, args.class_bytes)
+        classpath.append(jar)
+
+    for i in range(min(args.duplicates, args.jars)):
+        duplicate = os.path.join(root, "lib", os.path.basename(classpath[i]))
+        os.makedirs(os.path.dirname(duplicate), exist_ok=True)
+        shutil.copy2(classpath[i], duplicate)
+        classpath.append(duplicate)
+
+    for d in range(args.class_dirs):
+        class_dir = os.path.join(root, "workspace", f"module{d}", "target", "classes")
+        for p in range(args.packages_per_dir):
+            package_dir = os.path.join(class_dir, *[f"p{p}l{level}" for level in range(args.dir_depth)])
+            os.makedirs(package_dir, exist_ok=True)
+            for c in range(args.classes_per_package):
+                with open(os.path.join(package_dir, f"C{c}.class"), "wb") as f:
+                    f.write(class_bytes(rng, args.class_bytes))
+        classpath.append(class_dir)
+    return classpath
+
+
+# Write a HotSpot perf-data file (format 2.0, little endian) with string and long counters
+def write_perfdata(path: str, counters: dict[str, str | int]) -> None:
+    entries = b""
+    for name, value in counters.items():
+        name_bytes = name.encode() + b"\0"
+        name_bytes += b"\0" * (-len(name_bytes) % 8)
+        if isinstance(value, int):
+            data_type, vector_length, data = b"J", 0, struct.pack("<q", value)
+        else:
+            data = value.encode() + b"\0"
+            data += b"\0" * (-len(data) % 8)
+            data_type, vector_length = b"B", len(data)
+        header_length = 20
+        entry_length = header_length + len(name_bytes) + len(data)
+        entries += struct.pack("<iii", entry_length, header_length, vector_length)
+        entries += data_type + b"\x00\x01\x03"
+        entries += struct.pack("<i", header_length + len(name_bytes)) + name_bytes + data
+    prologue = b"\xca\xfe\xc0\xc0" + bytes([1, 2, 0, 1])
+    prologue += struct.pack("<iiqii", 32 + len(entries), 0, 0, 32, len(counters))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(prologue + entries)
+
+
+# Fake JDK (java, jcmd, jlink, jdeps, jmods, release) and fake mvn, all driven by the state file
+def create_fake_tools(root: str, classpath: list[str], args: argparse.Namespace) -> tuple[str, str]:
+    jdk_dir = os.path.join(root, "fake-jdk")
+    for sub_dir in ("bin", "jmods", "lib"):
+        os.makedirs(os.path.join(jdk_dir, sub_dir), exist_ok=True)
+    with open(os.path.join(jdk_dir, "release"), "w") as f:
+        f.write('JAVA_VERSION="22.0.1"\n')
+    with open(os.path.join(jdk_dir, "jmods", "java.base.jmod"), "wb") as f:
+        f.write(b"JM\x01\x00")
+
+    tool_names = ("java", "jcmd", "jlink", "jdeps", "mvn")
+    for name in tool_names:
+        tool_path = os.path.join(jdk_dir, "bin", name)
+        with open(tool_path, "w") as f:
+            f.write(f"#!{sys.executable}\n{FAKE_TOOL_SOURCE}")
+        os.chmod(tool_path, 0o755)
+
+    state = {
+        "pid": FAKE_PID,
+        "main_class": FAKE_MAIN_CLASS,
+        "args": ["--server.port=8080", "--spring.profiles.active=bench"],
+        "jvm_args": ["-Xms512m", "-Xmx2g", "-XX:+UseG1GC", "-Dfile.encoding=UTF-8"],
+        "flags": ["-XX:CICompilerCount=4", "-XX:ConcGCThreads=2", "-XX:G1HeapRegionSize=1048576",
+                  "-XX:InitialHeapSize=536870912", "-XX:MaxHeapSize=2147483648", "-XX:+UseG1GC"],
+        "default_flags": {"ParallelGCThreads": 8, "TieredCompilation": "true", "UseSerialGC": "false"},
+        "classpath": classpath,
+        "modules": FAKE_MODULES,
+        "jre_bytes": args.jre_mb * 1024 * 1024 * 2 // 3,
+        "jar_name": FAKE_JAR_NAME,
+        "fat_jar_entries": args.jars * args.classes_per_jar // 4,
+        # A fifth of the classes of every jar, as a running service would have loaded
+        "loaded_classes": [f"{os.path.basename(jar)[:-4].replace('-', '.')}.C{i}"
+                           for jar in classpath if jar.endswith(".jar")
+                           for i in range(args.classes_per_jar // 5)],
+        "delays": {
+            "jcmd": args.jcmd_delay,
+            "jlink": args.jlink_delay,
+            "java": args.java_delay,
+            "jdeps": args.jdeps_delay,
+            "mvn": args.mvn_delay,
+        },
+    }
+    state_file = os.path.join(root, "fake-state.json")
+    with open(state_file, "w") as f:
+        json.dump(state, f)
+    write_perfdata(os.path.join(root, "hsperfdata", "hsperfdata_bench", FAKE_PID), {
+        "sun.rt.javaCommand": f"{FAKE_MAIN_CLASS} {' '.join(state['args'])}",
+        "java.rt.vmArgs": " ".join(state["jvm_args"]),
+        "java.rt.vmFlags": "",
+        "java.property.java.class.path": os.pathsep.join(classpath),
+        "sun.rt.createVmBeginTime": int(time.time() * 1000),
+    })
+    os.environ["FAKE_JVM_STATE"] = state_file
+    os.environ["PATH"] = os.path.join(jdk_dir, "bin") + os.pathsep + os.environ.get("PATH", "")
+    return jdk_dir, os.path.join(jdk_dir, "bin", "mvn")
+
+
+# Fresh copies of the packer modules, so configuration from a previous scenario does not leak
+def load_packers(root: str):
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    pack_common = importlib.reload(importlib.import_module("packCommon"))
+    pack_common.CACHE_ROOT = os.path.join(root, "cache")
+    pack_common.JDEPS_CACHE_FILE = os.path.join(pack_common.CACHE_ROOT, "jdeps-cache.json")
+    pack_common.JRE_CACHE_DIR = os.path.join(pack_common.CACHE_ROOT, "jre")
+    pack_common.PROFILER.enabled = True
+    pack_running = importlib.reload(importlib.import_module("packRunningJava"))
+    pack_maven = importlib.reload(importlib.import_module("packMavenProject"))
+    return pack_common, pack_running, pack_maven
+
+
+def configure_running(pack_running, root: str, jdk_dir: str, name: str, options: dict) -> None:
+    pack_dir = os.path.join(root, "out", name)
+    pack_running.JDK_PATH = jdk_dir
+    pack_running.PACK_DIR = pack_dir
+    pack_running.DEPENDENCY_DIR = os.path.join(pack_dir, "dependencies")
+    pack_running.DEPENDENCY_STORE_DIR = os.path.join(root, "out", ".pack-store")
+    # An empty list disables perf-data discovery, so jcmd is used
+    pack_running.HSPERFDATA_DIRS = glob.glob(os.path.join(root, "hsperfdata", "hsperfdata_*"))
+    for key, value in options.items():
+        setattr(pack_running, key, value)
+
+
+# Without verbose, discard the packers' output, including the output of the fake tools they run,
+# which writes to file descriptor 1 and so bypasses redirect_stdout
+def run_quietly(verbose: bool, action) -> None:
+    if verbose:
+        action()
+        return
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    try:
+        with tempfile.TemporaryFile() as captured, contextlib.redirect_stdout(io.StringIO()):
+            os.dup2(captured.fileno(), 1)
+            action()
+    finally:
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+
+
+# Run packRunningJava's stage graph against the fake JVM; returns per-stage profiles
+def bench_running(root: str, jdk_dir: str, name: str, options: dict, verbose: bool) -> dict:
+    pack_common, pack_running, _ = load_packers(root)
+    configure_running(pack_running, root, jdk_dir, name, options)
+
+    def pack() -> None:
+        processes = pack_running.list_java_processes()
+        pid, main_class, _ = processes[0]
+        archive = None
+        if pack_running.ARCHIVE_OUTPUT:
+            archive = pack_common.PackageArchive(pack_running.ARCHIVE_OUTPUT, pack_running.PACK_DIR,
+                                                 pack_running.ARCHIVE_FORMAT, pack_running.ARCHIVE_WORKERS)
+        else:
+            os.makedirs(pack_running.PACK_DIR, exist_ok=True)
+        pack_running.run_stages(pack_running.app_stages(pid, main_class, pack_running.PACK_DIR, archive=archive))
+        if archive is not None:
+            with pack_common.PROFILER.stage("archive", [pack_running.ARCHIVE_OUTPUT]):
+                archive.close()
+
+    start = time.perf_counter()
+    with pack_common.PROFILER.stage("discover"):
+        run_quietly(verbose, lambda: pack_running.list_java_processes())
+    run_quietly(verbose, pack)
+    return {"total_seconds": time.perf_counter() - start, "stages": pack_common.PROFILER.stages}
+
+
+# Multi-module reactor: a library and two services below an aggregator that is also their parent;
+# the services name their main class in different ways, and one sets its own finalName
+def create_maven_reactor(project_dir: str) -> None:
+    pom = '<project xmlns="http://maven.apache.org/POM/4.0.0"><modelVersion>4.0.0</modelVersion>CONTENT</project>'
+    parent = ('<parent><groupId>com.example</groupId><artifactId>bench-reactor</artifactId><version>${revision}</version>'
+              '<relativePath>RELATIVE_PATH</relativePath></parent>')
+    poms = {
+        "": '<groupId>com.example</groupId><artifactId>bench-reactor</artifactId><version>${revision}</version>'
+            '<packaging>pom</packaging><properties><revision>2.1.0</revision></properties>'
+            '<modules><module>bench-lib</module><module>services</module></modules>',
+        "bench-lib": parent.replace("RELATIVE_PATH", "../pom.xml") + '<artifactId>bench-lib</artifactId>',
+        "services": parent.replace("RELATIVE_PATH", "../pom.xml") + '<artifactId>bench-services</artifactId><packaging>pom</packaging>'
+                    '<modules><module>orders</module><module>billing/pom.xml</module></modules>',
+        os.path.join("services", "orders"): parent.replace("RELATIVE_PATH", "../../pom.xml") +
+            '<artifactId>orders</artifactId><properties><start-class>com.example.orders.Main</start-class></properties>',
+        os.path.join("services", "billing"): parent.replace("RELATIVE_PATH", "../../pom.xml") +
+            '<artifactId>billing</artifactId><build><finalName>${project.artifactId}-service</finalName><plugins><plugin>'
+            '<artifactId>maven-jar-plugin</artifactId><configuration><archive><manifest>'
+            '<mainClass>com.example.billing.Main</mainClass></manifest></archive></configuration></plugin></plugins></build>',
+    }
+    for module, content in poms.items():
+        module_dir = os.path.join(project_dir, module)
+        os.makedirs(module_dir, exist_ok=True)
+        with open(os.path.join(module_dir, "pom.xml"), "w") as f:
+            f.write(pom.replace("CONTENT", content))
+        if module and module != "services":
+            package = os.path.basename(module).replace("bench-", "")
+            source_dir = os.path.join(module_dir, "src", "main", "java", "com", "example", package)
+            os.makedirs(source_dir)
+            for i in range(100):
+                with open(os.path.join(source_dir, f"C{i}.java"), "w") as f:
+                    f.write(f"package com.example.{package}; class C{i} {{}}\n")
+
+
+# Run packMavenProject.main against a generated project (or reactor, with REACTOR_MODULES) and the fake mvn
+def bench_maven(root: str, jdk_dir: str, mvn: str, options: dict, verbose: bool) -> dict:
+    reactor = options.get("REACTOR_MODULES", False)
+    project_dir = os.path.join(root, "maven-reactor" if reactor else "maven-project")
+    if reactor and not os.path.exists(project_dir):
+        create_maven_reactor(project_dir)
+    elif not os.path.exists(project_dir):
+        source_dir = os.path.join(project_dir, "src", "main", "java", "com", "example", "bench")
+        os.makedirs(source_dir)
+        with open(os.path.join(project_dir, "pom.xml"), "w") as f:
+            f.write('<project xmlns="http://maven.apache.org/POM/4.0.0"><modelVersion>4.0.0</modelVersion>'
+                    '<groupId>com.example</groupId><artifactId>bench-app</artifactId><version>1.0.0</version></project>')
+        for i in range(200):
+            with open(os.path.join(source_dir, f"C{i}.java"), "w") as f:
+                f.write(f"package com.example.bench; class C{i} {{}}\n")
+
+    pack_common, _, pack_maven = load_packers(root)
+    pack_maven.PROJECT_DIR = project_dir
+    pack_maven.OUTPUT_DIR = os.path.join(root, "out", "maven-reactor" if reactor else "maven")
+    pack_maven.NEW_POM_FILE = os.path.join(project_dir, "pom_executable.xml")
+    pack_maven.BUILD_FINGERPRINT_FILE = os.path.join(project_dir, "target", ".pack-build-fingerprint")
+    pack_maven.CLASSPATH_FILE = os.path.join(project_dir, "target", "pack-classpath.txt")
+    pack_maven.FAT_JAR_STATE_FILE = os.path.join(project_dir, "target", ".pack-fat-jar.json")
+    pack_maven.JDK_PATH = jdk_dir
+    # The fake mvn's shaded jar has a fixed name; reactor modules read theirs from the POMs
+    pack_maven.JAR_FILE_NAME = None if reactor else FAKE_JAR_NAME
+    pack_maven.MAVEN_EXECUTABLE = mvn
+    for key, value in options.items():
+        setattr(pack_maven, key, value)
+    os.makedirs(pack_maven.OUTPUT_DIR, exist_ok=True)
+
+    start = time.perf_counter()
+    run_quietly(verbose, pack_maven.main)
+    return {"total_seconds": time.perf_counter() - start, "stages": pack_common.PROFILER.stages}
+
+
+def summarize(result: dict) -> dict:
+    stages = {}
+    for stage in result["stages"]:
+        throughput = None
+        if stage.bytes_written and stage.wall_seconds > 0:
+            throughput = stage.bytes_written / stage.wall_seconds / (1024 * 1024)
+        stages[stage.name] = {
+            "wall_seconds": stage.wall_seconds,
+            "child_cpu_seconds": stage.child_cpu_seconds,
+            "files_written": stage.files_written,
+            "bytes_written": stage.bytes_written,
+            "mb_per_second": round(throughput, 1) if throughput is not None else None,
+        }
+    return {"total_seconds": round(result["total_seconds"], 3), "stages": stages}
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, text=True)
+        return revision + ("-dirty" if dirty.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    print(f"\nCommit {report['commit']}, {report['classpath_entries']} classpath entries, "
+          f"{report['classpath_files']} files ({report['classpath_bytes'] // (1024 * 1024)} MB)")
+    for scenario, result in report["scenarios"].items():
+        previous = (baseline or {}).get("scenarios", {}).get(scenario)
+        change = ""
+        if previous:
+            change = f"  (baseline {previous['total_seconds']:.2f}s, {result['total_seconds'] / previous['total_seconds'] - 1:+.0%})" \
+                if previous["total_seconds"] else ""
+        print(f"\n{scenario}: {result['total_seconds']:.2f}s{change}")
+        for name, stage in result["stages"].items():
+            throughput = f"{stage['mb_per_second']:.1f} MB/s" if stage["mb_per_second"] is not None else "-"
+            previous_stage = (previous or {}).get("stages", {}).get(name)
+            stage_change = f"  (baseline {previous_stage['wall_seconds']:.2f}s)" if previous_stage else ""
+            print(f"  {name:<20} {stage['wall_seconds']:>8.2f}s {stage['files_written']:>8} files "
+                  f"{stage['bytes_written'] / (1024 * 1024):>9.1f} MB {throughput:>12}{stage_change}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark packRunningJava and packMavenProject offline with fake JDK and Maven tools.")
+    parser.add_argument("--jars", type=int, default=2000, help="number of dependency jars")
+    parser.add_argument("--classes-per-jar", type=int, default=20)
+    parser.add_argument("--class-bytes", type=int, default=2048, help="size of each generated class file")
+    parser.add_argument("--duplicates", type=int, default=200, help="jars also present in a second location")
+    parser.add_argument("--class-dirs", type=int, default=4, help="exploded class directories")
+    parser.add_argument("--packages-per-dir", type=int, default=50)
+    parser.add_argument("--classes-per-package", type=int, default=20)
+    parser.add_argument("--dir-depth", type=int, default=6, help="package depth in class directories")
+    parser.add_argument("--jre-mb", type=int, default=40, help="size of the fake jlink output")
+    parser.add_argument("--jcmd-delay", type=float, default=0.3)
+    parser.add_argument("--jlink-delay", type=float, default=3.0)
+    parser.add_argument("--java-delay", type=float, default=0.2)
+    parser.add_argument("--jdeps-delay", type=float, default=0.5)
+    parser.add_argument("--mvn-delay", type=float, default=5.0)
+    parser.add_argument("--jdeps", action="store_true",
+                        help="also benchmark JRE_MODULES_MODE='jdeps' (one fake jdeps run per classpath entry when cold)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="directory for the generated files (default: a new temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the packers' output")
+    args = parser.parse_args()
+
+    if sys.platform != "linux":
+        parser.error("the benchmark uses POSIX fake tools and only runs on Linux")
+
+    root = args.workdir or tempfile.mkdtemp(prefix="pack-bench-")
+    os.makedirs(root, exist_ok=True)
+    try:
+        print(f"Generating synthetic classpath in {root}...")
+        classpath = generate_classpath(os.path.join(root, "input"), args)
+        jdk_dir, mvn = create_fake_tools(root, classpath, args)
+        files = 0
+        total_bytes = 0
+        for entry in classpath:
+            if os.path.isfile(entry):
+                files += 1
+                total_bytes += os.path.getsize(entry)
+                continue
+            for dir_path, _, file_names in os.walk(entry):
+                for file_name in file_names:
+                    files += 1
+                    total_bytes += os.path.getsize(os.path.join(dir_path, file_name))
+
+        scenarios = {}
+        # Cold: empty pack directory and caches; warm: same again, exercising the incremental paths
+        running_scenarios = [
+            ("running-cold", "running", {}),
+            ("running-warm", "running", {}),
+            ("running-jcmd-discovery", "running", {"HSPERFDATA_DIRS": []}),
+            ("running-jar-dirs", "running-jar-dirs", {"JAR_CLASS_DIRECTORIES": True}),
+            ("running-trim-cold", "running-trim", {"TRIM_JARS": True}),
+            ("running-trim-warm", "running-trim", {"TRIM_JARS": True}),
+            ("running-merge-jars-cold", "running-merge", {"MERGE_SMALL_JARS": True, "LAUNCHER_CLASSPATH": "argfile"}),
+            ("running-merge-jars-warm", "running-merge", {"MERGE_SMALL_JARS": True, "LAUNCHER_CLASSPATH": "argfile"}),
+            ("running-replay-flags", "running-replay-flags", {"REPLAY_JVM_FLAGS": True}),
+            ("running-zip", "running-zip", {"ARCHIVE_OUTPUT": os.path.join(root, "out", "running.zip")}),
+            ("running-tar-gz", "running-tar-gz", {"ARCHIVE_OUTPUT": os.path.join(root, "out", "running.tar.gz")}),
+        ]
+        if args.jdeps:
+            running_scenarios += [
+                ("running-jdeps-cold", "running-jdeps", {"JRE_MODULES_MODE": "jdeps"}),
+                ("running-jdeps-warm", "running-jdeps", {"JRE_MODULES_MODE": "jdeps"}),
+            ]
+        for scenario, name, options in running_scenarios:
+            print(f"Running {scenario}...")
+            scenarios[scenario] = summarize(bench_running(root, jdk_dir, name, options, args.verbose))
+        maven_scenarios = [
+            ("maven-cold", {}),
+            ("maven-warm", {}),
+            ("maven-native-cold", {"FAT_JAR_BUILDER": "native"}),
+            ("maven-native-warm", {"FAT_JAR_BUILDER": "native"}),
+            ("maven-native-one-source-changed", {"FAT_JAR_BUILDER": "native"}),
+            ("maven-reactor-native-cold", {"FAT_JAR_BUILDER": "native", "REACTOR_MODULES": True}),
+            ("maven-reactor-native-warm", {"FAT_JAR_BUILDER": "native", "REACTOR_MODULES": True}),
+        ]
+        for scenario, options in maven_scenarios:
+            if scenario == "maven-native-one-source-changed":
+                source = os.path.join(root, "maven-project", "src", "main", "java", "com", "example", "bench", "C0.java")
+                os.utime(source, (time.time() + 1, time.time() + 1))
+            print(f"Running {scenario}...")
+            scenarios[scenario] = summarize(bench_maven(root, jdk_dir, mvn, options, args.verbose))
+
+        report = {
+            "commit": git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "parameters": {key: value for key, value in vars(args).items()
+                           if key not in ("workdir", "keep", "json", "compare", "verbose")},
+            "classpath_entries": len(classpath),
+            "classpath_files": files,
+            "classpath_bytes": total_bytes,
+            "scenarios": scenarios,
+        }
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print_report(report, baseline)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Startup latency benchmark for packaged applications.
+#
+# Runs generated launchers (or any command) several times and measures the time until the app is
+# ready: a log line matching a regex, a TCP port accepting connections, or process exit. Reports
+# min, p50, p95 and max per variant, side by side. Runs of the variants are interleaved, so a
+# slowly warming disk cache or a noisy neighbour affects all variants alike.
+#
+# Usage:
+#   python benchStartup.py --variant full=/tmp/pack-full/start_program.sh \
+#                          --variant minimal=/tmp/pack-jdeps/start_program.sh --ready-line "Started"
+#   python benchStartup.py --variant base=pack/start_program.sh \
+#                          --variant g1=pack/start_program.sh --java-opts g1="-XX:+UseG1GC" --ready-port 8080
+#   python benchStartup.py --variant original="java -cp app.jar com.example.Main" --runs 20
+
+import argparse
+import json
+import math
+import os
+import re
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Variant:
+    name: str
+    command: list[str]
+    cwd: str
+    java_opts: str | None = None
+    seconds: list[float] = field(default_factory=list)
+    failures: int = 0
+
+
+# Launcher path or command line of a variant; launchers run from their own directory,
+# because they reference custom-jre and the dependencies relative to it
+def parse_variant(spec: str) -> Variant:
+    name, separator, command_line = spec.partition("=")
+    if not separator or not name or not command_line:
+        raise argparse.ArgumentTypeError(f"expected NAME=LAUNCHER or NAME=COMMAND, got {spec!r}")
+    command = shlex.split(command_line, posix=os.name != "nt")
+    cwd = os.getcwd()
+    if os.path.isfile(command[0]):
+        command[0] = os.path.abspath(command[0])
+        cwd = os.path.dirname(command[0])
+        if command[0].endswith(".sh") and os.name != "nt":
+            command.insert(0, "bash")
+        elif command[0].endswith(".bat") and os.name == "nt":
+            command = ["cmd", "/c", *command]
+    return Variant(name, command, cwd)
+
+
+def port_is_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.05):
+            return True
+    except OSError:
+        return False
+
+
+# Returns False when the port is still open after timeout seconds
+def wait_for_port_closed(port: int, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while port_is_open(port):
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+# Start the command in its own process group and wait until it is ready.
+# Returns the seconds until ready, or None when it did not get ready within timeout.
+def measure_once(variant: Variant, ready_line: re.Pattern | None, ready_port: int | None, timeout: float) -> float | None:
+    env = dict(os.environ)
+    if variant.java_opts is not None:
+        env["JAVA_OPTS"] = variant.java_opts
+    popen_options = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt" else {"start_new_session": True}
+    start = time.perf_counter()
+    process = subprocess.Popen(variant.command, cwd=variant.cwd, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, errors="replace", **popen_options)
+    ready = threading.Event()
+    ready_after = []
+
+    def drain_output() -> None:
+        for line in process.stdout:
+            if ready_line is not None and not ready.is_set() and ready_line.search(line):
+                ready_after.append(time.perf_counter() - start)
+                ready.set()
+
+    reader = threading.Thread(target=drain_output, daemon=True)
+    reader.start()
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            if ready.is_set():
+                return ready_after[0]
+            if ready_port is not None and port_is_open(ready_port):
+                return time.perf_counter() - start
+            if process.poll() is not None:
+                reader.join(1)
+                if ready_after:
+                    return ready_after[0]
+                # Without a line or port signal, exit is the signal
+                if ready_line is None and ready_port is None:
+                    return time.perf_counter() - start
+                return None
+            ready.wait(0.005)
+        return None
+    finally:
+        stop_process_group(process)
+
+
+# Stop the launcher and the JVM it started
+def stop_process_group(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        try:
+            if os.name == "nt":
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    process.wait()
+    if os.name != "nt":
+        # The launcher may have exited while its JVM keeps running
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(variant: Variant) -> dict:
+    values = sorted(variant.seconds)
+    summary = {"runs": len(values), "failures": variant.failures}
+    if values:
+        summary.update({
+            "min": round(values[0], 4),
+            "p50": round(percentile(values, 0.50), 4),
+            "p95": round(percentile(values, 0.95), 4),
+            "max": round(values[-1], 4),
+            "mean": round(sum(values) / len(values), 4),
+        })
+    return summary
+
+
+def print_report(variants: list[Variant]) -> None:
+    baseline = summarize(variants[0]).get("p50")
+    print(f"\n{'Variant':<24} {'Runs':>5} {'Fail':>5} {'Min':>9} {'p50':>9} {'p95':>9} {'Max':>9} {'vs first':>9}")
+    for variant in variants:
+        summary = summarize(variant)
+        if not variant.seconds:
+            print(f"{variant.name:<24} {summary['runs']:>5} {summary['failures']:>5} {'-':>9} {'-':>9} {'-':>9} {'-':>9}")
+            continue
+        change = f"{summary['p50'] / baseline - 1:+.0%}" if baseline else "-"
+        print(f"{variant.name:<24} {summary['runs']:>5} {summary['failures']:>5} "
+              f"{summary['min']:>8.3f}s {summary['p50']:>8.3f}s {summary['p95']:>8.3f}s {summary['max']:>8.3f}s {change:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the startup latency of packaged Java applications.")
+    parser.add_argument("--variant", action="append", type=parse_variant, required=True, metavar="NAME=LAUNCHER",
+                        help="launcher script or command line to measure; repeat to compare variants")
+    parser.add_argument("--java-opts", action="append", default=[], metavar="NAME=OPTIONS",
+                        help="JAVA_OPTS for a variant, appended to the JVM arguments of generated launchers")
+    parser.add_argument("--runs", type=int, default=10, help="measured runs per variant")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs per variant first")
+    ready = parser.add_mutually_exclusive_group()
+    ready.add_argument("--ready-line", help="regex of an output line that marks the app as started")
+    ready.add_argument("--ready-port", type=int, help="TCP port on localhost the app listens on when started")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for readiness per run")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    variants = args.variant
+    names = [variant.name for variant in variants]
+    if len(set(names)) != len(names):
+        parser.error("variant names must be unique")
+    for spec in args.java_opts:
+        name, _, options = spec.partition("=")
+        if name not in names:
+            parser.error(f"--java-opts for unknown variant {name!r}")
+        variants[names.index(name)].java_opts = options
+    if args.ready_port is not None and port_is_open(args.ready_port):
+        parser.error(f"port {args.ready_port} is already open, stop the original application first")
+
+    ready_line = re.compile(args.ready_line) if args.ready_line else None
+    signal_name = (f"line /{args.ready_line}/" if ready_line else
+                   f"port {args.ready_port}" if args.ready_port is not None else "process exit")
+    print(f"Measuring time to {signal_name}: {args.warmup} warmup and {args.runs} measured runs per variant")
+
+    for run in range(args.warmup + args.runs):
+        for variant in variants:
+            seconds = measure_once(variant, ready_line, args.ready_port, args.timeout)
+            # Wait for the port to close, so the next run does not see the previous app
+            if args.ready_port is not None and not wait_for_port_closed(args.ready_port, args.timeout):
+                sys.exit(f"Port {args.ready_port} is still open {args.timeout:.0f}s after stopping {variant.name}")
+            if run < args.warmup:
+                continue
+            if seconds is None:
+                variant.failures += 1
+                print(f"  {variant.name} run {run - args.warmup + 1}: not ready within {args.timeout:.0f}s")
+            else:
+                variant.seconds.append(seconds)
+
+    print_report(variants)
+    if args.json:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "ready_signal": signal_name,
+            "variants": {variant.name: {"command": variant.command, "java_opts": variant.java_opts,
+                                        "seconds": variant.seconds, **summarize(variant)} for variant in variants},
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    if all(not variant.seconds for variant in variants):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1280 @@
+# Helpers shared by packRunningJava.py and packMavenProject.py.
+
+import os
+import sys
+import io
+import errno
+import subprocess
+import hashlib
+import json
+import platform
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, Iterator
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+try:
+    import fcntl  # POSIX only, used for reflink clones
+except ImportError:
+    fcntl = None
+
+CACHE_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "packJavaProgram")  # Root of all local caches
+JDEPS_CACHE_FILE = os.path.join(CACHE_ROOT, "jdeps-cache.json")  # jdeps results keyed by JDK version and jar hash
+JDEPS_WORKERS = os.cpu_count() or 1  # Number of jdeps processes run in parallel
+JRE_CACHE_DIR = os.path.join(CACHE_ROOT, "jre")  # jlink runtime images keyed by JDK, modules and jlink options
+JRE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Least recently used images are evicted above this size, 0 disables the cache
+JLINK_OPTIONS = ["--no-header-files", "--no-man-pages"]  # Options passed to jlink besides modules and output
+ARCHIVE_CHUNK_BYTES = 1024 * 1024  # Streamed archives are compressed in chunks of this size on a thread pool
+ARCHIVE_COMPRESSION_LEVEL = 6  # zlib level used for streamed archives
+JAR_MERGE_EXCLUDES = ["META-INF/*.SF", "META-INF/*.DSA", "META-INF/*.RSA"]  # Signature files dropped when jars are merged, as in the shade filter
+COPY_METHODS = ["reflink", "copy_file_range", "sendfile", "buffered"]  # Tried in order, the first that works is remembered per filesystem pair
+PROFILE_ENV_VAR = "PACK_PROFILE"  # Set to 1, or to the path of the JSON report, to profile every stage
+
+
+def is_windows() -> bool:
+    return platform.system().lower() == 'windows'
+
+
+# Human readable byte count
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+# Path of an executable in the bin directory of a JDK or JRE
+def jdk_tool(jdk_path: str, name: str) -> str:
+    exe_ext = '.exe' if is_windows() else ''
+    return os.path.join(jdk_path, "bin", f"{name}{exe_ext}")
+
+
+# SHA-256 digest of a file, read in chunks
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_FICLONE = 0x40049409  # Linux ioctl that shares the extents of one file with another (XFS, btrfs, bcachefs)
+# Errors that mean a copy method is not supported for this pair of files, not that the copy failed
+_UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS,
+                            errno.ENOTTY, errno.EBADF, errno.ETXTBSY}
+
+
+def _copy_reflink(source_fd: int, target_fd: int, size: int) -> None:
+    if fcntl is None or platform.system() != 'Linux':
+        raise OSError(errno.ENOTSUP, "reflink is only available on Linux")
+    fcntl.ioctl(target_fd, _FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd: int, target_fd: int, size: int) -> None:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(source_fd, target_fd, size - offset, offset, offset)
+        if copied == 0:
+            # Some filesystems (procfs, FUSE) answer 0 instead of an error; the next method copies it
+            raise OSError(errno.ENOTSUP, f"copy_file_range stopped after {offset} of {size} bytes")
+        offset += copied
+
+
+def _copy_sendfile(source_fd: int, target_fd: int, size: int) -> None:
+    if not hasattr(os, "sendfile") or platform.system() != 'Linux':
+        raise OSError(errno.ENOSYS, "sendfile to a file is only available on Linux")
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(target_fd, source_fd, offset, min(size - offset, 1 << 30))
+        if sent == 0:
+            raise OSError(errno.ENOTSUP, f"sendfile stopped after {offset} of {size} bytes")
+        offset += sent
+
+
+def _copy_buffered(source_fd: int, target_fd: int, size: int) -> None:
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    copied = 0
+    while True:
+        chunk = os.read(source_fd, 1024 * 1024)
+        if not chunk:
+            break
+        copied += len(chunk)
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(target_fd, view):]
+    if copied != size:
+        # The source changed while it was copied; a truncated copy would be skipped as unchanged later
+        raise OSError(errno.EIO, f"copied {copied} bytes, but the source has {size} bytes")
+
+
+_COPY_FUNCTIONS = {
+    "reflink": _copy_reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _copy_sendfile,
+    "buffered": _copy_buffered,
+}
+
+
+# Copies file contents with the fastest method in COPY_METHODS that the filesystems support:
+# a reflink clone shares the data blocks and is instant, copy_file_range and sendfile copy in the
+# kernel, buffered copies go through user space. The method is probed on the first copy between
+# the filesystems of a source and a target directory and remembered; counts per method are kept.
+class FileCopier:
+    def __init__(self) -> None:
+        self._methods: dict[tuple[int, int], int] = {}  # (source st_dev, target dir st_dev) -> index in COPY_METHODS
+        self._lock = threading.Lock()
+        self.files: dict[str, int] = {}
+        self.bytes: dict[str, int] = {}
+
+    # Copy source to target with its permission bits and timestamps (like shutil.copy2).
+    # Returns the method used.
+    def copy(self, source: str, target: str) -> str:
+        source_stat = os.stat(source)
+        target_dir = os.path.dirname(os.path.abspath(target))
+        key = (source_stat.st_dev, os.stat(target_dir).st_dev)
+        with self._lock:
+            index = self._methods.get(key, 0)
+
+        source_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+            try:
+                while True:
+                    method = COPY_METHODS[index]
+                    try:
+                        _COPY_FUNCTIONS[method](source_fd, target_fd, source_stat.st_size)
+                        break
+                    except OSError as e:
+                        if e.errno not in _UNSUPPORTED_COPY_ERRORS or index == len(COPY_METHODS) - 1:
+                            raise
+                    # Start over with the next method
+                    os.ftruncate(target_fd, 0)
+                    os.lseek(target_fd, 0, os.SEEK_SET)
+                    index += 1
+            finally:
+                os.close(target_fd)
+        finally:
+            os.close(source_fd)
+        shutil.copystat(source, target)
+
+        with self._lock:
+            if key not in self._methods:
+                print(f"Copying into {target_dir} uses {method}")
+            self._methods[key] = index
+            self.files[method] = self.files.get(method, 0) + 1
+            self.bytes[method] = self.bytes.get(method, 0) + source_stat.st_size
+        return method
+
+    # Files and bytes copied per method so far, e.g. "reflink 120 files (35.2 MB)"
+    def summary(self) -> str:
+        with self._lock:
+            return ", ".join(f"{method} {self.files[method]} files ({format_bytes(self.bytes[method])})"
+                             for method in COPY_METHODS if method in self.files) or "no files copied"
+
+
+FILE_COPIER = FileCopier()  # Shared by all copies of one packer run
+
+
+# shutil.copy2 replacement for copytree(copy_function=...), going through FILE_COPIER
+def copy_file(source: str, target: str) -> str:
+    if os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(source))
+    FILE_COPIER.copy(source, target)
+    return target
+
+
+# Read the JDK "release" file into a dict, e.g. {"JAVA_VERSION": "22.0.1", ...}
+def read_jdk_release(jdk_path: str) -> dict[str, str]:
+    release = {}
+    try:
+        with open(os.path.join(jdk_path, "release"), 'r', encoding='utf-8') as f:
+            for line in f:
+                if '=' in line:
+                    key, value = line.strip().split('=', 1)
+                    release[key] = value.strip('"')
+    except OSError:
+        pass
+    return release
+
+
+# Feature version of a JDK (22 for "22.0.1"), falling back to `java -version`
+def jdk_feature_version(jdk_path: str) -> str:
+    version = read_jdk_release(jdk_path).get("JAVA_VERSION")
+    if not version:
+        output = subprocess.run([jdk_tool(jdk_path, "java"), "-version"],
+                                capture_output=True, text=True).stderr
+        quoted = output.split('"')
+        version = quoted[1] if len(quoted) > 1 else "0"
+    feature = version.split('.')[0]
+    # Java 8 and earlier report themselves as 1.x
+    return version.split('.')[1] if feature == "1" else feature
+
+
+# All modules of a JDK, as reported by java --list-modules
+def list_jdk_modules(jdk_path: str) -> list[str]:
+    output = subprocess.check_output([jdk_tool(jdk_path, "java"), "--list-modules"]).decode()
+    # Only keep the part before @, remove version numbers
+    return [line.split('@')[0] for line in output.strip().splitlines() if line.strip()]
+
+
+def _load_jdeps_cache() -> dict:
+    try:
+        with open(JDEPS_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache.setdefault("hashes", {})
+    cache.setdefault("modules", {})
+    return cache
+
+
+def _save_jdeps_cache(cache: dict) -> None:
+    os.makedirs(os.path.dirname(JDEPS_CACHE_FILE), exist_ok=True)
+    tmp_path = f"{JDEPS_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, JDEPS_CACHE_FILE)
+
+
+# Hash a jar, reusing the cached digest when path, size and mtime are unchanged
+def _cached_jar_hash(cache: dict, jar: str) -> tuple[str, str]:
+    stat = os.stat(jar)
+    stat_key = f"{os.path.abspath(jar)}|{stat.st_size}|{stat.st_mtime_ns}"
+    digest = cache["hashes"].get(stat_key)
+    if digest is None:
+        digest = hash_file(jar)
+    return stat_key, digest
+
+
+# Run jdeps on one jar or class directory and return the JDK modules it needs
+def run_jdeps(jdk_path: str, path: str, feature_version: str) -> set[str]:
+    output = subprocess.check_output([
+        jdk_tool(jdk_path, "jdeps"),
+        "--print-module-deps",
+        "--ignore-missing-deps",
+        "--multi-release", feature_version,
+        "-q",
+        path
+    ], stderr=subprocess.STDOUT).decode()
+    lines = [line.strip() for line in output.strip().splitlines() if line.strip()]
+    if not lines:
+        return set()
+    return {module for module in lines[-1].split(',') if module}
+
+
+# Compute the JDK modules needed by the given jars and class directories.
+# jdeps results for jars are cached per JDK version and jar content hash;
+# class directories are always analysed again.
+# Returns None when jdeps fails, so the caller can fall back to all modules.
+def compute_required_modules(jdk_path: str, classpath_entries: list[str], extra_modules: list[str] | None = None) -> list[str] | None:
+    feature_version = jdk_feature_version(jdk_path)
+    cache = _load_jdeps_cache()
+    modules = {"java.base"}
+    modules.update(extra_modules or [])
+
+    to_analyse = {}
+    for entry in classpath_entries:
+        if os.path.isfile(entry):
+            stat_key, digest = _cached_jar_hash(cache, entry)
+            cache["hashes"][stat_key] = digest
+            cache_key = f"{feature_version}:{digest}"
+            if cache_key in cache["modules"]:
+                modules.update(cache["modules"][cache_key])
+            else:
+                to_analyse[entry] = cache_key
+        elif os.path.isdir(entry):
+            to_analyse[entry] = None
+
+    if to_analyse:
+        print(f"Running jdeps on {len(to_analyse)} classpath entries "
+              f"({len(classpath_entries) - len(to_analyse)} cached)...")
+    with ThreadPoolExecutor(max_workers=max(1, JDEPS_WORKERS)) as executor:
+        futures = {entry: executor.submit(run_jdeps, jdk_path, entry, feature_version) for entry in to_analyse}
+        failed = False
+        for entry, future in futures.items():
+            try:
+                entry_modules = future.result()
+            except (subprocess.CalledProcessError, OSError) as e:
+                output = getattr(e, 'output', b'') or b''
+                print(f"jdeps failed for {entry}: {output.decode(errors='replace').strip() or e}")
+                failed = True
+                continue
+            modules.update(entry_modules)
+            if to_analyse[entry] is not None:
+                cache["modules"][to_analyse[entry]] = sorted(entry_modules)
+
+    _save_jdeps_cache(cache)
+    if failed:
+        return None
+    return sorted(modules)
+
+
+# Decide which modules go into the custom JRE.
+# mode "all" keeps every module of the JDK, mode "jdeps" keeps only what jdeps finds plus extra_modules.
+def resolve_jre_modules(jdk_path: str, mode: str, classpath_entries: list[str], extra_modules: list[str] | None = None) -> list[str]:
+    if mode == "jdeps":
+        modules = compute_required_modules(jdk_path, classpath_entries, extra_modules)
+        if modules is not None:
+            available = set(list_jdk_modules(jdk_path))
+            unknown = [module for module in modules if module not in available]
+            if unknown:
+                print(f"Warning: ignoring modules not present in the JDK: {', '.join(unknown)}")
+            return [module for module in modules if module in available]
+        print("Falling back to all available modules.")
+    elif mode != "all":
+        print(f"Unknown JRE module mode '{mode}', using all available modules.")
+    return list_jdk_modules(jdk_path)
+
+
+# Cache key of a jlink runtime image: JDK identity, sorted module set and jlink options
+def jre_cache_key(jdk_path: str, modules: list[str], jlink_options: list[str]) -> str:
+    jdk_path = os.path.abspath(jdk_path)
+    java_base = os.path.join(jdk_path, "jmods", "java.base.jmod")
+    key_data = {
+        "jdk": jdk_path,
+        "release": read_jdk_release(jdk_path),
+        # Detects a JDK upgraded in place at the same path
+        "java_base_mtime": os.stat(java_base).st_mtime_ns if os.path.exists(java_base) else None,
+        "modules": sorted(set(modules)),
+        "options": list(jlink_options),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            total += os.path.getsize(os.path.join(dir_path, file_name))
+    return total
+
+
+# Hardlink every file of source_dir into target_dir, copying where linking is not possible.
+# Returns "hardlink", "copy" or "mixed".
+def place_tree(source_dir: str, target_dir: str) -> str:
+    methods = set()
+
+    def link_or_copy(src: str, dst: str) -> str:
+        try:
+            os.link(src, dst)
+            methods.add("hardlink")
+        except OSError:
+            methods.add(FILE_COPIER.copy(src, dst))
+        return dst
+
+    shutil.copytree(source_dir, target_dir, copy_function=link_or_copy)
+    return methods.pop() if len(methods) == 1 else "mixed" if methods else "copy"
+
+
+def run_jlink(jdk_path: str, modules: list[str], output_dir: str, jlink_options: list[str]) -> None:
+    subprocess.check_call([
+        jdk_tool(jdk_path, "jlink"),
+        "--module-path", os.path.join(jdk_path, "jmods"),
+        "--add-modules", ",".join(modules),
+        "--output", output_dir,
+        *jlink_options
+    ])
+
+
+# Remove least recently used runtime images until the cache fits JRE_CACHE_MAX_BYTES
+def evict_jre_cache(keep: str | None = None) -> None:
+    entries = []
+    for name in os.listdir(JRE_CACHE_DIR):
+        entry_dir = os.path.join(JRE_CACHE_DIR, name)
+        stamp = os.path.join(entry_dir, "last_used")
+        if not os.path.isfile(stamp):
+            continue
+        try:
+            with open(os.path.join(entry_dir, "size"), 'r') as f:
+                size = int(f.read().strip())
+        except (OSError, ValueError):
+            size = _tree_size(entry_dir)
+        entries.append((os.path.getmtime(stamp), name, size))
+
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= JRE_CACHE_MAX_BYTES:
+            break
+        if name == keep:
+            continue
+        print(f"Evicting cached JRE {name} ({size // (1024 * 1024)} MB)")
+        shutil.rmtree(os.path.join(JRE_CACHE_DIR, name), ignore_errors=True)
+        total -= size
+
+
+# Build a runtime image with jlink into output_dir, reusing a cached image when
+# the JDK, module set and jlink options are unchanged.
+# With archive, the image is added to the archive at output_dir instead of being placed there.
+def build_custom_jre(jdk_path: str, modules: list[str], output_dir: str, jlink_options: list[str] | None = None, archive: "PackageArchive | None" = None) -> None:
+    jlink_options = JLINK_OPTIONS if jlink_options is None else jlink_options
+
+    # Ensure output directory doesn't exist, delete if it exists
+    if archive is None and os.path.exists(output_dir):
+        print(f"Directory already exists, removing: {output_dir}")
+        shutil.rmtree(output_dir)
+
+    if JRE_CACHE_MAX_BYTES <= 0:
+        print(f"Generating custom JRE with {len(modules)} modules at: {output_dir}")
+        if archive is None:
+            run_jlink(jdk_path, modules, output_dir, jlink_options)
+        else:
+            image_dir = os.path.join(archive.temp_dir(), "runtime")
+            run_jlink(jdk_path, modules, image_dir, jlink_options)
+            archive.add_tree(image_dir, output_dir)
+        return
+
+    key = jre_cache_key(jdk_path, modules, jlink_options)
+    entry_dir = os.path.join(JRE_CACHE_DIR, key)
+    runtime_dir = os.path.join(entry_dir, "runtime")
+
+    if os.path.isdir(runtime_dir):
+        print(f"Reusing cached JRE {key} with {len(modules)} modules")
+    else:
+        print(f"Generating custom JRE with {len(modules)} modules (cache key {key})")
+        os.makedirs(JRE_CACHE_DIR, exist_ok=True)
+        staging_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        try:
+            run_jlink(jdk_path, modules, os.path.join(staging_dir, "runtime"), jlink_options)
+            with open(os.path.join(staging_dir, "size"), 'w') as f:
+                f.write(str(_tree_size(staging_dir)))
+            with open(os.path.join(staging_dir, "key.json"), 'w', encoding='utf-8') as f:
+                json.dump({"jdk": os.path.abspath(jdk_path), "modules": sorted(set(modules)),
+                           "options": list(jlink_options)}, f, indent=1)
+            try:
+                os.rename(staging_dir, entry_dir)
+            except OSError:
+                # Another packer stored the same image first
+                if not os.path.isdir(runtime_dir):
+                    raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    with open(os.path.join(entry_dir, "last_used"), 'w') as f:
+        f.write(str(time.time()))
+    if archive is None:
+        method = place_tree(runtime_dir, output_dir)
+        print(f"Custom JRE placed at {output_dir} ({method})")
+    else:
+        archive.add_tree(runtime_dir, output_dir)
+        print(f"Custom JRE added to the archive at {archive.name(output_dir)}")
+    evict_jre_cache(keep=key)
+
+
+# Compress one chunk as raw deflate, primed with the tail of the previous chunk (as pigz does).
+# Non-final chunks end with a sync flush on a byte boundary, so the chunks concatenate into one stream.
+def _deflate_chunk(data: bytes, dictionary: bytes, last: bool) -> bytes:
+    if dictionary:
+        compressor = zlib.compressobj(ARCHIVE_COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(ARCHIVE_COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _dos_date_time(timestamp: float) -> tuple[int, int]:
+    t = time.localtime(max(timestamp, 315532800))  # Zip cannot store dates before 1980
+    return ((t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+
+@dataclass
+class ZipEntry:
+    name: bytes
+    mode: int
+    mtime: float
+    zip64: bool
+    offset: int = 0
+    crc: int = 0
+    size: int = 0
+    compressed_size: int = 0
+    method: int = zlib.DEFLATED  # 8 deflate, 0 stored
+    flags: int = 0x0808  # Data descriptor follows the data, UTF-8 name
+
+
+# Local file header of an entry; with a data descriptor, CRC and sizes follow the data instead
+def zip_local_header(entry: ZipEntry) -> bytes:
+    date, dos_time = _dos_date_time(entry.mtime)
+    if entry.flags & 0x08:
+        crc = size = compressed_size = 0
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if entry.zip64 else b""
+    elif entry.zip64:
+        crc, size, compressed_size = entry.crc, 0xFFFFFFFF, 0xFFFFFFFF
+        extra = struct.pack('<HHQQ', 1, 16, entry.size, entry.compressed_size)
+    else:
+        crc, size, compressed_size = entry.crc, entry.size, entry.compressed_size
+        extra = b""
+    # Version 4.5 is needed for zip64
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if entry.zip64 else 20, entry.flags, entry.method,
+                       dos_time, date, crc, compressed_size, size, len(entry.name), len(extra)) + entry.name + extra
+
+
+def zip_data_descriptor(entry: ZipEntry) -> bytes:
+    if entry.zip64:
+        return struct.pack('<IIQQ', 0x08074b50, entry.crc, entry.compressed_size, entry.size)
+    return struct.pack('<IIII', 0x08074b50, entry.crc, entry.compressed_size, entry.size)
+
+
+# Write the central directory of entries, starting at offset of the file. Returns the bytes written.
+def write_zip_directory(f, entries: list[ZipEntry], offset: int) -> int:
+    directory_offset = offset
+    for entry in entries:
+        fields = []
+        size, compressed_size, entry_offset = entry.size, entry.compressed_size, entry.offset
+        if size >= 0xFFFFFFFF or compressed_size >= 0xFFFFFFFF:
+            fields += [size, compressed_size]
+            size = compressed_size = 0xFFFFFFFF
+        if entry_offset >= 0xFFFFFFFF:
+            fields.append(entry_offset)
+            entry_offset = 0xFFFFFFFF
+        extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b""
+        date, dos_time = _dos_date_time(entry.mtime)
+        version = 45 if entry.zip64 or fields else 20
+        file_type = 0o040000 if entry.name.endswith(b"/") else 0o100000
+        f.write(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | version, version, entry.flags, entry.method, dos_time, date,
+            entry.crc, compressed_size, size, len(entry.name), len(extra), 0, 0, 0,
+            (file_type | entry.mode) << 16, entry_offset) + entry.name + extra)
+        offset += 46 + len(entry.name) + len(extra)
+
+    directory_size = offset - directory_offset
+    count = len(entries)
+    if count >= 0xFFFF or directory_offset >= 0xFFFFFFFF or directory_size >= 0xFFFFFFFF:
+        zip64_end_offset = offset
+        f.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                            directory_size, directory_offset))
+        f.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        offset += 56 + 20
+        count = min(count, 0xFFFF)
+        directory_size = min(directory_size, 0xFFFFFFFF)
+        directory_offset = min(directory_offset, 0xFFFFFFFF)
+    f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, directory_size, directory_offset, 0))
+    return offset + 22 - directory_offset
+
+
+# Compressed data of the entry whose local header is at offset, as stored in the zip file
+def read_raw_zip_data(f, offset: int, compressed_size: int) -> bytes:
+    f.seek(offset)
+    header = f.read(30)
+    if len(header) < 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"No local file header at offset {offset}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(offset + 30 + name_length + extra_length)
+    data = f.read(compressed_size)
+    if len(data) != compressed_size:
+        raise zipfile.BadZipFile(f"Truncated entry at offset {offset}")
+    return data
+
+
+# File reader that hashes what is read, so archived files get their SHA-256 without a second pass
+class _HashingReader:
+    def __init__(self, f) -> None:
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+
+# tarfile writes the tar stream here; it is cut into chunks that are compressed in parallel
+class _TarSink:
+    def __init__(self, archive: "PackageArchive") -> None:
+        self.archive = archive
+
+    def write(self, data: bytes) -> int:
+        self.archive._write_tar_bytes(data)
+        return len(data)
+
+
+# Streams a package into a .zip or .tar.gz file, or to stdout, without staging it on disk.
+# Paths are given as they would be on disk; entries are named relative to root.
+# Every file is read once; its chunks are deflated on a thread pool and written in order,
+# with at most a few chunks per worker held in memory. zip entries use data descriptors,
+# so the output never needs to be seekable; tar.gz is a single gzip member and repeats of
+# an already added file (e.g. the same cached JRE in several apps) become hardlink entries.
+class PackageArchive:
+    def __init__(self, output: str, root: str, archive_format: str | None = None, workers: int | None = None) -> None:
+        if archive_format is None:
+            archive_format = "tar.gz" if output.endswith((".tar.gz", ".tgz")) else "zip"
+        if archive_format not in ("zip", "tar.gz"):
+            raise ValueError(f"Unsupported archive format: {archive_format}")
+        self.output = output
+        self.root = root
+        self.format = archive_format
+        self.files = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        workers = max(1, workers or os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._max_pending = 4 * workers
+        self._pending: deque = deque()  # (bytes | Future | callable, zip entry or None), in output order
+        self._lock = threading.RLock()
+        self._start = time.perf_counter()
+        self._sources: dict[str, str] = {}  # entry name -> source file
+        self.digests: dict[str, dict] = {}  # entry name -> {"size", "sha256"} of the uncompressed content
+        self._temp_dirs: list[str] = []
+
+        if output == "-":
+            self._tmp_path = None
+            # A duplicate of file descriptor 1, so the caller can point that at stderr while the archive streams
+            sys.stdout.flush()
+            self._file = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            self._tmp_path = f"{output}.{os.getpid()}.tmp"
+            self._file = open(self._tmp_path, 'wb')
+
+        if self.format == "zip":
+            self._entries: list[ZipEntry] = []
+        else:
+            self._inodes: dict[tuple[int, int], str] = {}
+            self._gzip_crc = 0
+            self._gzip_size = 0
+            self._tar_buffer = bytearray()
+            self._tar_dictionary = b""
+            # gzip header: deflate, no flags, no mtime, maximum compression hint off, OS unknown
+            self._pending.append((b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff", None))
+            self._tar = tarfile.open(fileobj=_TarSink(self), mode='w|', format=tarfile.PAX_FORMAT)
+
+    # Entry name of a path under root
+    def name(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace("\\", "/")
+
+    # Scratch directory that lives until the archive is closed
+    def temp_dir(self) -> str:
+        path = tempfile.mkdtemp(prefix="pack-archive-")
+        self._temp_dirs.append(path)
+        return path
+
+    def add_file(self, source: str, target: str, mode: int | None = None) -> None:
+        stat = os.stat(source)
+        name = self.name(target)
+        with self._lock:
+            self._sources[name] = source
+            self.files += 1
+            self.input_bytes += stat.st_size
+            mode = stat.st_mode & 0o7777 if mode is None else mode
+            if self.format == "zip":
+                with open(source, 'rb') as f:
+                    reader = _HashingReader(f)
+                    self._add_zip_entry(name, reader, stat.st_size, mode, stat.st_mtime)
+                self.digests[name] = {"size": stat.st_size, "sha256": reader.digest.hexdigest()}
+                return
+
+            info = tarfile.TarInfo(name)
+            info.mode = mode
+            info.mtime = int(stat.st_mtime)
+            inode = (stat.st_dev, stat.st_ino)
+            if inode in self._inodes:
+                info.type = tarfile.LNKTYPE
+                info.linkname = self._inodes[inode]
+                self._tar.addfile(info)
+                self.digests[name] = self.digests[info.linkname]
+                return
+            self._inodes[inode] = name
+            info.size = stat.st_size
+            with open(source, 'rb') as f:
+                reader = _HashingReader(f)
+                self._tar.addfile(info, reader)
+            self.digests[name] = {"size": stat.st_size, "sha256": reader.digest.hexdigest()}
+
+    def add_bytes(self, data: bytes, target: str, mode: int = 0o644) -> None:
+        name = self.name(target)
+        with self._lock:
+            self.files += 1
+            self.input_bytes += len(data)
+            self.digests[name] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+            if self.format == "zip":
+                self._add_zip_entry(name, io.BytesIO(data), len(data), mode, time.time())
+                return
+            info = tarfile.TarInfo(name)
+            info.mode = mode
+            info.mtime = int(time.time())
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+
+    # Add every file below source_dir, following symlinks
+    def add_tree(self, source_dir: str, target_dir: str) -> None:
+        for dir_path, dir_names, file_names in os.walk(source_dir, followlinks=True):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                source = os.path.join(dir_path, file_name)
+                self.add_file(source, os.path.join(target_dir, os.path.relpath(source, source_dir)))
+
+    # Add the files already added under existing_dir once more under target_dir
+    def add_copy(self, existing_dir: str, target_dir: str) -> None:
+        prefix = self.name(existing_dir) + "/"
+        with self._lock:
+            copies = [(source, name[len(prefix):]) for name, source in self._sources.items() if name.startswith(prefix)]
+        for source, relative_name in copies:
+            self.add_file(source, os.path.join(target_dir, relative_name))
+
+    def _add_zip_entry(self, name: str, f, size: int, mode: int, mtime: float) -> None:
+        entry = ZipEntry(name.encode('utf-8'), mode, mtime, zip64=size >= 0xFFFF0000)
+        self._entries.append(entry)
+        self._queue(zip_local_header(entry), entry)
+
+        dictionary = b""
+        chunk = f.read(ARCHIVE_CHUNK_BYTES)
+        while True:
+            next_chunk = f.read(ARCHIVE_CHUNK_BYTES) if chunk else b""
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.size += len(chunk)
+            last = not next_chunk
+            self._queue(self._executor.submit(_deflate_chunk, chunk, dictionary, last), entry)
+            if last:
+                break
+            dictionary = chunk[-32768:]
+            chunk = next_chunk
+
+        self._queue(lambda: zip_data_descriptor(entry), None)
+
+    def _write_tar_bytes(self, data: bytes) -> None:
+        self._tar_buffer += data
+        while len(self._tar_buffer) >= ARCHIVE_CHUNK_BYTES:
+            self._submit_gzip_chunk(bytes(self._tar_buffer[:ARCHIVE_CHUNK_BYTES]), last=False)
+            del self._tar_buffer[:ARCHIVE_CHUNK_BYTES]
+
+    def _submit_gzip_chunk(self, chunk: bytes, last: bool) -> None:
+        self._gzip_crc = zlib.crc32(chunk, self._gzip_crc)
+        self._gzip_size += len(chunk)
+        self._queue(self._executor.submit(_deflate_chunk, chunk, self._tar_dictionary, last), None)
+        self._tar_dictionary = chunk[-32768:]
+
+    def _queue(self, item: bytes | Future | Callable[[], bytes], entry: ZipEntry | None) -> None:
+        self._pending.append((item, entry))
+        self._drain(self._max_pending)
+
+    # Write queued items in order until at most limit are left, waiting for compression as needed
+    def _drain(self, limit: int) -> None:
+        while len(self._pending) > limit:
+            item, entry = self._pending.popleft()
+            if isinstance(item, Future):
+                data = item.result()
+                if entry is not None:
+                    entry.compressed_size += len(data)
+            elif callable(item):
+                data = item()
+            else:
+                data = item
+                if entry is not None:
+                    entry.offset = self.output_bytes  # Local header of the entry
+            self._file.write(data)
+            self.output_bytes += len(data)
+
+    # Finish the archive and move it into place
+    def close(self) -> None:
+        with self._lock:
+            if self.format == "zip":
+                self._drain(0)
+                self.output_bytes += write_zip_directory(self._file, self._entries, self.output_bytes)
+            else:
+                self._tar.close()
+                self._submit_gzip_chunk(bytes(self._tar_buffer), last=True)
+                self._queue(struct.pack('<II', self._gzip_crc, self._gzip_size & 0xFFFFFFFF), None)
+                self._drain(0)
+            self._file.flush()
+            self._finish()
+        if self._tmp_path is not None:
+            os.replace(self._tmp_path, self.output)
+        ratio = self.output_bytes / self.input_bytes if self.input_bytes else 1
+        print(f"Archive {'written to stdout' if self.output == '-' else f'written: {self.output}'} "
+              f"({self.files} files, {format_bytes(self.input_bytes)} -> {format_bytes(self.output_bytes)}, "
+              f"{ratio:.0%}) in {time.perf_counter() - self._start:.2f}s",
+              file=sys.stderr if self.output == "-" else sys.stdout)
+
+    # Stop after a failure, removing the partial archive
+    def abort(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._finish()
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def _finish(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._file.close()
+        for path in self._temp_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# Main section of a jar manifest; lines are wrapped at 72 bytes as the jar specification requires
+def jar_manifest(attributes: dict[str, str]) -> bytes:
+    manifest = bytearray()
+    for line in ["Manifest-Version: 1.0", "Created-By: packJavaProgram", *(f"{key}: {value}" for key, value in attributes.items())]:
+        data = line.encode('utf-8')
+        manifest += data[:72] + b"\r\n"
+        for start in range(72, len(data), 71):
+            manifest += b" " + data[start:start + 71] + b"\r\n"
+    return bytes(manifest + b"\r\n")
+
+
+# Main section of a jar manifest as {name: value}, with continuation lines joined; jar_manifest
+# writes Manifest-Version and Created-By itself, so they are left out
+def read_manifest_attributes(manifest: bytes) -> dict[str, str]:
+    attributes = {}
+    name = None
+    for line in manifest.decode('utf-8', errors='replace').splitlines():
+        if not line:
+            break
+        if line.startswith(" ") and name is not None:
+            attributes[name] += line[1:]
+        elif ":" in line:
+            name, value = line.split(":", 1)
+            attributes[name.strip()] = value.strip()
+    return {name: value for name, value in attributes.items() if name.lower() not in ("manifest-version", "created-by")}
+
+
+# Shade-style patterns: * matches within one path segment
+_JAR_EXCLUDES = [re.compile(re.escape(pattern).replace(r"\*", "[^/]*")) for pattern in JAR_MERGE_EXCLUDES]
+_MULTI_RELEASE = re.compile(rb"^Multi-Release:\s*true\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+@dataclass
+class JarMergeStats:
+    entries: int = 0
+    duplicates: int = 0  # Entries hidden by the same name in an earlier input
+    copied: int = 0  # Entries copied from input jars without recompression
+    compressed: int = 0  # Entries compressed from input directories or merged service files
+    reused: int = 0  # Entries taken over from the previous output
+    written: bool = True  # False when the previous output was still up to date
+
+
+# Entry name of a zip member; names without the UTF-8 flag are decoded as cp437 by zipfile,
+# but jar tools write UTF-8 either way
+def _zip_info_name(info: zipfile.ZipInfo) -> str:
+    if info.flag_bits & 0x800:
+        return info.filename
+    return info.filename.encode('cp437').decode('utf-8', 'replace')
+
+
+# Entries of a jar (name -> ZipInfo) or a class directory (name -> file path), in order,
+# and the input's manifest, or None
+def _list_merge_input(path: str) -> tuple[list[tuple[str, zipfile.ZipInfo | str]], bytes | None]:
+    if os.path.isdir(path):
+        items = []
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            relative = os.path.relpath(dir_path, path).replace("\\", "/")
+            prefix = "" if relative == "." else relative + "/"
+            if prefix:
+                items.append((prefix, dir_path))
+            items += [(prefix + file_name, os.path.join(dir_path, file_name)) for file_name in sorted(file_names)]
+        manifest_path = os.path.join(path, "META-INF", "MANIFEST.MF")
+        if not os.path.isfile(manifest_path):
+            return items, None
+        with open(manifest_path, 'rb') as f:
+            return items, f.read()
+    with zipfile.ZipFile(path) as jar:
+        items = [(_zip_info_name(info), info) for info in jar.infolist()]
+        manifest = next((info for name, info in items if name == "META-INF/MANIFEST.MF"), None)
+        return items, jar.read(manifest) if manifest is not None else None
+
+
+def _deflate_entry(name: str, data: bytes, mtime: float, mode: int = 0o644) -> tuple[ZipEntry, bytes]:
+    if name.endswith("/"):
+        return ZipEntry(name.encode('utf-8'), 0o755, mtime, zip64=False, method=0, flags=0x0800), b""
+    compressor = zlib.compressobj(ARCHIVE_COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    entry = ZipEntry(name.encode('utf-8'), mode, mtime, zip64=len(data) >= 0xFFFFFFFF or len(compressed) >= 0xFFFFFFFF,
+                     crc=zlib.crc32(data), size=len(data), compressed_size=len(compressed), flags=0x0800)
+    return entry, compressed
+
+
+def _compress_files(files: list[tuple[str, str]]) -> list[tuple[ZipEntry, bytes]]:
+    results = []
+    for name, path in files:
+        stat = os.stat(path)
+        if name.endswith("/"):
+            results.append(_deflate_entry(name, b"", stat.st_mtime))
+            continue
+        with open(path, 'rb') as f:
+            results.append(_deflate_entry(name, f.read(), stat.st_mtime, stat.st_mode & 0o777))
+    return results
+
+
+# Compressed data of jar members, read as is
+def _read_jar_entries(jar_path: str, members: list[tuple[str, zipfile.ZipInfo]]) -> list[tuple[ZipEntry, bytes]]:
+    results = []
+    with open(jar_path, 'rb') as f:
+        for name, info in members:
+            data = read_raw_zip_data(f, info.header_offset, info.compress_size)
+            mode = (info.external_attr >> 16) & 0o777 or (0o755 if name.endswith("/") else 0o644)
+            entry = ZipEntry(name.encode('utf-8'), mode, time.mktime(info.date_time + (0, 0, -1)),
+                             zip64=info.file_size >= 0xFFFFFFFF or info.compress_size >= 0xFFFFFFFF,
+                             crc=info.CRC, size=info.file_size, compressed_size=info.compress_size,
+                             method=info.compress_type, flags=0x0800)
+            results.append((entry, data))
+    return results
+
+
+# Entries of the previous output, with their compressed data
+def _read_previous_entries(output: str, entries: list[ZipEntry]) -> list[tuple[ZipEntry, bytes]]:
+    with open(output, 'rb') as f:
+        return [(ZipEntry(**{**asdict(entry), "offset": 0}), read_raw_zip_data(f, entry.offset, entry.compressed_size))
+                for entry in entries]
+
+
+def _load_merge_state(state_file: str | None, output: str) -> dict | None:
+    if state_file is None:
+        return None
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        stat = os.stat(output)
+    except (OSError, ValueError):
+        return None
+    # The recorded offsets are only valid for exactly the output that was written
+    if state.get("output") != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    state["entries"] = [ZipEntry(**{**entry, "name": entry["name"].encode('utf-8')}) for entry in state["entries"]]
+    return state
+
+
+# Merge class directories and jars into one jar, the way the shade plugin does: the first input
+# with an entry name wins, signature files and the inputs' manifests are dropped, and a new
+# manifest with attributes is written, declaring Multi-Release when an input jar does. With
+# keep_first_manifest, the main attributes of the first input's manifest are kept, and attributes
+# override them. With merge_services, META-INF/services files found in several inputs are
+# concatenated instead. Members of input jars are copied without recompression; files of input
+# directories are compressed on a thread pool.
+# The output is laid out as manifest, jar members, directory files. With a state_file, a rebuild
+# keeps the previous output up to the end of the jar members when no jar changed, and takes
+# unchanged directory files over from it, so only changed entries are compressed and written.
+def merge_jars(inputs: list[str], output: str, attributes: dict[str, str], merge_services: bool = False,
+               state_file: str | None = None, workers: int | None = None, keep_first_manifest: bool = False) -> JarMergeStats:
+    stats = JarMergeStats()
+    workers = max(1, workers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = list(executor.map(_list_merge_input, inputs))
+
+        selected: dict[str, tuple[int, zipfile.ZipInfo | str]] = {}
+        services: dict[str, list[tuple[int, zipfile.ZipInfo | str]]] = {}
+        for index, (items, input_manifest) in enumerate(listings):
+            multi_release = input_manifest is not None and bool(_MULTI_RELEASE.search(input_manifest))
+            for name, item in items:
+                if name in ("META-INF/", "META-INF/MANIFEST.MF") or any(p.fullmatch(name) for p in _JAR_EXCLUDES):
+                    continue
+                if name.startswith("META-INF/versions/"):
+                    # Versioned entries of a jar that is not multi-release are inert, and a versioned entry
+                    # never overrides the base entry of an earlier input on the original classpath
+                    base_name = name.split("/", 3)[3] if name.count("/") >= 3 else ""
+                    if (not multi_release and not isinstance(item, str)) or (base_name in selected and selected[base_name][0] < index):
+                        continue
+                if merge_services and name.startswith("META-INF/services/") and not name.endswith("/"):
+                    services.setdefault(name, []).append((index, item))
+                elif name in selected:
+                    stats.duplicates += 1
+                else:
+                    selected[name] = (index, item)
+        first_manifest = listings[0][1] if keep_first_manifest and listings else None
+        kept = read_manifest_attributes(first_manifest) if first_manifest is not None else {}
+        overridden = {name.lower() for name in attributes}
+        attributes = {**{name: value for name, value in kept.items() if name.lower() not in overridden}, **attributes}
+        if any(input_manifest is not None and _MULTI_RELEASE.search(input_manifest) for _, input_manifest in listings):
+            attributes.setdefault("Multi-Release", "true")
+        manifest = jar_manifest(attributes)
+
+        jar_members: dict[int, list[tuple[str, zipfile.ZipInfo]]] = {}
+        files: list[tuple[str, str]] = []
+        for name, (index, item) in selected.items():
+            if isinstance(item, str):
+                files.append((name, item))
+            else:
+                jar_members.setdefault(index, []).append((name, item))
+
+        generated: list[tuple[str, bytes]] = []
+        for name, sources in services.items():
+            content = bytearray()
+            for index, item in sources:
+                if isinstance(item, str):
+                    with open(item, 'rb') as f:
+                        data = f.read()
+                else:
+                    with zipfile.ZipFile(inputs[index]) as jar:
+                        data = jar.read(item)
+                content += data if not content or content.endswith(b"\n") or not data else b"\n" + data
+            generated.append((name, bytes(content)))
+
+        prefix_digest = hashlib.sha256(manifest)
+        for index in sorted(jar_members):
+            stat = os.stat(inputs[index])
+            prefix_digest.update(f"{os.path.abspath(inputs[index])}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+            for name, _ in jar_members[index]:
+                prefix_digest.update(name.encode('utf-8') + b"\n")
+        prefix_key = prefix_digest.hexdigest()
+
+        state = _load_merge_state(state_file, output)
+        reuse_prefix = state is not None and state["prefix_key"] == prefix_key
+        previous = {entry.name.decode('utf-8'): entry for entry in state["entries"]} if state is not None else {}
+
+        # Tail entries: (name, previous entry to take over or None, file path or generated content)
+        tail = []
+        file_stats = {}
+        for name, path in files:
+            stat = os.stat(path)
+            file_stats[name] = [stat.st_size, stat.st_mtime_ns]
+            unchanged = state is not None and state["files"].get(name) == file_stats[name]
+            tail.append((name, previous.get(name) if unchanged else None, path))
+        for name, content in generated:
+            entry = previous.get(name)
+            unchanged = entry is not None and entry.crc == zlib.crc32(content) and entry.size == len(content)
+            tail.append((name, entry if unchanged else None, content))
+
+        previous_tail = [entry.name.decode('utf-8') for entry in state["entries"][state["prefix_count"]:]] if state else None
+        if reuse_prefix and previous_tail == [name for name, _, _ in tail] and all(entry for _, entry, _ in tail):
+            stats.entries = len(state["entries"])
+            stats.reused = stats.entries
+            stats.written = False
+            return stats
+
+        tmp_path = f"{output}.{os.getpid()}.tmp"
+        entries: list[ZipEntry] = []
+        pending: deque[Future] = deque()
+        try:
+            if reuse_prefix:
+                FILE_COPIER.copy(output, tmp_path)
+                f = open(tmp_path, 'r+b')
+                f.truncate(state["prefix_bytes"])
+                f.seek(state["prefix_bytes"])
+                entries += state["entries"][:state["prefix_count"]]
+                stats.reused += len(entries)
+            else:
+                f = open(tmp_path, 'wb')
+            with f:
+                position = f.tell()
+
+                def write_results(results: list[tuple[ZipEntry, bytes]]) -> None:
+                    nonlocal position
+                    for entry, data in results:
+                        entry.offset = position
+                        header = zip_local_header(entry)
+                        f.write(header)
+                        f.write(data)
+                        position += len(header) + len(data)
+                        entries.append(entry)
+
+                def submit(function, *args) -> None:
+                    pending.append(executor.submit(function, *args))
+                    while len(pending) > 4 * workers:
+                        write_results(pending.popleft().result())
+
+                def flush() -> None:
+                    while pending:
+                        write_results(pending.popleft().result())
+
+                if not reuse_prefix:
+                    write_results([_deflate_entry("META-INF/", b"", time.time()),
+                                   _deflate_entry("META-INF/MANIFEST.MF", manifest, time.time())])
+                    for index in sorted(jar_members):
+                        batch, batch_bytes = [], 0
+                        for name, info in jar_members[index]:
+                            batch.append((name, info))
+                            batch_bytes += info.compress_size
+                            if batch_bytes >= ARCHIVE_CHUNK_BYTES or len(batch) >= 256:
+                                submit(_read_jar_entries, inputs[index], batch)
+                                batch, batch_bytes = [], 0
+                        if batch:
+                            submit(_read_jar_entries, inputs[index], batch)
+                        stats.copied += len(jar_members[index])
+                    flush()
+                prefix_bytes, prefix_count = position, len(entries)
+
+                batch_kind, batch = None, []
+                for name, entry, source in tail:
+                    kind = "reuse" if entry is not None else "file" if isinstance(source, str) else "generated"
+                    if batch and (kind != batch_kind or len(batch) >= 64):
+                        submit(*_merge_task(batch_kind, batch, output))
+                        batch = []
+                    batch_kind = kind
+                    batch.append(entry if kind == "reuse" else (name, source))
+                    if kind == "reuse":
+                        stats.reused += 1
+                    else:
+                        stats.compressed += 1
+                if batch:
+                    submit(*_merge_task(batch_kind, batch, output))
+                flush()
+                write_zip_directory(f, entries, position)
+            os.replace(tmp_path, output)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    stats.entries = len(entries)
+    if state_file is not None:
+        stat = os.stat(output)
+        new_state = {
+            "output": [stat.st_size, stat.st_mtime_ns],
+            "prefix_key": prefix_key,
+            "prefix_bytes": prefix_bytes,
+            "prefix_count": prefix_count,
+            "files": file_stats,
+            "entries": [{**asdict(entry), "name": entry.name.decode('utf-8')} for entry in entries],
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+        tmp_state = f"{state_file}.{os.getpid()}.tmp"
+        with open(tmp_state, 'w', encoding='utf-8') as f:
+            json.dump(new_state, f)
+        os.replace(tmp_state, state_file)
+    return stats
+
+
+def _merge_task(kind: str, batch: list, output: str) -> tuple:
+    if kind == "reuse":
+        return _read_previous_entries, output, batch
+    if kind == "file":
+        return _compress_files, batch
+    return lambda items: [_deflate_entry(name, content, time.time()) for name, content in items], batch
+
+
+@dataclass
+class StageProfile:
+    name: str
+    start_offset_seconds: float
+    wall_seconds: float
+    child_cpu_seconds: float | None
+    files_written: int
+    bytes_written: int
+    peak_rss_bytes: int | None
+    children_peak_rss_bytes: int | None
+
+
+def _child_cpu_seconds() -> float | None:
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+# Peak RSS of this process and of its largest reaped child so far, in bytes
+def _peak_rss() -> tuple[int | None, int | None]:
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        scale = 1 if platform.system() == 'Darwin' else 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+    try:
+        import psutil
+    except ImportError:
+        return None, None
+    return getattr(psutil.Process().memory_info(), 'peak_wset', None), None
+
+
+# Files under paths created or modified since a point in time, as (count, bytes)
+def _written_since(paths: list[str], since: float) -> tuple[int, int]:
+    files = 0
+    total_bytes = 0
+
+    def count(file_path: str) -> None:
+        nonlocal files, total_bytes
+        stat = os.stat(file_path)
+        # ctime also catches hardlinks and renames, which keep the mtime of their source
+        if max(stat.st_mtime, stat.st_ctime) >= since:
+            files += 1
+            total_bytes += stat.st_size
+
+    for path in paths:
+        if os.path.isfile(path):
+            count(path)
+        elif os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    try:
+                        count(os.path.join(dir_path, file_name))
+                    except OSError:
+                        pass
+    return files, total_bytes
+
+
+# Records wall time, child process CPU time, files and bytes written and peak RSS per stage.
+# Child CPU time is process-wide, so it is shared between stages that overlap in time.
+class StageProfiler:
+    def __init__(self) -> None:
+        self.enabled = bool(os.environ.get(PROFILE_ENV_VAR))
+        self.stages: list[StageProfile] = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, output_paths: list[str] | tuple[str, ...] = ()) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        start_time = time.time() - 0.05  # File timestamps come from a coarser kernel clock
+        cpu_before = _child_cpu_seconds()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu_after = _child_cpu_seconds()
+            files, written = _written_since(list(output_paths), start_time)
+            peak_rss, children_peak_rss = _peak_rss()
+            profile = StageProfile(
+                name=name,
+                start_offset_seconds=round(start - self._start, 3),
+                wall_seconds=round(wall, 3),
+                child_cpu_seconds=round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+                files_written=files,
+                bytes_written=written,
+                peak_rss_bytes=peak_rss,
+                children_peak_rss_bytes=children_peak_rss,
+            )
+            with self._lock:
+                self.stages.append(profile)
+
+    # Print a summary table and write the JSON report.
+    # The report goes to the path in PACK_PROFILE, or to default_path when it is just a flag.
+    def finish(self, script: str, default_path: str) -> None:
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self._start
+        print(f"\n{'Stage':<32} {'Wall':>8} {'Child CPU':>10} {'Files':>8} {'Written':>10} {'Peak RSS':>10}")
+        for stage in self.stages:
+            cpu = f"{stage.child_cpu_seconds:.2f}s" if stage.child_cpu_seconds is not None else "n/a"
+            rss = format_bytes(max(stage.peak_rss_bytes or 0, stage.children_peak_rss_bytes or 0))
+            print(f"{stage.name:<32} {stage.wall_seconds:>7.2f}s {cpu:>10} {stage.files_written:>8} "
+                  f"{format_bytes(stage.bytes_written):>10} {rss:>10}")
+        print(f"{'total':<32} {total:>7.2f}s")
+
+        env_value = os.environ.get(PROFILE_ENV_VAR, "")
+        report_path = env_value if env_value and env_value.lower() not in ("1", "true", "yes", "on") else default_path
+        report = {
+            "script": script,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "total_wall_seconds": round(total, 3),
+            "stages": [asdict(stage) for stage in self.stages],
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Profile report written to: {report_path}")
+
+
+PROFILER = StageProfiler()  # Shared by all stages of one packer run
@@ -1,7 +1,13 @@
 import os
+import re
 import xml.etree.ElementTree as ET
 import subprocess
-import shutil
+import hashlib
+import io
+from dataclasses import dataclass
+from functools import lru_cache
+
+from packCommon import PROFILER, copy_file, merge_jars, read_manifest_attributes, resolve_jre_modules, build_custom_jre
 
 # Configuration variables
 PROJECT_DIR = r"d:\codes\myProject"  # Root directory of the Maven project
@@ -9,10 +15,42 @@ OUTPUT_DIR = r"D:\tmp\pack"  # Output directory for generated files
 MAIN_CLASS = "base.SimpleStarter"  # Main class of the project
 NEW_POM_FILE = os.path.join(PROJECT_DIR, "pom_executable.xml")  # Path for the newly generated POM file
 JDK_PATH = r"d:\software\dev\jdk22"  # Path to JDK 22
+JAR_FILE_NAME = None  # Shaded jar produced in target/; None reads it from the POM (build finalName, or artifactId-version.jar)
+PROGRAM_ARGS = r"tcs-config\tcs-room1.conf tcs-config\tcs-global.conf mockUcs"  # Program arguments passed by run.bat
+JRE_MODULES_MODE = "all"  # "all": every JDK module, "jdeps": only the modules the shaded jar needs
+EXTRA_JRE_MODULES = []  # Modules jdeps cannot see, e.g. used via reflection or ServiceLoader
+MAVEN_EXECUTABLE = r"mvn.cmd"  # Maven launcher
+BUILD_FINGERPRINT_FILE = os.path.join(PROJECT_DIR, "target", ".pack-build-fingerprint")  # Fingerprint of the last successful build
+FINGERPRINT_EXCLUDED_DIRS = {"target", ".git", ".idea", ".svn", ".vscode"}  # Not part of the source tree fingerprint
+FAT_JAR_BUILDER = "shade"  # "shade": maven-shade-plugin builds the jar, "native": Maven only compiles and resolves dependencies, the packer merges the jar
+MERGE_SERVICE_FILES = False  # Native builder: concatenate META-INF/services files of all jars; False keeps the first one, like the shade config
+FAT_JAR_WORKERS = os.cpu_count() or 4  # Threads copying and compressing entries of the native fat jar
+CLASSPATH_FILE = os.path.join(PROJECT_DIR, "target", "pack-classpath.txt")  # Runtime classpath written by Maven for the native builder
+FAT_JAR_STATE_FILE = os.path.join(PROJECT_DIR, "target", ".pack-fat-jar.json")  # Entry layout of the last native fat jar, for incremental rebuilds
+REACTOR_MODULES = False  # Package every module of the PROJECT_DIR reactor that has a main class, each into OUTPUT_DIR/<artifactId>, sharing one custom JRE
+MAVEN_THREADS = "1C"  # Reactor builds: Maven -T value, modules that do not depend on each other build in parallel
+MODULE_MAIN_CLASSES = {}  # Reactor builds: main class per module artifactId, for modules whose POM names none
+MODULE_PROGRAM_ARGS = {}  # Reactor builds: program arguments per module artifactId
+PROFILE_STAGES = False  # Write a per-stage timing and I/O report to OUTPUT_DIR/pack-profile.json (or set PACK_PROFILE=1)
+
+POM_NAMESPACE = {"mvn": "http://maven.apache.org/POM/4.0.0"}
+MAIN_CLASS_PROPERTIES = ("start-class", "exec.mainClass", "main.class", "mainClass")  # Properties that name the main class by convention
+
+# A module of the Maven project, as far as packaging needs it
+@dataclass
+class MavenModule:
+    directory: str
+    artifact_id: str
+    packaging: str
+    jar_file_name: str  # Jar the module builds in target/
+    main_class: str | None
+    modules: list[str]  # <module> entries, for aggregators
+    root: ET.Element
+    tree: ET.ElementTree
 
 # Read and parse the existing POM file
-def read_existing_pom():
-    pom_path = os.path.join(PROJECT_DIR, "pom.xml")
+def read_existing_pom(directory):
+    pom_path = os.path.join(directory, "pom.xml")
     if not os.path.exists(pom_path):
         print(f"Error: pom.xml not found at {pom_path}")
         exit(1)
@@ -20,10 +58,193 @@ def read_existing_pom():
     root = tree.getroot()
     return root, tree
 
+# Text of a POM element, or None when it is missing or empty
+def pom_text(element, path):
+    node = element.find(path, POM_NAMESPACE) if element is not None else None
+    return node.text.strip() if node is not None and node.text and node.text.strip() else None
+
+# Replace ${name} references, repeatedly for properties that reference other properties
+def resolve_pom_properties(text, properties):
+    for _ in range(10):
+        resolved = re.sub(r"\$\{([^}]+)\}", lambda match: properties.get(match.group(1), match.group(0)), text)
+        if resolved == text:
+            break
+        text = resolved
+    return text
+
+# Properties a POM sees: those of its parent chain (as far as the parent POMs are on disk), its own
+# <properties>, project.groupId/artifactId/version and the unresolved build finalName
+@lru_cache(maxsize=None)
+def pom_properties(pom_path):
+    root = ET.parse(pom_path).getroot()
+    properties = {"project.build.finalName": "${project.artifactId}-${project.version}"}
+    parent = root.find("mvn:parent", POM_NAMESPACE)
+    if parent is not None:
+        relative_path = parent.find("mvn:relativePath", POM_NAMESPACE)
+        # An empty <relativePath/> means the parent is only looked up in repositories
+        parent_pom = os.path.join(os.path.dirname(pom_path), "../pom.xml" if relative_path is None else relative_path.text or "")
+        if os.path.isdir(parent_pom):
+            parent_pom = os.path.join(parent_pom, "pom.xml")
+        if (relative_path is None or relative_path.text) and os.path.isfile(parent_pom):
+            properties.update(pom_properties(os.path.normpath(parent_pom)))
+        properties.update({"project.parent.groupId": pom_text(parent, "mvn:groupId"),
+                           "project.parent.version": pom_text(parent, "mvn:version")})
+    own_properties = root.find("mvn:properties", POM_NAMESPACE)
+    for node in own_properties if own_properties is not None else []:
+        properties[node.tag.split("}")[-1]] = (node.text or "").strip()
+    properties.update({
+        "project.groupId": pom_text(root, "mvn:groupId") or pom_text(parent, "mvn:groupId"),
+        "project.artifactId": pom_text(root, "mvn:artifactId"),
+        "project.version": pom_text(root, "mvn:version") or pom_text(parent, "mvn:version"),
+    })
+    properties["project.build.finalName"] = pom_text(root, "mvn:build/mvn:finalName") or properties["project.build.finalName"]
+    return {name: value for name, value in properties.items() if value is not None}
+
+# Manifest attributes the project jar would get from the POM: the <archive> configuration of the jar
+# plugin (manifestFile, manifestEntries, addDefaultImplementationEntries) and the manifestEntries of
+# a shade ManifestResourceTransformer. Without a package phase the native builder has no project jar
+# to take them from.
+def pom_manifest_attributes(module):
+    properties = pom_properties(os.path.normpath(os.path.join(module.directory, "pom.xml")))
+    build = module.root.find("mvn:build", POM_NAMESPACE)
+    attributes = {}
+    for archive in build.iterfind(".//mvn:archive", POM_NAMESPACE) if build is not None else []:
+        manifest_file = pom_text(archive, "mvn:manifestFile")
+        if manifest_file:
+            manifest_path = os.path.join(module.directory, resolve_pom_properties(manifest_file, properties))
+            if os.path.isfile(manifest_path):
+                with open(manifest_path, "rb") as f:
+                    attributes.update(read_manifest_attributes(f.read()))
+        if pom_text(archive, "mvn:manifest/mvn:addDefaultImplementationEntries") == "true":
+            attributes["Implementation-Title"] = pom_text(module.root, "mvn:name") or properties["project.artifactId"]
+            attributes["Implementation-Version"] = properties.get("project.version", "")
+            vendor = pom_text(module.root, "mvn:organization/mvn:name")
+            if vendor:
+                attributes["Implementation-Vendor"] = vendor
+        for entries in archive.iterfind("mvn:manifestEntries", POM_NAMESPACE):
+            attributes.update({node.tag.split("}")[-1]: (node.text or "").strip() for node in entries})
+    for entries in build.iterfind(".//mvn:transformer/mvn:manifestEntries", POM_NAMESPACE) if build is not None else []:
+        attributes.update({node.tag.split("}")[-1]: (node.text or "").strip() for node in entries})
+    return {name: resolve_pom_properties(value, properties) for name, value in attributes.items()
+            if value and name != "Main-Class"}
+
+# Main class a module's own POM names: a conventional property like start-class, or the
+# mainClass / Main-Class configuration of a plugin (jar, shade, spring-boot, exec, assembly)
+def pom_main_class(root, properties):
+    own_properties = root.find("mvn:properties", POM_NAMESPACE)
+    own = {node.tag.split("}")[-1]: node.text for node in (own_properties if own_properties is not None else [])}
+    candidates = [own.get(name) for name in MAIN_CLASS_PROPERTIES]
+    build = root.find("mvn:build", POM_NAMESPACE)
+    if build is not None:
+        candidates += [node.text for node in build.iterfind(".//mvn:mainClass", POM_NAMESPACE)]
+        candidates += [node.text for node in build.iterfind(".//mvn:Main-Class", POM_NAMESPACE)]
+    for candidate in candidates:
+        value = resolve_pom_properties(candidate.strip(), properties) if candidate else ""
+        if value and "${" not in value:
+            return value
+    return None
+
+# Read the module in directory, with its artifact and jar name resolved from the POM
+def read_maven_module(directory):
+    root, tree = read_existing_pom(directory)
+    properties = pom_properties(os.path.normpath(os.path.join(directory, "pom.xml")))
+    artifact_id = properties["project.artifactId"]
+    return MavenModule(
+        directory=directory,
+        artifact_id=artifact_id,
+        packaging=pom_text(root, "mvn:packaging") or "jar",
+        jar_file_name=resolve_pom_properties(properties["project.build.finalName"], properties) + ".jar",
+        main_class=MODULE_MAIN_CLASSES.get(artifact_id) or pom_main_class(root, properties),
+        modules=[node.text.strip() for node in root.iterfind("mvn:modules/mvn:module", POM_NAMESPACE) if node.text],
+        root=root,
+        tree=tree,
+    )
+
+# Directory of a <module> entry, which may name the directory or a POM file in it
+def module_directory(directory, entry):
+    path = os.path.normpath(os.path.join(directory, entry))
+    return os.path.dirname(path) if os.path.isfile(path) else path
+
+# All modules of the reactor in directory, depth first in POM order
+def discover_reactor_modules(directory):
+    module = read_maven_module(directory)
+    modules = [module]
+    for entry in module.modules:
+        modules += discover_reactor_modules(module_directory(directory, entry))
+    return modules
+
+# Modules to package: with REACTOR_MODULES every jar module of the reactor that has a main class,
+# otherwise the project itself with MAIN_CLASS (and JAR_FILE_NAME, when set)
+def modules_to_package(reactor):
+    if not REACTOR_MODULES:
+        module = reactor[0]
+        module.main_class = MAIN_CLASS
+        module.jar_file_name = JAR_FILE_NAME or module.jar_file_name
+        return [module]
+    runnable = [module for module in reactor if module.packaging == "jar" and module.main_class]
+    if not runnable:
+        print(f"Error: no module of {PROJECT_DIR} names a main class; set MODULE_MAIN_CLASSES")
+        exit(1)
+    for module in runnable:
+        print(f"Module {module.artifact_id}: {module.main_class} ({module.jar_file_name})")
+        if "${" in module.jar_file_name:
+            print(f"Warning: {module.artifact_id} uses properties of a parent POM that is not on disk, its jar name is unresolved")
+    return runnable
+
+# Per-module locations: the project's own in single-project mode, below each module otherwise
+def module_jar(module):
+    return os.path.join(module.directory, "target", module.jar_file_name)
+
+def module_classpath_file(module):
+    return os.path.join(module.directory, "target", os.path.basename(CLASSPATH_FILE)) if REACTOR_MODULES else CLASSPATH_FILE
+
+def module_fat_jar_state_file(module):
+    return os.path.join(module.directory, "target", os.path.basename(FAT_JAR_STATE_FILE)) if REACTOR_MODULES else FAT_JAR_STATE_FILE
+
+def module_output_dir(module):
+    return os.path.join(OUTPUT_DIR, module.artifact_id) if REACTOR_MODULES else OUTPUT_DIR
+
+# Write a POM, only when its content changed; returns the content
+def write_pom(tree, pom_file):
+    ET.register_namespace('', POM_NAMESPACE["mvn"])
+    buffer = io.BytesIO()
+    tree.write(buffer, xml_declaration=True, encoding="utf-8")
+    content = buffer.getvalue()
+    if os.path.exists(pom_file):
+        with open(pom_file, "rb") as f:
+            if f.read() == content:
+                print(f"POM file is up to date: {pom_file}")
+                return content
+    with open(pom_file, "wb") as f:
+        f.write(content)
+    print(f"New POM file generated at: {pom_file}")
+    return content
+
+# Shade builds of a reactor: write pom_executable.xml with the shade plugin for every module to package,
+# and for every aggregator above one, with its <modules> pointing at the generated POMs, so one
+# Maven invocation of the root's generated POM builds them all. Returns the content of the generated
+# POMs below directory, empty when it needs none.
+def generate_reactor_poms(modules_by_directory, directory, packaged):
+    module = modules_by_directory[directory]
+    pom_name = os.path.basename(NEW_POM_FILE)
+    if module in packaged:
+        return generate_new_pom(module.root, module.tree, module.main_class, os.path.join(directory, pom_name))
+    contents = b""
+    for node in module.root.iterfind("mvn:modules/mvn:module", POM_NAMESPACE):
+        child_directory = module_directory(directory, node.text.strip())
+        child_contents = generate_reactor_poms(modules_by_directory, child_directory, packaged)
+        if child_contents:
+            contents += child_contents
+            node.text = os.path.relpath(os.path.join(child_directory, pom_name), directory).replace(os.sep, "/")
+    if not contents:
+        return b""
+    return write_pom(module.tree, os.path.join(directory, pom_name)) + contents
+
 # 生成一个新的POM文件，加入打包插件配置
-def generate_new_pom(root, tree):
-    namespace = {"mvn": "http://maven.apache.org/POM/4.0.0"}
-    ET.register_namespace('', "http://maven.apache.org/POM/4.0.0")
+def generate_new_pom(root, tree, main_class=None, new_pom_file=None):
+    namespace = POM_NAMESPACE
+    main_class = main_class or MAIN_CLASS
+    new_pom_file = new_pom_file or NEW_POM_FILE
 
     # Find the <build> node, create it if not exists
     build_node = root.find("mvn:build", namespace)
@@ -60,7 +281,7 @@ def generate_new_pom(root, tree):
         
         manifest_entries_node = ET.SubElement(transformer_node, "manifestEntries")
         main_class_node = ET.SubElement(manifest_entries_node, "Main-Class")
-        main_class_node.text = MAIN_CLASS
+        main_class_node.text = main_class
         
         multi_release_node = ET.SubElement(manifest_entries_node, "Multi-Release")
         multi_release_node.text = "true"
@@ -86,65 +307,135 @@ def generate_new_pom(root, tree):
         goal_node = ET.SubElement(goals_node, "goal")
         goal_node.text = "shade"
 
-    # Write the new POM file
-    tree.write(NEW_POM_FILE, xml_declaration=True, encoding="utf-8")
-    print(f"New POM file generated at: {NEW_POM_FILE}")
+    # Write the new POM file, only when its content changed
+    return write_pom(tree, new_pom_file)
 
-# Run Maven package using the new POM file
-def run_maven_package():
+# Maven command used to build the shaded jar, or for the native builder to compile the
+# project and write its runtime classpath. Reactor builds run in parallel (-T) and only
+# build the packaged modules and the modules they depend on.
+def maven_package_command(packaged):
+    reactor_args = []
+    classpath_file = CLASSPATH_FILE
+    pom_file = NEW_POM_FILE
+    if REACTOR_MODULES:
+        reactor_args = ["-T", MAVEN_THREADS, "-pl", ",".join(f":{module.artifact_id}" for module in packaged), "-am"]
+        # Relative to each module's directory
+        classpath_file = os.path.join("target", os.path.basename(CLASSPATH_FILE))
+        pom_file = os.path.join(PROJECT_DIR, os.path.basename(NEW_POM_FILE))
+    if FAT_JAR_BUILDER == "native":
+        return [MAVEN_EXECUTABLE, "-f", os.path.join(PROJECT_DIR, "pom.xml"), *reactor_args, "compile",
+                "dependency:build-classpath", f"-Dmdep.outputFile={classpath_file}", "-DincludeScope=runtime"]
+    return [MAVEN_EXECUTABLE, "-f", pom_file, *reactor_args, "package", "-DskipTests"]
+
+# Files the Maven build produces, all of which must exist to skip it
+def maven_outputs(packaged):
+    if FAT_JAR_BUILDER == "native":
+        return [path for module in packaged
+                for path in (module_classpath_file(module), os.path.join(module.directory, "target", "classes"))]
+    return [module_jar(module) for module in packaged]
+
+# Fingerprint of everything the build depends on: the generated POMs, the source tree
+# (paths, sizes and modification times), the Maven settings and the Maven command
+def compute_build_fingerprint(pom_content, packaged):
+    digest = hashlib.sha256()
+    digest.update(pom_content)
+    digest.update("\0".join(maven_package_command(packaged)).encode())
+    digest.update(os.environ.get("MAVEN_OPTS", "").encode())
+
+    settings_files = [
+        os.path.join(os.path.expanduser("~"), ".m2", "settings.xml"),
+        os.path.join(os.environ.get("MAVEN_HOME", ""), "conf", "settings.xml"),
+    ]
+    for settings_file in settings_files:
+        if os.path.isfile(settings_file):
+            with open(settings_file, "rb") as f:
+                digest.update(f.read())
+
+    for dir_path, dir_names, file_names in os.walk(PROJECT_DIR):
+        dir_names[:] = sorted(d for d in dir_names if d not in FINGERPRINT_EXCLUDED_DIRS)
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            # Generated POMs of the project and, in a reactor, of its modules
+            if file_name == os.path.basename(NEW_POM_FILE):
+                continue
+            stat = os.stat(file_path)
+            digest.update(f"{os.path.relpath(file_path, PROJECT_DIR)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+# The Maven build can be skipped when the fingerprint matches the last successful build and its outputs exist
+def is_build_up_to_date(fingerprint, packaged):
+    if not all(os.path.exists(path) for path in maven_outputs(packaged)):
+        return False
     try:
-        maven_executable = r"mvn.cmd"
-        print(f"Running Maven package using new POM file: {NEW_POM_FILE}")
-        subprocess.check_call([maven_executable, "-f", NEW_POM_FILE, "package", "-DskipTests"], cwd=PROJECT_DIR)
+        with open(BUILD_FINGERPRINT_FILE, "r") as f:
+            return f.read().strip() == fingerprint
+    except OSError:
+        return False
+
+def save_build_fingerprint(fingerprint):
+    os.makedirs(os.path.dirname(BUILD_FINGERPRINT_FILE), exist_ok=True)
+    with open(BUILD_FINGERPRINT_FILE, "w") as f:
+        f.write(fingerprint)
+
+# Run Maven package using the new POM file, or compile for the native builder
+def run_maven_package(packaged):
+    try:
+        if FAT_JAR_BUILDER == "native":
+            print("Running Maven compile and dependency resolution for the native fat jar builder")
+        else:
+            print(f"Running Maven package using new POM file: {maven_package_command(packaged)[2]}")
+        subprocess.check_call(maven_package_command(packaged), cwd=PROJECT_DIR)
         print("Maven package completed successfully.")
     except subprocess.CalledProcessError:
         print("Error occurred during Maven packaging.")
         exit(1)
 
-# Generate a custom JRE using jlink
-def generate_custom_jre():
+# Merge the module's target/classes and runtime dependencies into its jar in target/, like the shade
+# config: the module's own classes win over dependencies, signature files are dropped, and the
+# manifest gets Main-Class and Multi-Release. Dependency entries are copied without recompression.
+def build_fat_jar(module):
+    classes_dir = os.path.join(module.directory, "target", "classes")
+    with open(module_classpath_file(module), "r", encoding="utf-8") as f:
+        classpath = [entry for entry in f.read().strip().split(os.pathsep) if entry]
+    fat_jar = module_jar(module)
+    attributes = {**pom_manifest_attributes(module), "Main-Class": module.main_class, "Multi-Release": "true"}
+    stats = merge_jars([classes_dir, *classpath], fat_jar, attributes, merge_services=MERGE_SERVICE_FILES,
+                       state_file=module_fat_jar_state_file(module), workers=FAT_JAR_WORKERS, keep_first_manifest=True)
+    if not stats.written:
+        print(f"Fat jar is up to date: {fat_jar}")
+        return
+    print(f"Fat jar merged at {fat_jar} from {len(classpath)} dependencies: {stats.entries} entries, "
+          f"{stats.copied} copied, {stats.compressed} compressed, {stats.reused} kept from the previous jar, "
+          f"{stats.duplicates} duplicates skipped")
+
+# Generate a custom JRE using jlink, or reuse a cached one; a reactor's modules all share it
+def generate_custom_jre(packaged):
     try:
-        jlink_executable = os.path.join(JDK_PATH, "bin", "jlink.exe")
         output_jre_dir = os.path.join(OUTPUT_DIR, "custom-jre")
-        
-        # Ensure the output directory does not exist; delete it if it does
-        if os.path.exists(output_jre_dir):
-            print(f"Directory already exists, removing: {output_jre_dir}")
-            shutil.rmtree(output_jre_dir)
-
-        # Use java --list-modules to get all available modules
-        java_executable = os.path.join(JDK_PATH, "bin", "java.exe")
-        available_modules = subprocess.check_output([java_executable, "--list-modules"]).decode().strip().splitlines()
-
-        # Extract module names (only the part before @, remove version numbers)
-        modules_to_add = ",".join([line.split('@')[0] for line in available_modules])
-
-        # Generate JRE using jlink
-        print(f"Generating custom JRE with all available modules at: {output_jre_dir}")
-        subprocess.check_call([
-            jlink_executable,
-            "--module-path", os.path.join(JDK_PATH, "jmods"),
-            "--add-modules", modules_to_add,
-            "--output", output_jre_dir,
-            "--no-header-files",
-            "--no-man-pages"
-        ])
+
+        # Either all available modules, or the ones jdeps finds in the shaded jars
+        shaded_jars = [module_jar(module) for module in packaged]
+        modules = resolve_jre_modules(JDK_PATH, JRE_MODULES_MODE, shaded_jars, EXTRA_JRE_MODULES)
+        build_custom_jre(JDK_PATH, modules, output_jre_dir)
         print("Custom JRE generated successfully.")
     except subprocess.CalledProcessError:
         print("Error occurred during JRE generation.")
         exit(1)
 
 # Create executable script
-def create_executable_script():
-    jar_file_src_path = os.path.join(PROJECT_DIR, "target", "tcs.cnnckp.base.starter-1.0.0-SNAPSHOT.jar")
-    jar_file_dst_path = os.path.join(OUTPUT_DIR, "tcs.cnnckp.base.starter-1.0.0-SNAPSHOT.jar")
-    script_path = os.path.join(OUTPUT_DIR, "run.bat")
+def create_executable_script(module):
+    output_dir = module_output_dir(module)
+    jar_file_src_path = module_jar(module)
+    jar_file_dst_path = os.path.join(output_dir, module.jar_file_name)
+    script_path = os.path.join(output_dir, "run.bat")
+    os.makedirs(output_dir, exist_ok=True)
 
-    program_args = "tcs-config\\tcs-room1.conf tcs-config\\tcs-global.conf mockUcs"
+    program_args = MODULE_PROGRAM_ARGS.get(module.artifact_id, "") if REACTOR_MODULES else PROGRAM_ARGS
+    jre_path = "..\\custom-jre" if REACTOR_MODULES else "custom-jre"
 
     # Copy JAR file to OUTPUT_DIR
     if os.path.exists(jar_file_src_path):
-        shutil.copy(jar_file_src_path, jar_file_dst_path)
+        copy_file(jar_file_src_path, jar_file_dst_path)
         print(f"Copied JAR file to: {jar_file_dst_path}")
     else:
         print(f"Error: JAR file not found at {jar_file_src_path}")
@@ -152,8 +443,8 @@ def create_executable_script():
 
     # Generate batch script content
     script_content = f"""@echo off
-set JRE_PATH=custom-jre
-set MAIN_CLASS={MAIN_CLASS}
+set JRE_PATH={jre_path}
+set MAIN_CLASS={module.main_class}
 set CLASSPATH={jar_file_dst_path}
 %JRE_PATH%\\bin\\java.exe --add-opens java.desktop/java.beans=ALL-UNNAMED -cp %CLASSPATH% %MAIN_CLASS% {program_args}
 """
@@ -165,14 +456,55 @@ set CLASSPATH={jar_file_dst_path}
 
 
 # Main process
-if __name__ == "__main__":
-    root, tree = read_existing_pom()
-    generate_new_pom(root, tree)
+def main():
+    if PROFILE_STAGES:
+        PROFILER.enabled = True
+
+    if FAT_JAR_BUILDER not in ("shade", "native"):
+        print(f"Error: unknown FAT_JAR_BUILDER {FAT_JAR_BUILDER!r}, expected 'shade' or 'native'")
+        exit(1)
+
+    with PROFILER.stage("pom", [NEW_POM_FILE]):
+        reactor = discover_reactor_modules(PROJECT_DIR) if REACTOR_MODULES else [read_maven_module(PROJECT_DIR)]
+        packaged = modules_to_package(reactor)
+        if FAT_JAR_BUILDER == "native":
+            # Maven builds no jar, so the project's own POMs are used unchanged
+            pom_content = b""
+            for module in reactor:
+                with open(os.path.join(module.directory, "pom.xml"), "rb") as pom_file:
+                    pom_content += pom_file.read()
+        elif REACTOR_MODULES:
+            modules_by_directory = {module.directory: module for module in reactor}
+            pom_content = generate_reactor_poms(modules_by_directory, PROJECT_DIR, packaged)
+        else:
+            pom_content = generate_new_pom(reactor[0].root, reactor[0].tree)
 
-    # 运行maven package
-    run_maven_package()
+    # 运行maven package, unless nothing changed since the last successful build
+    with PROFILER.stage("mvn", [os.path.join(module.directory, "target") for module in packaged]):
+        fingerprint = compute_build_fingerprint(pom_content, packaged)
+        if is_build_up_to_date(fingerprint, packaged):
+            print("Sources, POM and settings unchanged since the last build, skipping Maven package.")
+        else:
+            run_maven_package(packaged)
+            save_build_fingerprint(fingerprint)
+
+    if FAT_JAR_BUILDER == "native":
+        with PROFILER.stage("merge", [module_jar(module) for module in packaged]):
+            for module in packaged:
+                build_fat_jar(module)
 
     # Generate a custom JRE using jlink
-    generate_custom_jre()
+    with PROFILER.stage("jlink", [os.path.join(OUTPUT_DIR, "custom-jre")]):
+        generate_custom_jre(packaged)
+
+    launcher_outputs = [os.path.join(module_output_dir(module), name) for module in packaged
+                        for name in (module.jar_file_name, "run.bat")]
+    with PROFILER.stage("launcher", launcher_outputs):
+        for module in packaged:
+            create_executable_script(module)
+
+    PROFILER.finish("packMavenProject", os.path.join(OUTPUT_DIR, "pack-profile.json"))
 
-    create_executable_script()
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,28 @@
 #    - On Linux: run ./start_program.sh
 
 import os
+import sys
+import io
+import contextlib
 import subprocess
 import shutil
 import re
 import platform
+import json
+import hashlib
+import time
+import threading
+import zipfile
+import struct
+import glob
+import tempfile
+import fnmatch
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable
+
+from packCommon import PROFILER, FILE_COPIER, PackageArchive, copy_file, format_bytes, hash_file, is_windows, jar_manifest, merge_jars, read_manifest_attributes, resolve_jre_modules, build_custom_jre, place_tree
 
 # Configure global variables
 JDK_PATH = r"d:\software\dev\jdk22"
@@ -20,18 +38,200 @@ PACK_DIR = "D:\\tmp\\pack5"  # Target directory for packaging
 DEPENDENCY_DIR = os.path.join(PACK_DIR, "dependencies")  # Directory for dependencies
 EXTRA_FILES_AND_DIRS = [
 ]
+HSPERFDATA_DIRS = None  # Directories with HotSpot perf-data files; None means <tmp>/hsperfdata_* of this host
+JCMD_TIMEOUT_SECONDS = 10  # jcmd is only a fallback when perf-data is missing; unresponsive VMs are given up after this
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)  # Number of threads used to copy dependencies
+COPY_MANIFEST_NAME = ".copy_manifest.json"  # Manifest of copied files, used to skip unchanged files on later runs
+COPY_VERIFY_HASH = False  # Also compare SHA-256 digests, not only size and modification time
+# Optional content-addressed store, e.g. "./.pack-store": each distinct dependency file is stored once, keyed
+# by SHA-256, and hardlinked into the mirrored layout. It is never cleaned up. None copies files directly.
+DEPENDENCY_STORE_DIR = None
+JAR_CLASS_DIRECTORIES = False  # Pack classpath directories (e.g. target/classes) into jars instead of copying them
+JAR_WORKERS = os.cpu_count() or 1  # Number of directories compressed in parallel
+JAR_MANIFEST_NAME = ".jar_manifest.json"  # Fingerprints of jarred directories, used to skip unchanged ones
+CDS_TRAINING = False  # Run the packaged app once to record an AppCDS archive that the launchers use
+CDS_ARCHIVE_NAME = "app.jsa"  # Dynamic CDS archive written to PACK_DIR
+CDS_TRAINING_SECONDS = 60  # Maximum duration of the training run
+CDS_READY_MARKER = None  # Regex of an output line that marks the app as started, ends training early
+CDS_MEASURE_STARTUP = True  # Measure startup with and without the archive after training
+BATCH_PIDS = [  # Pack these PIDs without prompting, each into its own PACK_DIR/<app>-<pid> directory
+]
+BATCH_MAIN_CLASS_REGEX = None  # Or pack every running JVM whose main class matches this regex
+ARCHIVE_OUTPUT = None  # Stream the package into this .zip or .tar.gz file ("-" for stdout) instead of writing PACK_DIR
+ARCHIVE_FORMAT = None  # "zip" or "tar.gz"; None picks it from the ARCHIVE_OUTPUT extension (zip for stdout)
+ARCHIVE_WORKERS = os.cpu_count() or 1  # Number of threads compressing the archive
+TRIM_JARS = False  # Keep only the classes the running JVM has loaded (plus TRIM_KEEP_PATTERNS) in the copied jars
+TRIM_KEEP_PATTERNS = [  # Jar entries TRIM_JARS always keeps, as globs, e.g. "com/example/plugins/*" for classes loaded later
+]
+TRIM_MANIFEST_NAME = ".trim_manifest.json"  # Sources and kept classes of trimmed jars, used to skip unchanged ones
+MERGE_SMALL_JARS = False  # Merge runs of consecutive small classpath jars into fewer jars, so the JVM opens and scans fewer files
+MERGE_JAR_MAX_BYTES = 256 * 1024  # Jars smaller than this are merged
+MERGED_JAR_MAX_BYTES = 16 * 1024 * 1024  # A merged jar takes small jars until it reaches this size
+MERGE_JAR_IGNORED_DUPLICATES = [  # Resources that several jars of one merged jar may contain, as globs; the first copy is kept
+    "META-INF/LICENSE*", "META-INF/NOTICE*", "META-INF/DEPENDENCIES*", "META-INF/README*", "LICENSE*", "NOTICE*", "about.html",
+]
+MERGEABLE_MANIFEST_ATTRIBUTES = [  # Manifest main attributes a merged jar may drop or keeps itself; jars with others are not merged
+    "Manifest-Version", "Created-By", "Multi-Release",
+]
+MERGE_MANIFEST_NAME = ".merge_manifest.json"  # Sources of merged jars, used to skip unchanged ones
+REPLAY_JVM_FLAGS = False  # Write the performance flags the running JVM's ergonomics chose to jvm.options, used by the launchers
+JVM_OPTIONS_FILE_NAME = "jvm.options"  # Java argument file in PACK_DIR with the replayed flags, meant to be edited per app
+REPLAY_JVM_FLAG_PATTERNS = [  # Flags REPLAY_JVM_FLAGS considers performance relevant, as globs of flag names
+    "Use*GC", "InitialHeapSize", "MaxHeapSize", "MinHeapSize", "NewSize", "MaxNewSize", "NewRatio", "SurvivorRatio",
+    "MaxTenuringThreshold", "G1HeapRegionSize", "MaxGCPauseMillis", "GCTimeRatio", "ParallelGCThreads", "ConcGCThreads",
+    "MetaspaceSize", "MaxMetaspaceSize", "ReservedCodeCacheSize", "CICompilerCount", "TieredCompilation",
+    "TieredStopAtLevel", "UseLargePages", "UseTransparentHugePages", "AlwaysPreTouch", "UseNUMA", "ThreadStackSize",
+    "UseStringDeduplication",
+]
+LAUNCHER_CLASSPATH = "inline"  # "inline": -cp in the launchers, "argfile": a @classpath-*.args file, "manifest": Class-Path of a classpath.jar
+RELEASE_MANIFEST_NAME = "release-manifest.json"  # Written to PACK_DIR: size and SHA-256 of every file of the package
+PREVIOUS_RELEASE_MANIFEST = None  # release-manifest.json of the deployed release; when set, a delta package is written
+DELTA_OUTPUT = None  # Directory, .zip or .tar.gz of the delta package; None means <PACK_DIR>-delta
+HASH_WORKERS = os.cpu_count() or 1  # Number of files hashed in parallel for the release manifest
+WATCH = False  # After packing, keep watching the classpath and EXTRA_FILES_AND_DIRS and re-pack what changed, until Ctrl+C
+WATCH_POLL_SECONDS = 1.0  # How often the watched files are checked for changes
+WATCH_DEBOUNCE_SECONDS = 2.0  # Re-pack once no further change was seen for this long,
+WATCH_MAX_DELAY_SECONDS = 10.0  # but no later than this after the first change, even while files keep changing
+PROFILE_STAGES = False  # Write a per-stage timing and I/O report to PACK_DIR/pack-profile.json (or set PACK_PROFILE=1)
+JRE_MODULES_MODE = "all"  # "all": every JDK module, "jdeps": only the modules the classpath needs
+EXTRA_JRE_MODULES = [  # Modules jdeps cannot see, e.g. used via reflection or ServiceLoader (jdk.crypto.ec, jdk.localedata)
+]
 
-# List all running Java processes using jcmd
+# Directories that hold HotSpot perf-data files, one file per running JVM named after its PID
+def hsperfdata_directories() -> list[str]:
+    if HSPERFDATA_DIRS is not None:
+        return list(HSPERFDATA_DIRS)
+    # HotSpot always uses /tmp on Linux and macOS, and the user's temp directory on Windows
+    temp_dir = tempfile.gettempdir() if is_windows() else "/tmp"
+    return sorted(glob.glob(os.path.join(temp_dir, "hsperfdata_*")))
+
+
+# Parse a HotSpot perf-data file (format 2.0) into {counter name: str or int}
+def read_perfdata(path: str) -> dict[str, str | int]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Prologue: magic, byte order, major, minor, accessible, used, overflow, mod time stamp, entry offset, entry count
+    if len(data) < 32 or data[:4] != b'\xca\xfe\xc0\xc0':
+        raise ValueError(f"Not a perf-data file: {path}")
+    endian = '<' if data[4] == 1 else '>'
+    if data[5] != 2:
+        raise ValueError(f"Unsupported perf-data version {data[5]}.{data[6]}: {path}")
+    entry_offset, entry_count = struct.unpack_from(endian + 'ii', data, 24)
+
+    counters = {}
+    offset = entry_offset
+    for _ in range(entry_count):
+        if offset + 20 > len(data):
+            break
+        entry_length, name_offset, vector_length = struct.unpack_from(endian + 'iii', data, offset)
+        data_type = data[offset + 12]
+        data_offset, = struct.unpack_from(endian + 'i', data, offset + 16)
+        if entry_length <= 0:
+            break
+
+        name_start = offset + name_offset
+        name = data[name_start:data.index(b'\0', name_start)].decode('ascii', 'replace')
+        value_start = offset + data_offset
+        if data_type == ord('J') and vector_length == 0:
+            counters[name], = struct.unpack_from(endian + 'q', data, value_start)
+        elif data_type == ord('B') and vector_length > 0:
+            raw = data[value_start:value_start + vector_length]
+            counters[name] = raw.split(b'\0', 1)[0].decode('utf-8', 'replace')
+        offset += entry_length
+    return counters
+
+
+def _process_alive(pid: int) -> bool:
+    if is_windows():
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Perf-data counters of every live JVM that this user can read, keyed by PID
+def discover_jvms_from_perfdata() -> dict[str, dict[str, str | int]]:
+    jvms = {}
+    for directory in hsperfdata_directories():
+        for path in glob.glob(os.path.join(directory, "*")):
+            pid = os.path.basename(path)
+            if not pid.isdigit() or not _process_alive(int(pid)):
+                continue
+            try:
+                counters = read_perfdata(path)
+            except (OSError, ValueError, struct.error):
+                continue
+            if counters.get("sun.rt.javaCommand"):
+                jvms[pid] = counters
+    return jvms
+
+
+# HotSpot cuts perf-data string counters at PerfMaxStringConstLength - 1 bytes (1024 - 1 by default)
+PERFDATA_TRUNCATED_BYTES = 1023
+PERFDATA_COMMAND_LINE_COUNTERS = ("java.rt.vmArgs", "java.rt.vmFlags", "sun.rt.javaCommand", "java.property.java.class.path")
+
+
+# Names of the command line counters that may have been cut off: any of PERFDATA_TRUNCATED_BYTES or more
+def truncated_perfdata_counters(counters: dict[str, str | int]) -> list[str]:
+    return [name for name in PERFDATA_COMMAND_LINE_COUNTERS
+            if isinstance(counters.get(name), str) and len(counters[name].encode('utf-8')) >= PERFDATA_TRUNCATED_BYTES]
+
+
+# jcmd VM.command_line style text built from perf-data, so the jcmd parsers can read it
+def perfdata_command_line(counters: dict[str, str | int]) -> str:
+    lines = ["VM Arguments:"]
+    if counters.get("java.rt.vmArgs"):
+        lines.append(f"jvm_args: {counters['java.rt.vmArgs']}")
+    if counters.get("java.rt.vmFlags"):
+        lines.append(f"jvm_flags: {counters['java.rt.vmFlags']}")
+    lines.append(f"java_command: {counters.get('sun.rt.javaCommand', '')}")
+    if counters.get("java.property.java.class.path"):
+        lines.append(f"java_class_path (initial): {counters['java.property.java.class.path']}")
+    return "\n".join(lines) + "\n"
+
+
+# List all running Java processes, from perf-data files or, when there are none, with jcmd -l
 def list_java_processes() -> list[tuple[str, str, str]] | None:
+    jvms = discover_jvms_from_perfdata()
+    java_processes = []
+    for pid, counters in sorted(jvms.items(), key=lambda item: int(item[0])):
+        full_command = str(counters["sun.rt.javaCommand"])
+        if 'jcmd' not in full_command and 'jps' not in full_command:
+            java_processes.append((pid, full_command.split()[0], full_command))
+    if java_processes:
+        return java_processes
+    return list_java_processes_with_jcmd()
+
+
+# List all running Java processes using jcmd
+def list_java_processes_with_jcmd() -> list[tuple[str, str, str]] | None:
     try:
         # Run jcmd -l to list all Java processes
         process = subprocess.Popen(
             ['jcmd', '-l'],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            shell=True
+            shell=is_windows()  # A list with shell=True only runs 'jcmd' on POSIX
         )
-        stdout, stderr = process.communicate()
+        try:
+            stdout, stderr = process.communicate(timeout=JCMD_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            print(f"jcmd -l did not answer within {JCMD_TIMEOUT_SECONDS}s")
+            return None
 
         if stderr:
             print(f"Error retrieving Java processes: {stderr.decode()}")
@@ -59,8 +259,8 @@ def list_java_processes() -> list[tuple[str, str, str]] | None:
         print(f"Exception while listing Java processes: {e}")
         return None
 
-# Let user select a Java process
-def select_java_process() -> str | None:
+# Let user select a Java process, returns (pid, main class)
+def select_java_process() -> tuple[str, str] | None:
     processes = list_java_processes()
     
     if not processes:
@@ -84,71 +284,59 @@ def select_java_process() -> str | None:
                 selected_pid, selected_main_class, full_command = processes[index]
                 print(f"\nSelected: {full_command} (PID: {selected_pid})")
                 print(f"Using main class: {selected_main_class}")
-                return selected_main_class
+                return selected_pid, selected_main_class
             else:
                 print("Invalid selection. Please try again.")
         except ValueError:
             print("Please enter a number or 'q' to quit.")
 
 
-# Use jlink to generate custom JRE
-def generate_custom_jre() -> None:
+# Use jlink to generate custom JRE, or reuse a cached one
+def generate_custom_jre(classpath_list: list[str] | None = None, pack_dir: str | None = None, archive: PackageArchive | None = None) -> None:
     try:
-        is_windows = platform.system().lower() == 'windows'
-        exe_ext = '.exe' if is_windows else ''
-        jlink_executable = os.path.join(JDK_PATH, "bin", f"jlink{exe_ext}")  # Path to jlink based on OS
-        output_jre_dir = os.path.join(PACK_DIR, "custom-jre")  # Output directory for custom JRE
-        
-        # Ensure output directory doesn't exist, delete if it exists
-        if os.path.exists(output_jre_dir):
-            print(f"Directory already exists, removing: {output_jre_dir}")
-            shutil.rmtree(output_jre_dir)
-
-        # Use java --list-modules to get all available modules
-        java_executable = os.path.join(JDK_PATH, "bin", f"java{exe_ext}")
-        available_modules = subprocess.check_output([java_executable, "--list-modules"], shell=is_windows).decode().strip().splitlines()
-
-        # Extract module names (only extract the part before @, remove version numbers)
-        modules_to_add = ",".join([line.split('@')[0] for line in available_modules])
-
-        # Use jlink to generate JRE
-        print(f"Generating custom JRE with all available modules at: {output_jre_dir}")
-        subprocess.check_call([
-            jlink_executable,
-            "--module-path", os.path.join(JDK_PATH, "jmods"),
-            "--add-modules", modules_to_add,
-            "--output", output_jre_dir,
-            "--no-header-files",
-            "--no-man-pages"
-        ])
+        output_jre_dir = os.path.join(pack_dir or PACK_DIR, "custom-jre")  # Output directory for custom JRE
+
+        # Either all available modules, or the ones jdeps finds in the classpath
+        modules = resolve_jre_modules(JDK_PATH, JRE_MODULES_MODE, classpath_list or [], EXTRA_JRE_MODULES)
+        build_custom_jre(JDK_PATH, modules, output_jre_dir, archive=archive)
         print("Custom JRE generated successfully.")
-    except subprocess.CalledProcessError:
-        print("Error occurred during JRE generation.")
-        exit(1)
+    except subprocess.CalledProcessError as e:
+        # Raised rather than exiting, since this runs in a stage thread and other apps may still pack
+        raise PackError(f"Error occurred during JRE generation: {e}") from e
 
 
 
-# Get information about a specific Java process
-def get_java_process_info(main_class: str) -> str | None:
-    try:
-        process = subprocess.Popen(
-            ['jcmd', main_class, 'VM.command_line'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True
-        )
-        stdout, stderr = process.communicate()
+# Run a jcmd diagnostic command against one PID, giving up after JCMD_TIMEOUT_SECONDS
+def run_jcmd(pid: str, *command: str) -> str:
+    result = subprocess.run(
+        ['jcmd', pid, *command],
+        capture_output=True,
+        timeout=JCMD_TIMEOUT_SECONDS,
+        shell=is_windows()  # A list with shell=True only runs 'jcmd' on POSIX
+    )
+    if result.returncode != 0 or result.stderr.strip():
+        raise RuntimeError(result.stderr.decode(errors='replace').strip() or f"jcmd exited with {result.returncode}")
+    return result.stdout.decode(errors='replace')
 
-        if stderr:
-            print(f"Error retrieving process info: {stderr.decode()}")
-            return None
 
-        output = stdout.decode()
-        return output
+# Get the VM.command_line information of a Java process by PID.
+# Perf-data is read without attaching; jcmd VM.command_line is the fallback, and is also used
+# when perf-data cut a counter off, as it does with the long classpaths of IDE-started apps.
+def get_java_process_info(pid: str) -> str | None:
+    jvms = discover_jvms_from_perfdata()
+    if pid in jvms:
+        truncated = truncated_perfdata_counters(jvms[pid])
+        if not truncated:
+            return perfdata_command_line(jvms[pid])
+        print(f"Perf-data of {pid} is truncated ({', '.join(truncated)}), asking jcmd for the command line")
 
+    try:
+        return run_jcmd(pid, 'VM.command_line')
+    except subprocess.TimeoutExpired:
+        print(f"jcmd {pid} VM.command_line did not answer within {JCMD_TIMEOUT_SECONDS}s")
     except Exception as e:
-        print(f"Exception while retrieving process info: {e}")
-        return None
+        print(f"Error retrieving process info: {e}")
+    return None
 
 
 # Parse jcmd output to extract classpath
@@ -158,7 +346,8 @@ def parse_classpath(jcmd_output: str) -> list[str]:
     
     if match:
         classpath = match.group(1)
-        return classpath.split(';')
+        # The process runs on this host, so its classpath uses this host's separator
+        return classpath.strip().split(os.pathsep)
     
     return []
 
@@ -174,45 +363,772 @@ def parse_jvm_args(jcmd_output: str) -> str:
     return ""
 
 
-# Copy dependency files from classpath
-def copy_dependencies(classpath_list: list[str], target_directory: str) -> None:
-    if not os.path.exists(target_directory):
-        os.makedirs(target_directory)
+# Parse the java_command line into (main class or jar, program arguments)
+def parse_java_command(jcmd_output: str) -> tuple[str, list[str]]:
+    match = re.search(r"java_command: (.+)", jcmd_output)
+    if not match:
+        return "", []
+    parts = match.group(1).split()
+    return parts[0], parts[1:]
+
+
+# Parse jcmd VM.flags output into {flag name: value}, booleans become "true"/"false"
+def parse_vm_flags(jcmd_output: str) -> dict[str, str]:
+    flags = {}
+    for sign, name, value in re.findall(r"-XX:([+-]?)(\w+)(?:=(\S*))?", jcmd_output):
+        flags[name] = value if not sign else ("true" if sign == "+" else "false")
+    return flags
+
+
+# Parse jcmd VM.system_properties output (Java properties format) into a dict
+def parse_system_properties(jcmd_output: str) -> dict[str, str]:
+    escapes = {"t": "\t", "n": "\n", "r": "\r", "f": "\f"}
+
+    def unescape(text: str) -> str:
+        return re.sub(r"\\(u[0-9a-fA-F]{4}|.)",
+                      lambda m: chr(int(m.group(1)[1:], 16)) if len(m.group(1)) == 5 else escapes.get(m.group(1), m.group(1)),
+                      text)
+
+    properties = {}
+    for line in jcmd_output.splitlines():
+        if not line or line.startswith('#') or re.match(r"^\d+:$", line):
+            continue
+        match = re.match(r"((?:[^=:\\]|\\.)+)[=:](.*)", line)
+        if match:
+            properties[unescape(match.group(1).strip())] = unescape(match.group(2))
+    return properties
+
+
+# Everything the packing stages need to know about the selected JVM, gathered once
+@dataclass
+class JvmSnapshot:
+    pid: str
+    main_class: str
+    jvm_args: str
+    classpath: list[str]
+    program_args: list[str]
+    flags: dict[str, str] = field(default_factory=dict)
+    system_properties: dict[str, str] = field(default_factory=dict)
+    loaded_classes: set[str] | None = None  # Only collected for TRIM_JARS
+    flag_origins: dict[str, tuple[str, str]] | None = None  # Only collected for REPLAY_JVM_FLAGS
+
+
+# Binary names of the classes loaded in a JVM, from jcmd VM.class_hierarchy -i output, whose lines
+# look like "|  |--com.example.Foo/0x0000000801001000" or "|  implements java.io.Serializable/null (declared intf)"
+def parse_loaded_classes(jcmd_output: str) -> set[str]:
+    return set(re.findall(r"([\w$]+(?:\.[\w$]+)*)/(?:null|0x[0-9a-fA-F]+)", jcmd_output))
+
+
+# Parse jcmd VM.flags -all output (the -XX:+PrintFlagsFinal table) into {flag name: (value, origin)},
+# from lines like "   uint ConcGCThreads          = 2          {product} {ergonomic}". JDK 8 prints no
+# origin column but marks values that are not the default with ":=".
+def parse_vm_flags_all(jcmd_output: str) -> dict[str, tuple[str, str]]:
+    flags = {}
+    pattern = r"^\s*\S+\s+(\w+)\s+(:?)=[ \t]*(?:([^{\s]\S*)[ \t]+)?\{[^}]*\}(?:[ \t]*\{([^}]*)\})?"
+    for name, changed, value, origin in re.findall(pattern, jcmd_output, re.MULTILINE):
+        flags[name] = (value, origin or ("ergonomic" if changed else "default"))
+    return flags
+
+
+# How the JVM was started from the module path (--module-path/-p, --module/-m), or None for a classpath
+# launch. The launcher passes them to the JVM as the jdk.module.path and jdk.module.main properties;
+# the JVM arguments are checked too when the properties could not be read.
+def module_path_launch(system_properties: dict[str, str], command_line: str) -> str | None:
+    module_path = system_properties.get("jdk.module.path")
+    main_module = system_properties.get("jdk.module.main")
+    for arg in parse_jvm_args(command_line).split():
+        if arg.startswith("-Djdk.module.path="):
+            module_path = module_path or arg.split("=", 1)[1]
+        elif arg.startswith("-Djdk.module.main="):
+            main_module = main_module or arg.split("=", 1)[1]
+    if main_module:
+        return f"main module {main_module}"
+    if module_path:
+        return f"module path {module_path}"
+    return None
+
+
+# Query a JVM by PID: VM.command_line (perf-data when available), VM.flags and
+# VM.system_properties (and VM.class_hierarchy for TRIM_JARS) run concurrently,
+# each with a timeout, and are parsed once
+def collect_jvm_snapshot(pid: str) -> JvmSnapshot:
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        command_line_future = executor.submit(get_java_process_info, pid)
+        optional_futures = [
+            ("VM.flags", executor.submit(run_jcmd, pid, 'VM.flags')),
+            ("VM.system_properties", executor.submit(run_jcmd, pid, 'VM.system_properties')),
+        ]
+        if TRIM_JARS:
+            optional_futures.append(("VM.class_hierarchy", executor.submit(run_jcmd, pid, 'VM.class_hierarchy', '-i')))
+        if REPLAY_JVM_FLAGS:
+            optional_futures.append(("VM.flags -all", executor.submit(run_jcmd, pid, 'VM.flags', '-all')))
+
+        command_line = command_line_future.result()
+        optional_outputs = {}
+        for name, future in optional_futures:
+            try:
+                optional_outputs[name] = future.result()
+            except subprocess.TimeoutExpired:
+                print(f"jcmd {pid} {name} did not answer within {JCMD_TIMEOUT_SECONDS}s, continuing without it")
+            except Exception as e:
+                print(f"jcmd {pid} {name} failed, continuing without it: {e}")
 
+    if not command_line:
+        raise PackError(f"Failed to retrieve Java process information for PID {pid}.")
+
+    # java.class.path is never truncated, unlike the perf-data command line; the command line is the fallback
+    system_properties = parse_system_properties(optional_outputs.get("VM.system_properties", ""))
+    module_launch = module_path_launch(system_properties, command_line)
+    if module_launch:
+        raise PackError(f"PID {pid} was started from the module path ({module_launch}), which cannot be packed; "
+                        f"start it with -cp/--class-path instead.")
+    if system_properties.get("java.class.path"):
+        classpath = system_properties["java.class.path"].split(os.pathsep)
+    else:
+        classpath = parse_classpath(command_line)
+    jvm_args = parse_jvm_args(command_line)
+    main_class, program_args = parse_java_command(command_line)
+    return JvmSnapshot(
+        pid=pid,
+        main_class=main_class,
+        jvm_args=jvm_args,
+        classpath=classpath,
+        program_args=program_args,
+        flags=parse_vm_flags(optional_outputs.get("VM.flags", "")),
+        system_properties=system_properties,
+        loaded_classes=parse_loaded_classes(optional_outputs["VM.class_hierarchy"])
+        if "VM.class_hierarchy" in optional_outputs else None,
+        flag_origins=parse_vm_flags_all(optional_outputs["VM.flags -all"]) if "VM.flags -all" in optional_outputs else None,
+    )
+
+
+# Map a classpath entry to its mirrored location under the dependency directory
+def mirror_path(path: str, target_directory: str) -> str:
+    drive, tail = os.path.splitdrive(path)
+    drive_letter = drive.lower().rstrip(':')
+    return os.path.join(target_directory, drive_letter, tail.lstrip("\\/"))
+
+
+# Size, modification time and (optionally) content hash of a file
+def file_signature(path: str, with_hash: bool = False) -> dict:
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if with_hash:
+        signature["sha256"] = hash_file(path)
+    return signature
+
+
+@dataclass
+class CopyStats:
+    copied_files: int = 0
+    copied_bytes: int = 0
+    linked_files: int = 0
+    linked_bytes: int = 0
+    skipped_files: int = 0
+    skipped_bytes: int = 0
+    failed: list[str] = field(default_factory=list)
+
+    def summary(self, elapsed: float) -> str:
+        return (f"{self.copied_files} files ({format_bytes(self.copied_bytes)}) copied, "
+                f"{self.linked_files} files ({format_bytes(self.linked_bytes)}) linked from the store, "
+                f"{self.skipped_files} files ({format_bytes(self.skipped_bytes)}) unchanged and skipped, "
+                f"{len(self.failed)} failed in {elapsed:.2f}s")
+
+
+def load_copy_manifest(manifest_path: str) -> dict:
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_copy_manifest(manifest_path: str, manifest: dict) -> None:
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+# Expand classpath entries into (source file, target file) pairs
+def plan_dependency_copies(classpath_list: list[str], target_directory: str) -> list[tuple[str, str]]:
+    jobs = []
     for path in classpath_list:
-        if os.path.exists(path):
+        if not os.path.exists(path):
+            print(f"Path not found: {path}")
+            continue
+
+        target_path = mirror_path(path, target_directory)
+        if os.path.isfile(path):
+            jobs.append((path, target_path))
+        elif os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                relative_dir = os.path.relpath(dir_path, path)
+                for file_name in file_names:
+                    jobs.append((os.path.join(dir_path, file_name),
+                                 os.path.normpath(os.path.join(target_path, relative_dir, file_name))))
+    return jobs
+
+
+# Put a file into the content-addressed store unless identical content is already there.
+# Returns (stored path, SHA-256, whether the content was new).
+def store_file(source: str, store_dir: str) -> tuple[str, str, bool]:
+    digest = hash_file(source)
+    stored_path = os.path.join(store_dir, digest[:2], digest)
+    if os.path.exists(stored_path):
+        return stored_path, digest, False
+
+    os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+    tmp_path = f"{stored_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    FILE_COPIER.copy(source, tmp_path)
+    os.replace(tmp_path, stored_path)
+    return stored_path, digest, True
+
+
+# Hardlink a stored file to target, replacing any existing file; copy if linking is not possible
+def link_stored_file(stored_path: str, target: str) -> None:
+    tmp_path = f"{target}.{threading.get_ident()}.tmp"
+    try:
+        os.link(stored_path, tmp_path)
+    except OSError:
+        FILE_COPIER.copy(stored_path, tmp_path)
+    os.replace(tmp_path, target)
+
+
+# Copy one file unless the manifest shows it is unchanged since the last run.
+# Returns (manifest entry, action, size) where action is "copied", "linked" or "skipped".
+def copy_file_if_changed(source: str, target: str, previous: dict | None) -> tuple[dict, str, int]:
+    signature = file_signature(source)
+    if (previous is not None and previous.get("source") == source
+            and previous.get("size") == signature["size"] and previous.get("mtime") == signature["mtime"]
+            and os.path.isfile(target) and os.path.getsize(target) == signature["size"]):
+        if not COPY_VERIFY_HASH or previous.get("sha256") == hash_file(source):
+            return previous, "skipped", signature["size"]
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if DEPENDENCY_STORE_DIR:
+        stored_path, signature["sha256"], is_new = store_file(source, DEPENDENCY_STORE_DIR)
+        link_stored_file(stored_path, target)
+        action = "copied" if is_new else "linked"
+    else:
+        # Replace rather than overwrite, the target may be a hardlink into the store
+        tmp_path = f"{target}.{threading.get_ident()}.tmp"
+        FILE_COPIER.copy(source, tmp_path)
+        os.replace(tmp_path, target)
+        if COPY_VERIFY_HASH:
+            signature["sha256"] = hash_file(source)
+        action = "copied"
+    return {"source": source, **signature}, action, signature["size"]
+
+
+# Apps packed at the same time by pack_batch, whose copy, jar and merge pools share the configured workers
+_concurrent_apps = 1
+
+
+# Workers of one app's pool: the configured number, split between the apps packed at the same time
+def app_workers(configured: int) -> int:
+    return max(1, configured // _concurrent_apps)
+
+
+# Copy (source, target) pairs on a thread pool, skipping files recorded as unchanged in the manifest
+def copy_files(jobs: list[tuple[str, str]], manifest_path: str, workers: int | None = None) -> CopyStats:
+    manifest_root = os.path.dirname(manifest_path)
+    previous_manifest = load_copy_manifest(manifest_path)
+    manifest = {}
+    stats = CopyStats()
+
+    with ThreadPoolExecutor(max_workers=app_workers(COPY_WORKERS) if workers is None else max(1, workers)) as executor:
+        futures = {}
+        for source, target in jobs:
+            key = os.path.relpath(target, manifest_root)
+            futures[executor.submit(copy_file_if_changed, source, target, previous_manifest.get(key))] = (source, key)
+
+        for future in as_completed(futures):
+            source, key = futures[future]
             try:
-                # Get drive part and convert to lowercase
-                drive, tail = os.path.splitdrive(path)
-                drive_letter = drive.lower().rstrip(':')
-
-                # Construct target path, preserving the entire path structure, including drive part
-                target_path = os.path.join(target_directory, drive_letter, tail.lstrip("\\"))
-
-                if os.path.isfile(path):
-                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                    shutil.copy(path, target_path)
-                    print(f"Copied file: {path} -> {target_path}")
-                elif os.path.isdir(path):
-                    shutil.copytree(path, target_path, dirs_exist_ok=True)
-                    print(f"Copied directory: {path} -> {target_path}")
+                entry, action, size = future.result()
             except Exception as e:
-                print(f"Error copying {path}: {e}")
+                print(f"Error copying {source}: {e}")
+                stats.failed.append(source)
+                continue
+
+            manifest[key] = entry
+            if action == "copied":
+                stats.copied_files += 1
+                stats.copied_bytes += size
+            elif action == "linked":
+                stats.linked_files += 1
+                stats.linked_bytes += size
+            else:
+                stats.skipped_files += 1
+                stats.skipped_bytes += size
+
+    save_copy_manifest(manifest_path, manifest)
+    return stats
+
+
+# Location of a classpath entry inside the package: its mirrored path, or a jar for directories
+# when JAR_CLASS_DIRECTORIES is enabled
+def packaged_classpath_entry(path: str, target_directory: str) -> str:
+    target_path = mirror_path(path, target_directory)
+    if JAR_CLASS_DIRECTORIES and os.path.isdir(path):
+        return target_path.rstrip("\\/") + ".jar"
+    return target_path
+
+
+# Cheap fingerprint of a directory tree: relative paths, sizes and modification times of its files
+def directory_fingerprint(path: str) -> str:
+    digest = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            stat = os.stat(file_path)
+            digest.update(f"{os.path.relpath(file_path, path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+# Stream a directory straight into a compressed jar, without staging a copy.
+# Returns (number of files, uncompressed bytes).
+def jar_directory(source_dir: str, jar_path: str) -> tuple[int, int]:
+    os.makedirs(os.path.dirname(jar_path), exist_ok=True)
+    tmp_path = f"{jar_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        written = write_jar(source_dir, f)
+    os.replace(tmp_path, jar_path)
+    return written
+
+
+# Write a directory as a jar to a file object. Returns (number of files, uncompressed bytes).
+def write_jar(source_dir: str, f) -> tuple[int, int]:
+    files = 0
+    total_bytes = 0
+    with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED, strict_timestamps=False) as jar:
+        # The manifest goes first, as JarInputStream expects
+        manifest = os.path.join(source_dir, "META-INF", "MANIFEST.MF")
+        if os.path.isfile(manifest):
+            jar.write(manifest, "META-INF/MANIFEST.MF")
         else:
-            print(f"Path not found: {path}")
+            jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\r\nCreated-By: packRunningJava\r\n\r\n")
+
+        for dir_path, dir_names, file_names in os.walk(source_dir):
+            dir_names.sort()
+            # Directory entries, like jar writes them, so ClassLoader.getResources("com/example/") finds the
+            # package, as classpath scanning (Spring's classpath*:) does
+            if dir_path != source_dir:
+                jar.write(dir_path, os.path.relpath(dir_path, source_dir).replace(os.sep, "/") + "/")
+            for file_name in sorted(file_names):
+                file_path = os.path.join(dir_path, file_name)
+                arcname = os.path.relpath(file_path, source_dir).replace(os.sep, "/")
+                if arcname == "META-INF/MANIFEST.MF":
+                    continue
+                jar.write(file_path, arcname)
+                files += 1
+                total_bytes += os.path.getsize(file_path)
+    return files, total_bytes
+
+
+# Jar classpath directories in parallel, skipping directories whose fingerprint is unchanged
+def jar_class_directories(directories: list[str], target_directory: str) -> None:
+    manifest_path = os.path.join(target_directory, JAR_MANIFEST_NAME)
+    previous_manifest = load_copy_manifest(manifest_path)
+    manifest = {}
+    start = time.perf_counter()
+    jarred = skipped = failed = files = total_bytes = 0
+
+    def jar_if_changed(directory: str, jar_path: str) -> tuple[dict, tuple[int, int] | None]:
+        fingerprint = directory_fingerprint(directory)
+        previous = previous_manifest.get(os.path.relpath(jar_path, target_directory))
+        if (previous is not None and previous.get("source") == directory
+                and previous.get("fingerprint") == fingerprint and os.path.isfile(jar_path)):
+            return previous, None
+        return {"source": directory, "fingerprint": fingerprint}, jar_directory(directory, jar_path)
+
+    with ThreadPoolExecutor(max_workers=app_workers(JAR_WORKERS)) as executor:
+        futures = {}
+        for directory in directories:
+            jar_path = packaged_classpath_entry(directory, target_directory)
+            futures[executor.submit(jar_if_changed, directory, jar_path)] = (directory, jar_path)
+
+        for future in as_completed(futures):
+            directory, jar_path = futures[future]
+            try:
+                entry, written = future.result()
+            except Exception as e:
+                print(f"Error creating jar from {directory}: {e}")
+                failed += 1
+                continue
+
+            manifest[os.path.relpath(jar_path, target_directory)] = entry
+            if written is None:
+                skipped += 1
+            else:
+                jarred += 1
+                files += written[0]
+                total_bytes += written[1]
+                print(f"Jarred directory: {directory} -> {jar_path}")
+
+    save_copy_manifest(manifest_path, manifest)
+    print(f"Class directories: {jarred} jarred ({files} files, {format_bytes(total_bytes)}), "
+          f"{skipped} unchanged and skipped, {failed} failed in {time.perf_counter() - start:.2f}s")
+
+
+# Class name of a jar entry ("META-INF/versions/17/a/B$C.class" -> "a.B$C"), None for other entries
+def jar_entry_class(name: str) -> str | None:
+    if not name.endswith(".class"):
+        return None
+    name = re.sub(r"^META-INF/versions/\d+/", "", name)
+    return name[:-len(".class")].replace("/", ".")
+
+
+# Main section of a jar manifest as {lowercase name: value}, without Manifest-Version and Created-By
+def manifest_main_attributes(manifest: bytes) -> dict[str, str]:
+    return {name.lower(): value for name, value in read_manifest_attributes(manifest).items()}
+
+
+def is_signed_jar(names: list[str]) -> bool:
+    return any(name.upper().startswith("META-INF/") and name.upper().endswith((".SF", ".RSA", ".DSA", ".EC"))
+               for name in names)
+
+
+# Entries of a jar that trimming keeps: every resource, loaded classes and the classes enclosing them,
+# module-info and package-info, and entries matching TRIM_KEEP_PATTERNS
+def trimmed_entries(names: list[str], loaded_classes: set[str]) -> list[str]:
+    kept_classes = set()
+    for name in names:
+        class_name = jar_entry_class(name)
+        if class_name in loaded_classes:
+            # Outer classes are loaded lazily through the InnerClasses attribute
+            parts = class_name.split("$")
+            kept_classes.update("$".join(parts[:i]) for i in range(1, len(parts) + 1))
+    return [
+        name for name in names
+        if jar_entry_class(name) is None
+        or jar_entry_class(name) in kept_classes
+        or name.rsplit("/", 1)[-1] in ("module-info.class", "package-info.class")
+        or any(fnmatch.fnmatchcase(name, pattern) for pattern in TRIM_KEEP_PATTERNS)
+    ]
 
 
-# Copy additional directories and files
-def copy_extra_files(extra_list: list[str], pack_dir: str) -> None:
+# Write a copy of a jar with only the kept entries. Signed jars are copied whole, removing classes
+# would invalidate the signature. Returns (kept classes, total classes, signed).
+def write_trimmed_jar(source: str, f, kept_entries: list[str]) -> tuple[int, int, bool]:
+    with zipfile.ZipFile(source) as jar:
+        infos = jar.infolist()
+        names = [info.filename for info in infos]
+        total_classes = sum(1 for name in names if name.endswith(".class"))
+        if is_signed_jar(names):
+            with open(source, 'rb') as source_file:
+                shutil.copyfileobj(source_file, f, 1024 * 1024)
+            return total_classes, total_classes, True
+
+        kept = set(kept_entries)
+        with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as trimmed:
+            for info in infos:
+                if info.filename in kept:
+                    trimmed.writestr(info, jar.read(info))
+    return sum(1 for name in kept if name.endswith(".class")), total_classes, False
+
+
+# Trim dependency jars to the loaded classes in parallel, skipping jars whose source and kept
+# classes are unchanged since the last run. With an archive, the trimmed jars are added to it.
+def trim_jars(jobs: list[tuple[str, str]], loaded_classes: set[str], target_directory: str, archive: PackageArchive | None = None) -> CopyStats:
+    manifest_path = os.path.join(target_directory, TRIM_MANIFEST_NAME)
+    previous_manifest = load_copy_manifest(manifest_path) if archive is None else {}
+    manifest = {}
+    stats = CopyStats()
+    kept_classes = total_classes = signed = 0
+    source_bytes = 0
+
+    def trim_if_changed(source: str, target: str) -> tuple[dict, tuple[int, int, bool] | None, int]:
+        # Only the central directory is read to decide whether the trimmed jar changes
+        with zipfile.ZipFile(source) as jar:
+            kept_entries = trimmed_entries(jar.namelist(), loaded_classes)
+        entry = {"source": source, **file_signature(source),
+                 "kept": hashlib.sha256("\n".join(kept_entries).encode()).hexdigest()}
+        previous = previous_manifest.get(os.path.relpath(target, target_directory))
+        if (previous is not None and {key: previous.get(key) for key in entry} == entry
+                and os.path.isfile(target) and os.path.getsize(target) == previous.get("trimmed_size")):
+            return previous, None, previous["trimmed_size"]
+
+        if archive is not None:
+            buffer = io.BytesIO()
+            result = write_trimmed_jar(source, buffer, kept_entries)
+            archive.add_bytes(buffer.getvalue(), target)
+            return entry, result, buffer.tell()
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            result = write_trimmed_jar(source, f, kept_entries)
+        os.replace(tmp_path, target)
+        entry["trimmed_size"] = os.path.getsize(target)
+        return entry, result, entry["trimmed_size"]
+
+    with ThreadPoolExecutor(max_workers=app_workers(JAR_WORKERS)) as executor:
+        futures = {executor.submit(trim_if_changed, source, target): (source, target) for source, target in jobs}
+        for future in as_completed(futures):
+            source, target = futures[future]
+            try:
+                entry, result, size = future.result()
+            except Exception as e:
+                print(f"Error trimming {source}: {e}")
+                stats.failed.append(source)
+                continue
+
+            manifest[os.path.relpath(target, target_directory)] = entry
+            if result is None:
+                stats.skipped_files += 1
+                stats.skipped_bytes += size
+                continue
+            stats.copied_files += 1
+            stats.copied_bytes += size
+            source_bytes += entry["size"]
+            kept_classes += result[0]
+            total_classes += result[1]
+            signed += result[2]
+
+    if archive is None:
+        save_copy_manifest(manifest_path, manifest)
+    written = (f"; {kept_classes} of {total_classes} classes kept, "
+               f"{format_bytes(source_bytes)} -> {format_bytes(stats.copied_bytes)}") if stats.copied_files else ""
+    print(f"Trimmed jars: {stats.copied_files} written ({signed} signed and kept whole), "
+          f"{stats.skipped_files} unchanged and skipped{written}")
+    return stats
+
+
+# Split classpath entries into (jar files to trim, other entries)
+def split_trimmed_jars(classpath_list: list[str], target_directory: str) -> tuple[list[tuple[str, str]], list[str]]:
+    jars = [path for path in classpath_list if path.lower().endswith(".jar") and os.path.isfile(path)]
+    others = [path for path in classpath_list if path not in jars]
+    return [(jar, mirror_path(jar, target_directory)) for jar in dict.fromkeys(jars)], others
+
+
+# Add dependency files from classpath to the archive; class directories are jarred in memory
+# when JAR_CLASS_DIRECTORIES is enabled
+def archive_dependencies(classpath_list: list[str], target_directory: str, archive: PackageArchive, loaded_classes: set[str] | None = None) -> CopyStats:
+    stats = CopyStats()
+    if loaded_classes is not None:
+        jobs, classpath_list = split_trimmed_jars(classpath_list, target_directory)
+        trimmed = trim_jars(jobs, loaded_classes, target_directory, archive)
+        stats.copied_files += trimmed.copied_files
+        stats.copied_bytes += trimmed.copied_bytes
+        stats.failed += trimmed.failed
+    if JAR_CLASS_DIRECTORIES:
+        directories = [path for path in classpath_list if os.path.isdir(path)]
+        classpath_list = [path for path in classpath_list if path not in directories]
+        for directory in directories:
+            buffer = io.BytesIO()
+            write_jar(directory, buffer)
+            archive.add_bytes(buffer.getvalue(), packaged_classpath_entry(directory, target_directory))
+            stats.copied_files += 1
+            stats.copied_bytes += buffer.tell()
+
+    for source, target in plan_dependency_copies(classpath_list, target_directory):
+        try:
+            archive.add_file(source, target)
+            stats.copied_files += 1
+            stats.copied_bytes += os.path.getsize(source)
+        except OSError as e:
+            print(f"Error adding {source} to the archive: {e}")
+            stats.failed.append(source)
+    return stats
+
+
+# Resources of a small jar that must not occur in another jar of the same merged jar, or None when
+# the jar cannot be merged (unreadable, signed, with a jar index, or with manifest attributes beyond
+# MERGEABLE_MANIFEST_ATTRIBUTES, which the fresh manifest of a merged jar would lose, e.g.
+# Automatic-Module-Name, Implementation-Version or Add-Opens). Classes and other single
+# lookups resolve in a merged jar as on the original classpath, since the first copy is kept, but
+# ClassLoader.getResources (e.g. META-INF/spring.factories) would lose the other copies.
+# Services files are concatenated by the merge, so they may repeat.
+def mergeable_jar_resources(path: str) -> set[str] | None:
+    try:
+        with zipfile.ZipFile(path) as jar:
+            names = jar.namelist()
+            manifest = jar.read("META-INF/MANIFEST.MF") if "META-INF/MANIFEST.MF" in names else b""
+    except (OSError, zipfile.BadZipFile):
+        return None
+    if is_signed_jar(names) or "META-INF/INDEX.LIST" in names:
+        return None
+    if set(manifest_main_attributes(manifest)) - {name.lower() for name in MERGEABLE_MANIFEST_ATTRIBUTES}:
+        return None
+    return {
+        name for name in names
+        if not name.endswith(("/", ".class")) and name != "META-INF/MANIFEST.MF"
+        and not name.startswith("META-INF/services/")
+        and not any(fnmatch.fnmatchcase(name, pattern) for pattern in MERGE_JAR_IGNORED_DUPLICATES)
+    }
+
+
+# Group runs of consecutive small jars on the classpath into merged jars. A run ends at a large jar,
+# a directory or a jar that cannot be merged; a merged jar is also closed when it would exceed
+# MERGED_JAR_MAX_BYTES or a resource would repeat. Keeping the classpath order means the merged
+# jars resolve classes exactly as the original jars did.
+# Returns {source jar: merged jar} for the jars of every group of at least two.
+def plan_jar_merges(classpath_list: list[str], target_directory: str) -> dict[str, str]:
+    entries = list(dict.fromkeys(classpath_list))
+    small_jars = [path for path in entries if path.lower().endswith(".jar") and os.path.isfile(path)
+                  and os.path.getsize(path) < MERGE_JAR_MAX_BYTES]
+    with ThreadPoolExecutor(max_workers=app_workers(COPY_WORKERS)) as executor:
+        resources = dict(zip(small_jars, executor.map(mergeable_jar_resources, small_jars)))
+
+    groups = []
+    group, group_resources, group_bytes = [], set(), 0
+    for path in entries + [None]:
+        jar_resources = resources.get(path)
+        size = os.path.getsize(path) if jar_resources is not None else 0
+        if group and (jar_resources is None or group_resources & jar_resources or group_bytes + size > MERGED_JAR_MAX_BYTES):
+            if len(group) > 1:
+                groups.append(group)
+            group, group_resources, group_bytes = [], set(), 0
+        if jar_resources is not None:
+            group.append(path)
+            group_resources |= jar_resources
+            group_bytes += size
+
+    merged_jars = {}
+    for index, group in enumerate(groups):
+        # Named after its sources, so a changed grouping never reuses a stale merged jar
+        digest = hashlib.sha256("\n".join(group).encode()).hexdigest()[:12]
+        merged_path = os.path.join(target_directory, "merged", f"merged-{index + 1:03d}-{digest}.jar")
+        for path in group:
+            merged_jars[path] = merged_path
+    return merged_jars
+
+
+# Build the merged jars of a merge plan, or add them to the archive. Merged jars whose sources are
+# unchanged since the last run are skipped, and merged jars that are no longer planned are removed.
+def merge_small_jars(merged_jars: dict[str, str], target_directory: str, archive: PackageArchive | None = None) -> CopyStats:
+    start = time.perf_counter()
+    groups: dict[str, list[str]] = {}
+    for source, merged_path in merged_jars.items():
+        groups.setdefault(merged_path, []).append(source)
+
+    manifest_path = os.path.join(target_directory, MERGE_MANIFEST_NAME)
+    previous_manifest = load_copy_manifest(manifest_path) if archive is None else {}
+    manifest = {}
+    stats = CopyStats()
+    for merged_path, sources in groups.items():
+        key = os.path.relpath(merged_path, target_directory)
+        try:
+            signature = [[source, *file_signature(source).values()] for source in sources]
+            if archive is None and previous_manifest.get(key) == signature and os.path.isfile(merged_path):
+                manifest[key] = signature
+                stats.skipped_files += 1
+                stats.skipped_bytes += os.path.getsize(merged_path)
+                continue
+            output = merged_path if archive is None else os.path.join(archive.temp_dir(), os.path.basename(merged_path))
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            merge_jars(sources, output, {}, merge_services=True, workers=app_workers(COPY_WORKERS))
+            if archive is not None:
+                archive.add_file(output, merged_path)
+            manifest[key] = signature
+            stats.copied_files += 1
+            stats.copied_bytes += os.path.getsize(output)
+        except Exception as e:
+            print(f"Error merging {len(sources)} jars into {merged_path}: {e}")
+            stats.failed.append(merged_path)
+
+    if archive is None:
+        merged_dir = os.path.join(target_directory, "merged")
+        for file_name in os.listdir(merged_dir) if os.path.isdir(merged_dir) else []:
+            if os.path.join(merged_dir, file_name) not in groups:
+                os.remove(os.path.join(merged_dir, file_name))
+        save_copy_manifest(manifest_path, manifest)
+    print(f"Merged {len(merged_jars)} small jars into {len(groups)} jars: {stats.copied_files} written, "
+          f"{stats.skipped_files} unchanged, {len(stats.failed)} failed in {time.perf_counter() - start:.2f}s")
+    return stats
+
+
+# Copy dependency files from classpath, or add them to the archive.
+# With loaded_classes, classpath jars are trimmed to the loaded classes instead of copied;
+# jars in merged_jars (from plan_jar_merges) are merged instead, and not trimmed.
+def copy_dependencies(classpath_list: list[str], target_directory: str, archive: PackageArchive | None = None, loaded_classes: set[str] | None = None, merged_jars: dict[str, str] | None = None) -> CopyStats:
+    merged = None
+    if merged_jars:
+        merged = merge_small_jars(merged_jars, target_directory, archive)
+        classpath_list = [path for path in classpath_list if path not in merged_jars]
+
+    if archive is not None:
+        start = time.perf_counter()
+        stats = archive_dependencies(classpath_list, target_directory, archive, loaded_classes)
+        if merged is not None:
+            stats.copied_files += merged.copied_files
+            stats.copied_bytes += merged.copied_bytes
+            stats.failed += merged.failed
+        print(f"Dependencies: {stats.summary(time.perf_counter() - start)}")
+        return stats
+
+    if not os.path.exists(target_directory):
+        os.makedirs(target_directory)
+
+    start = time.perf_counter()
+    planned = set(merged_jars.values()) if merged_jars else set()
+    if JAR_CLASS_DIRECTORIES:
+        directories = [path for path in classpath_list if os.path.isdir(path)]
+        classpath_list = [path for path in classpath_list if path not in directories]
+        if directories:
+            jar_class_directories(directories, target_directory)
+        planned.update(packaged_classpath_entry(directory, target_directory) for directory in directories)
+
+    trimmed = None
+    if loaded_classes is not None:
+        trim_jobs, classpath_list = split_trimmed_jars(classpath_list, target_directory)
+        trimmed = trim_jars(trim_jobs, loaded_classes, target_directory)
+        planned.update(target for _, target in trim_jobs)
+
+    jobs = plan_dependency_copies(classpath_list, target_directory)
+    stats = copy_files(jobs, os.path.join(target_directory, COPY_MANIFEST_NAME))
+    planned.update(target for _, target in jobs)
+    prune_dependencies(target_directory, planned)
+    for extra in (trimmed, merged):
+        if extra is not None:
+            stats.copied_files += extra.copied_files
+            stats.copied_bytes += extra.copied_bytes
+            stats.skipped_files += extra.skipped_files
+            stats.skipped_bytes += extra.skipped_bytes
+            stats.failed += extra.failed
+    print(f"Dependencies: {stats.summary(time.perf_counter() - start)}")
+    print(f"Copy methods: {FILE_COPIER.summary()}")
+    return stats
+
+
+# Remove the files of the dependency directory that are not planned, e.g. jars that left the classpath,
+# so they are neither shipped nor kept by applied delta packages. The packer's own manifests stay.
+def prune_dependencies(target_directory: str, planned: set[str]) -> None:
+    planned = {os.path.abspath(path) for path in planned}
+    removed = 0
+    for dir_path, _, file_names in os.walk(target_directory, topdown=False):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            if os.path.abspath(path) not in planned and not is_packer_file(file_name):
+                os.remove(path)
+                removed += 1
+        if dir_path != target_directory and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+    if removed:
+        print(f"Removed {removed} dependency files that are no longer on the classpath")
+
+
+# Copy additional directories and files, or add them to the archive
+def copy_extra_files(extra_list: list[str], pack_dir: str, archive: PackageArchive | None = None) -> None:
     for item in extra_list:
         if os.path.exists(item):
             dest = os.path.join(pack_dir, os.path.basename(item))
             try:
-                if os.path.isdir(item):
-                    shutil.copytree(item, dest, dirs_exist_ok=True)
+                if archive is not None:
+                    if os.path.isdir(item):
+                        archive.add_tree(item, dest)
+                    else:
+                        archive.add_file(item, dest)
+                    print(f"Added to the archive: {item} -> {archive.name(dest)}")
+                elif os.path.isdir(item):
+                    shutil.copytree(item, dest, copy_function=copy_file, dirs_exist_ok=True)
                     print(f"Copied directory: {item} -> {dest}")
                 elif os.path.isfile(item):
-                    shutil.copy(item, dest)
+                    copy_file(item, dest)
                     print(f"Copied file: {item} -> {dest}")
             except Exception as e:
                 print(f"Error copying {item}: {e}")
@@ -220,29 +1136,151 @@ def copy_extra_files(extra_list: list[str], pack_dir: str) -> None:
             print(f"Extra file or directory not found: {item}")
 
 
+# Split JVM arguments and drop -javaagent arguments that reference IDE-specific paths
+def filter_ide_jvm_args(jvm_args: str | None) -> list[str]:
+    return [
+        arg for arg in (jvm_args.split() if jvm_args else [])
+        if not (arg.startswith("-javaagent:") and ("idea_rt.jar" in arg or "eclipse" in arg))
+    ]
+
+
+# Arguments that put the replayed flags of jvm.options in front of the captured JVM arguments
+def jvm_options_args() -> list[str]:
+    return [f"@{JVM_OPTIONS_FILE_NAME}"] if REPLAY_JVM_FLAGS else []
+
+
+# Names of the flags that JVM arguments set explicitly, including the -X shorthands. Heap sizes given
+# relative to the RAM (MaxRAMPercentage, MaxRAM, ...) count as setting the heap sizes: the sizes they
+# resolved to on the original host must not be pinned on another one.
+def explicit_flag_names(jvm_args: list[str]) -> set[str]:
+    shorthands = {"-Xmx": ("MaxHeapSize",), "-Xms": ("InitialHeapSize", "MinHeapSize"), "-Xss": ("ThreadStackSize",),
+                  "-Xmn": ("NewSize", "MaxNewSize")}
+    heap_sizes = ("MaxHeapSize", "InitialHeapSize", "MinHeapSize")
+    names = set()
+    for arg in jvm_args:
+        match = re.match(r"-XX:[+-]?(\w+)", arg)
+        if match:
+            names.add(match.group(1))
+            if re.fullmatch(r"(Max|Initial|Min)RAM(Percentage|Fraction)|MaxRAM", match.group(1)):
+                names.update(heap_sizes)
+        names.update(*(flags for prefix, flags in shorthands.items() if arg.startswith(prefix)))
+    return names
+
+
+# Flags of the running JVM worth replaying: performance relevant ones (REPLAY_JVM_FLAG_PATTERNS) whose
+# value the JVM ergonomics chose on the original host (or a management client set), e.g. the GC, heap
+# or compiler threads. Flags the JVM arguments set are left to them.
+def replayed_jvm_flags(snapshot: JvmSnapshot) -> list[str]:
+    explicit = explicit_flag_names(filter_ide_jvm_args(snapshot.jvm_args))
+    replayed = []
+    for name, (value, origin) in sorted((snapshot.flag_origins or {}).items()):
+        if origin not in ("ergonomic", "management") or name in explicit:
+            continue
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in REPLAY_JVM_FLAG_PATTERNS):
+            replayed.append(f"-XX:{'+' if value == 'true' else '-'}{name}" if value in ("true", "false") else f"-XX:{name}={value}")
+    return replayed
+
+
+# Write jvm.options, a Java argument file (JDK 9+) with the replayed flags, to pack_dir or the archive.
+# It is written even without flags to replay, so it can be edited and the launchers always use it.
+def write_jvm_options(snapshot: JvmSnapshot, pack_dir: str, archive: PackageArchive | None = None) -> None:
+    if snapshot.flag_origins is None:
+        print("Warning: the flags of the running JVM are not available, no flags replayed")
+    replayed = replayed_jvm_flags(snapshot)
+
+    lines = [
+        f"# JVM options of {snapshot.main_class}, read by the launchers before the captured JVM arguments.",
+        f"# Flags the JVM ergonomics chose on {platform.node()} (PID {snapshot.pid}), from jcmd VM.flags -all.",
+        "# Edit freely; JAVA_OPTS still overrides them.",
+        *replayed,
+    ]
+    content = "".join(line + "\n" for line in lines).encode()
+
+    path = os.path.join(pack_dir, JVM_OPTIONS_FILE_NAME)
+    if archive is not None:
+        archive.add_bytes(content, path)
+        print(f"JVM options added to the archive: {archive.name(path)} ({len(replayed)} replayed flags)")
+        return
+    with open(path, 'wb') as f:
+        f.write(content)
+    print(f"JVM options created: {path} ({len(replayed)} replayed flags{': ' + ' '.join(replayed) if replayed else ''})")
+
+
+# Classpath of the package: the packaged location of every classpath entry, with the merged jars
+# of merged_jars in place of the jars merged into them
+def packaged_classpath(classpath_list: list[str], target_directory: str, merged_jars: dict[str, str] | None = None) -> list[str]:
+    merged_jars = merged_jars or {}
+    return list(dict.fromkeys(merged_jars.get(p) or packaged_classpath_entry(p, target_directory) for p in classpath_list))
+
+
+# Launcher arguments that read the classpath from the file written by write_classpath_files,
+# or None when LAUNCHER_CLASSPATH is "inline"
+def classpath_file_args(windows: bool) -> list[str] | None:
+    if LAUNCHER_CLASSPATH == "argfile":
+        return ["@classpath-windows.args" if windows else "@classpath-unix.args"]
+    if LAUNCHER_CLASSPATH == "manifest":
+        return ["-cp", "classpath.jar"]
+    return None
+
+
+# Write the classpath for the launchers into pack_dir, or the archive: Java argument files
+# (JDK 9+) for LAUNCHER_CLASSPATH "argfile", or a jar with only a manifest whose Class-Path
+# lists the classpath for "manifest". Both keep the command line short, below the Windows
+# limit, however many entries the classpath has.
+def write_classpath_files(classpath_list: list[str], target_directory: str, pack_dir: str, merged_jars: dict[str, str] | None = None, archive: PackageArchive | None = None) -> None:
+    if LAUNCHER_CLASSPATH == "inline":
+        return
+    if LAUNCHER_CLASSPATH not in ("argfile", "manifest"):
+        raise PackError(f"Unknown LAUNCHER_CLASSPATH {LAUNCHER_CLASSPATH!r}, expected 'inline', 'argfile' or 'manifest'.")
+    # Forward slashes work on Windows too, and are not escapes in argument files
+    classpath = [os.path.relpath(path, start=pack_dir).replace("\\", "/")
+                 for path in packaged_classpath(classpath_list, target_directory, merged_jars)]
+    files = {}
+    if LAUNCHER_CLASSPATH == "argfile":
+        for file_name, separator in (("classpath-windows.args", ";"), ("classpath-unix.args", ":")):
+            files[file_name] = f'-cp "{separator.join(classpath)}"\n'.encode()
+    else:
+        directories = {packaged_classpath_entry(p, target_directory) for p in classpath_list
+                       if os.path.isdir(p) and not JAR_CLASS_DIRECTORIES}
+        directories = {os.path.relpath(path, start=pack_dir).replace("\\", "/") for path in directories}
+        urls = [urllib.parse.quote(path) + ("/" if path in directories else "") for path in classpath]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as jar:
+            # A fixed timestamp keeps the jar identical, and out of delta packages, while the classpath is
+            jar.writestr(zipfile.ZipInfo("META-INF/MANIFEST.MF", (1980, 1, 1, 0, 0, 0)),
+                         jar_manifest({"Class-Path": " ".join(urls)}), zipfile.ZIP_DEFLATED)
+        files["classpath.jar"] = buffer.getvalue()
+
+    for file_name, content in files.items():
+        path = os.path.join(pack_dir, file_name)
+        if archive is not None:
+            archive.add_bytes(content, path)
+            print(f"Classpath file added to the archive: {archive.name(path)}")
+            continue
+        with open(path, 'wb') as f:
+            f.write(content)
+        print(f"Classpath file created: {path} ({len(classpath)} entries)")
+
+
 # Generate .bat file to launch Java program
-def create_bat_file(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None = None, prog_args: list[str] | str | None = None) -> None:
+def create_bat_file(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None = None, prog_args: list[str] | str | None = None, cds_archive: str | None = None, pack_dir: str | None = None, archive: PackageArchive | None = None, merged_jars: dict[str, str] | None = None) -> None:
+    pack_dir = pack_dir or PACK_DIR
     classpath = ";".join([
-        os.path.relpath(os.path.join(target_directory, os.path.splitdrive(p)[0].lower().rstrip(':'), os.path.splitdrive(p)[1].lstrip("\\")), start=PACK_DIR)
-        for p in classpath_list
+        os.path.relpath(path, start=pack_dir)
+        for path in packaged_classpath(classpath_list, target_directory, merged_jars)
     ])
     
     # Remove any -javaagent arguments that reference IDE-specific paths
-    jvm_args_parts = jvm_args.split()
-    filtered_jvm_args = []
-    i = 0
-    while i < len(jvm_args_parts):
-        if jvm_args_parts[i].startswith("-javaagent:") and ("idea_rt.jar" in jvm_args_parts[i] or "eclipse" in jvm_args_parts[i]):
-            # Skip IDE-specific agent
-            i += 1
-        else:
-            filtered_jvm_args.append(jvm_args_parts[i])
-            i += 1
+    filtered_jvm_args = jvm_options_args() + filter_ide_jvm_args(jvm_args)
+    if cds_archive:
+        filtered_jvm_args.append(f"-XX:SharedArchiveFile={cds_archive}")
     
     jvm_args = " ".join(filtered_jvm_args)
     
     # Build the full Java command
-    java_command = f'custom-jre\\bin\\java {jvm_args} -cp "{classpath}" {main_class}'
+    # JAVA_OPTS from the environment comes after the captured JVM arguments, so it can override them
+    classpath_option = " ".join(classpath_file_args(windows=True) or [f'-cp "{classpath}"'])
+    java_command = f'custom-jre\\bin\\java {jvm_args} %JAVA_OPTS% {classpath_option} {main_class}'
     
     # Add program arguments if available
     if prog_args:
@@ -251,47 +1289,44 @@ def create_bat_file(main_class: str, classpath_list: list[str], target_directory
         else:
             java_command += f' {prog_args}'
     
-    output_bat = os.path.join(PACK_DIR, "start_program.bat")
+    output_bat = os.path.join(pack_dir, "start_program.bat")
+    lines = ["@echo off", f"echo Starting {main_class}...", java_command]
+
+    if archive is not None:
+        archive.add_bytes("".join(line + "\r\n" for line in lines).encode(), output_bat)
+        print(f".bat file added to the archive: {archive.name(output_bat)}")
+        return
 
     with open(output_bat, 'w') as f:
-        f.write(f"@echo off\n")
-        f.write(f"echo Starting {main_class}...\n")
-        f.write(f"{java_command}\n")
+        for line in lines:
+            f.write(f"{line}\n")
     
     print(f".bat file created: {output_bat}")
 
 # Generate .sh file to launch Java program on Linux
-def create_sh_file(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None = None, prog_args: list[str] | str | None = None) -> None:
+def create_sh_file(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None = None, prog_args: list[str] | str | None = None, cds_archive: str | None = None, pack_dir: str | None = None, archive: PackageArchive | None = None, merged_jars: dict[str, str] | None = None) -> None:
+    pack_dir = pack_dir or PACK_DIR
+
     # For Linux, we need to convert Windows paths to Linux paths
     # Replace backslashes with forward slashes and handle drive letters
-    def convert_to_linux_path(path: str) -> str:
-        # Remove drive letter and convert backslashes to forward slashes
-        drive, tail = os.path.splitdrive(path)
-        drive_letter = drive.lower().rstrip(':')
-        linux_path = os.path.join(target_directory, drive_letter, tail.lstrip("\\")).replace("\\", "/")
-        return os.path.relpath(linux_path, start=PACK_DIR).replace("\\", "/")
+    def convert_to_linux_path(packaged_path: str) -> str:
+        return os.path.relpath(packaged_path, start=pack_dir).replace("\\", "/")
     
     # Create classpath with Linux path separator (:)
-    classpath = ":".join([convert_to_linux_path(p) for p in classpath_list])
+    classpath = ":".join([convert_to_linux_path(p) for p in packaged_classpath(classpath_list, target_directory, merged_jars)])
     
-    # Remove any -javaagent arguments that reference IDE-specific paths
-    jvm_args_parts = jvm_args.split() if jvm_args else []
-    filtered_jvm_args = []
-    i = 0
-    while i < len(jvm_args_parts):
-        if jvm_args_parts[i].startswith("-javaagent:") and ("idea_rt.jar" in jvm_args_parts[i] or "eclipse" in jvm_args_parts[i]):
-            # Skip IDE-specific agent
-            i += 1
-        else:
-            # Convert any Windows paths in JVM args to Linux format
-            arg = jvm_args_parts[i].replace("\\", "/")
-            filtered_jvm_args.append(arg)
-            i += 1
+    # Remove any -javaagent arguments that reference IDE-specific paths,
+    # and convert any Windows paths in JVM args to Linux format
+    filtered_jvm_args = jvm_options_args() + [arg.replace("\\", "/") for arg in filter_ide_jvm_args(jvm_args)]
+    if cds_archive:
+        filtered_jvm_args.append(f"-XX:SharedArchiveFile={cds_archive}")
     
     jvm_args = " ".join(filtered_jvm_args)
     
     # Build the full Java command with Linux path separators
-    java_command = f'./custom-jre/bin/java {jvm_args} -cp "{classpath}" {main_class}'
+    # exec, so signals reach the JVM; JAVA_OPTS from the environment comes after the captured JVM arguments, so it can override them
+    classpath_option = " ".join(classpath_file_args(windows=False) or [f'-cp "{classpath}"'])
+    java_command = f'exec ./custom-jre/bin/java {jvm_args} $JAVA_OPTS {classpath_option} {main_class}'
     
     # Add program arguments if available
     if prog_args:
@@ -300,12 +1335,17 @@ def create_sh_file(main_class: str, classpath_list: list[str], target_directory:
         else:
             java_command += f' {prog_args}'
     
-    output_sh = os.path.join(PACK_DIR, "start_program.sh")
+    output_sh = os.path.join(pack_dir, "start_program.sh")
+    lines = ["#!/bin/bash", f"echo Starting {main_class}...", java_command]
+
+    if archive is not None:
+        archive.add_bytes("".join(line + "\n" for line in lines).encode(), output_sh, 0o755)
+        print(f".sh file added to the archive: {archive.name(output_sh)}")
+        return
 
     with open(output_sh, 'w', newline='\n') as f:  # Use Unix line endings
-        f.write("#!/bin/bash\n")
-        f.write(f"echo Starting {main_class}...\n")
-        f.write(f"{java_command}\n")
+        for line in lines:
+            f.write(f"{line}\n")
     
     # Make the shell script executable
     try:
@@ -316,6 +1356,301 @@ def create_sh_file(main_class: str, classpath_list: list[str], target_directory:
         print(f"Warning: Could not make the script executable: {e}")
 
 
+# Start a command and wait until it prints a line matching ready_pattern, exits, or timeout passes.
+# Without a pattern only exit or timeout end the wait. Output keeps being drained in the background.
+# Returns (process, seconds until the ready line, or None).
+def run_until_ready(command: list[str], cwd: str, ready_pattern: re.Pattern | None, timeout: float) -> tuple[subprocess.Popen, float | None]:
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, errors='replace')
+    ready = threading.Event()
+    ready_after = []
+
+    def drain_output() -> None:
+        for line in process.stdout:
+            if ready_pattern is not None and not ready.is_set() and ready_pattern.search(line):
+                ready_after.append(time.perf_counter() - start)
+                ready.set()
+        ready.set()
+
+    threading.Thread(target=drain_output, daemon=True).start()
+    ready.wait(timeout)
+    return process, ready_after[0] if ready_after else None
+
+
+# Stop a process, politely first so shutdown hooks (and the CDS dump) run
+def stop_process(process: subprocess.Popen, grace_seconds: float = 60) -> None:
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(grace_seconds)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# Java command that runs the packaged app from its pack directory with the custom JRE
+def packaged_java_command(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None, prog_args: list[str], extra_jvm_args: list[str], pack_dir: str | None = None, merged_jars: dict[str, str] | None = None) -> list[str]:
+    pack_dir = pack_dir or PACK_DIR
+    classpath = os.pathsep.join(
+        os.path.relpath(path, start=pack_dir) for path in packaged_classpath(classpath_list, target_directory, merged_jars)
+    )
+    return [
+        # Absolute, since the command runs with pack_dir as its working directory
+        os.path.join(os.path.abspath(pack_dir), "custom-jre", "bin", "java.exe" if is_windows() else "java"),
+        *jvm_options_args(),
+        *filter_ide_jvm_args(jvm_args),
+        *extra_jvm_args,
+        *(classpath_file_args(is_windows()) or ["-cp", classpath]),
+        main_class,
+        *prog_args,
+    ]
+
+
+# Run the packaged app once to record a dynamic AppCDS archive in its pack directory.
+# Training ends when CDS_READY_MARKER appears, the app exits, or CDS_TRAINING_SECONDS pass.
+# Returns the archive path relative to the pack directory, or None if no archive was produced.
+def train_cds_archive(main_class: str, classpath_list: list[str], target_directory: str, jvm_args: str | None, prog_args: list[str], pack_dir: str | None = None, merged_jars: dict[str, str] | None = None) -> str | None:
+    pack_dir = pack_dir or PACK_DIR
+    archive_path = os.path.join(pack_dir, CDS_ARCHIVE_NAME)
+    if os.path.exists(archive_path):
+        os.remove(archive_path)
+    ready_pattern = re.compile(CDS_READY_MARKER) if CDS_READY_MARKER else None
+
+    # TerminateProcess on Windows skips the JVM exit path, so the archive is dumped with jcmd instead
+    if is_windows():
+        record_args = ["-XX:+RecordDynamicDumpInfo"]
+    else:
+        record_args = [f"-XX:ArchiveClassesAtExit={CDS_ARCHIVE_NAME}"]
+    command = packaged_java_command(main_class, classpath_list, target_directory, jvm_args, prog_args, record_args, pack_dir, merged_jars)
+
+    print(f"Training CDS archive for up to {CDS_TRAINING_SECONDS}s...")
+    process, ready_after = run_until_ready(command, pack_dir, ready_pattern, CDS_TRAINING_SECONDS)
+    if ready_after is not None:
+        print(f"Ready marker seen after {ready_after:.2f}s")
+    if is_windows() and process.poll() is None:
+        jcmd_executable = os.path.join(JDK_PATH, "bin", "jcmd.exe")
+        subprocess.run([jcmd_executable, str(process.pid), "VM.cds", "dynamic_dump", archive_path],
+                       capture_output=True, timeout=300)
+    stop_process(process)
+
+    if not os.path.isfile(archive_path):
+        print(f"CDS archive was not created: {archive_path}")
+        return None
+    print(f"CDS archive created: {archive_path} ({format_bytes(os.path.getsize(archive_path))})")
+
+    if CDS_MEASURE_STARTUP:
+        # Time to the ready marker, or to the first output line when no marker is configured
+        measure_pattern = ready_pattern or re.compile(r"\S")
+        timings = {}
+        for label, extra_args in (("without CDS", []), ("with CDS", [f"-XX:SharedArchiveFile={CDS_ARCHIVE_NAME}"])):
+            command = packaged_java_command(main_class, classpath_list, target_directory, jvm_args, prog_args, extra_args, pack_dir, merged_jars)
+            process, ready_after = run_until_ready(command, pack_dir, measure_pattern, CDS_TRAINING_SECONDS)
+            process.kill()
+            process.wait()
+            timings[label] = ready_after
+        print("Startup time: " + ", ".join(
+            f"{label} {seconds:.2f}s" if seconds is not None else f"{label} not measured"
+            for label, seconds in timings.items()))
+
+    return CDS_ARCHIVE_NAME
+
+
+# Files of the package in PACK_DIR that are bookkeeping of the packer, not part of a release
+def is_packer_file(relative_path: str) -> bool:
+    return (os.path.basename(relative_path) in (COPY_MANIFEST_NAME, JAR_MANIFEST_NAME, TRIM_MANIFEST_NAME, MERGE_MANIFEST_NAME, RELEASE_MANIFEST_NAME)
+            or relative_path == "pack-profile.json")
+
+
+def load_release_manifest(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get("files", {})
+
+
+def release_manifest_json(files: dict[str, dict]) -> bytes:
+    manifest = {"version": 1, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "files": files}
+    return json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+
+
+# Size and SHA-256 of every file under pack_dir, keyed by its "/"-separated relative path.
+# Hashes recorded in the last manifest are reused for files whose size and mtime are unchanged.
+def build_release_manifest(pack_dir: str) -> dict[str, dict]:
+    previous = load_release_manifest(os.path.join(pack_dir, RELEASE_MANIFEST_NAME))
+    files = {}
+    to_hash = []
+    for dir_path, dir_names, file_names in os.walk(pack_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(path, pack_dir).replace(os.sep, "/")
+            if is_packer_file(relative_path):
+                continue
+            stat = os.stat(path)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+            known = previous.get(relative_path)
+            if known and known.get("size") == entry["size"] and known.get("mtime") == entry["mtime"]:
+                entry["sha256"] = known["sha256"]
+            else:
+                to_hash.append(relative_path)
+            files[relative_path] = entry
+
+    with ThreadPoolExecutor(max_workers=max(1, HASH_WORKERS)) as executor:
+        digests = executor.map(hash_file, (os.path.join(pack_dir, path) for path in to_hash))
+        for relative_path, digest in zip(to_hash, digests):
+            files[relative_path]["sha256"] = digest
+    print(f"Release manifest: {len(files)} files, {len(files) - len(to_hash)} hashes reused")
+    return files
+
+
+# Compare two manifests: (added or changed paths, removed paths)
+def diff_release_manifests(previous: dict[str, dict], current: dict[str, dict]) -> tuple[list[str], list[str]]:
+    changed = sorted(path for path, entry in current.items()
+                     if previous.get(path, {}).get("sha256") != entry["sha256"])
+    removed = sorted(path for path in previous if path not in current)
+    return changed, removed
+
+
+DELTA_APPLY_SH = """#!/bin/bash
+# Apply this delta to an installed release: ./apply_delta.sh <install dir>
+set -e
+DELTA_DIR="$(cd "$(dirname "$0")" && pwd)"
+TARGET="${1:?usage: $0 <install dir>}"
+BASE_SHA256="%(base_sha256)s"
+if command -v sha256sum >/dev/null 2>&1; then
+    ACTUAL="$(sha256sum "$TARGET/%(manifest)s" 2>/dev/null | cut -d' ' -f1)"
+elif command -v shasum >/dev/null 2>&1; then
+    ACTUAL="$(shasum -a 256 "$TARGET/%(manifest)s" 2>/dev/null | cut -d' ' -f1)"
+else
+    echo "sha256sum or shasum is needed to verify $TARGET" >&2
+    exit 1
+fi
+if [ "$ACTUAL" != "$BASE_SHA256" ]; then
+    echo "$TARGET is not the release this delta was made for" >&2
+    exit 1
+fi
+while IFS= read -r path; do
+    [ -n "$path" ] && rm -f "$TARGET/$path"
+done < "$DELTA_DIR/removed.txt"
+cp -R "$DELTA_DIR/files/." "$TARGET/"
+echo "Delta applied to $TARGET"
+"""
+
+DELTA_APPLY_BAT = r"""@echo off
+rem Apply this delta to an installed release: apply_delta.bat <install dir>
+setlocal enabledelayedexpansion
+if "%%~1"=="" (
+    echo usage: %%~nx0 ^<install dir^>
+    exit /b 1
+)
+set "TARGET=%%~f1"
+set "BASE_SHA256=%(base_sha256)s"
+set "ACTUAL="
+for /f "skip=1 delims=" %%%%h in ('certutil -hashfile "%%TARGET%%\%(manifest)s" SHA256 2^>nul') do if not defined ACTUAL set "ACTUAL=%%%%h"
+if defined ACTUAL set "ACTUAL=!ACTUAL: =!"
+if /i not "!ACTUAL!"=="%%BASE_SHA256%%" (
+    echo %%TARGET%% is not the release this delta was made for
+    exit /b 1
+)
+for /f "usebackq delims=" %%%%f in ("%%~dp0removed.txt") do (
+    set "file=%%%%f"
+    if exist "%%TARGET%%\!file:/=\!" del /q "%%TARGET%%\!file:/=\!"
+)
+xcopy "%%~dp0files" "%%TARGET%%" /E /I /Y /Q >nul
+echo Delta applied to %%TARGET%%
+"""
+
+
+# Whether path is empty or a delta package written earlier, which write_delta_package may replace
+def is_delta_directory(path: str) -> bool:
+    if not os.path.isdir(path):
+        return False
+    names = set(os.listdir(path))
+    return not names or names == {"files", "removed.txt", "apply_delta.sh", "apply_delta.bat"}
+
+
+# Write the delta between the previous release and pack_dir: changed files under files/,
+# removed.txt, the new manifest and apply scripts. The output is a directory or, for a
+# .zip/.tar.gz path, an archive.
+def write_delta_package(pack_dir: str, previous_manifest_path: str, current: dict[str, dict], manifest_content: bytes, output: str) -> None:
+    previous = load_release_manifest(previous_manifest_path)
+    if not previous:
+        print(f"Previous release manifest not found or empty: {previous_manifest_path}, no delta written")
+        return
+    changed, removed = diff_release_manifests(previous, current)
+    with open(previous_manifest_path, 'rb') as f:
+        base_sha256 = hashlib.sha256(f.read()).hexdigest()
+    scripts = {"manifest": RELEASE_MANIFEST_NAME, "base_sha256": base_sha256}
+
+    to_archive = output.endswith((".zip", ".tar.gz", ".tgz"))
+    if to_archive:
+        delta = PackageArchive(output, output)
+    else:
+        if os.path.exists(output):
+            if not is_delta_directory(output):
+                raise PackError(f"DELTA_OUTPUT {output} exists and is not a delta package, not overwriting it")
+            shutil.rmtree(output)
+        os.makedirs(os.path.join(output, "files"))
+    try:
+        def add_bytes(data: bytes, relative_path: str, mode: int = 0o644) -> None:
+            target = os.path.join(output, relative_path)
+            if to_archive:
+                delta.add_bytes(data, target, mode)
+                return
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            os.chmod(target, mode)
+
+        for path in changed:
+            source = os.path.join(pack_dir, path)
+            target = os.path.join(output, "files", path)
+            if to_archive:
+                delta.add_file(source, target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                copy_file(source, target)  # Not a hardlink: launchers in PACK_DIR are rewritten in place
+        add_bytes(manifest_content, os.path.join("files", RELEASE_MANIFEST_NAME))
+        add_bytes("".join(path + "\n" for path in removed).encode('utf-8'), "removed.txt")
+        add_bytes((DELTA_APPLY_SH % scripts).encode(), "apply_delta.sh", 0o755)
+        add_bytes((DELTA_APPLY_BAT % scripts).replace("\n", "\r\n").encode(), "apply_delta.bat")
+    except BaseException:
+        if to_archive:
+            delta.abort()
+        raise
+    if to_archive:
+        delta.close()
+
+    delta_bytes = sum(current[path]["size"] for path in changed)
+    total_bytes = sum(entry["size"] for entry in current.values())
+    print(f"Delta package written to {output}: {len(changed)} added or changed, {len(removed)} removed, "
+          f"{format_bytes(delta_bytes)} of {format_bytes(total_bytes)} "
+          f"({delta_bytes / total_bytes if total_bytes else 0:.1%})")
+
+
+# Write the release manifest of the package and, given PREVIOUS_RELEASE_MANIFEST, the delta package.
+# With an archive the manifest is built from the digests taken while streaming; deltas need PACK_DIR.
+def write_release(archive: PackageArchive | None = None) -> None:
+    if archive is not None:
+        files = {name: digest for name, digest in archive.digests.items() if not is_packer_file(name)}
+        archive.add_bytes(release_manifest_json(files), os.path.join(PACK_DIR, RELEASE_MANIFEST_NAME))
+        if PREVIOUS_RELEASE_MANIFEST:
+            print("Delta packages are built from PACK_DIR and are not written with ARCHIVE_OUTPUT")
+        return
+
+    files = build_release_manifest(PACK_DIR)
+    content = release_manifest_json(files)
+    with open(os.path.join(PACK_DIR, RELEASE_MANIFEST_NAME), 'wb') as f:
+        f.write(content)
+    if PREVIOUS_RELEASE_MANIFEST:
+        write_delta_package(PACK_DIR, PREVIOUS_RELEASE_MANIFEST, files, content,
+                            DELTA_OUTPUT or os.path.abspath(PACK_DIR).rstrip("\\/") + "-delta")
+
+
 def validate_jdk_path() -> str:
     """
     Validate if JDK_PATH exists and contains necessary JDK files.
@@ -357,61 +1692,572 @@ def validate_jdk_path() -> str:
     print(f"Using JDK path: {JDK_PATH}")
     return JDK_PATH
 
-def main() -> None:
-    # Validate JDK_PATH and potentially update it
-    JDK_PATH = validate_jdk_path()
+# Raised by a stage to stop packing with a message instead of a traceback
+class PackError(Exception):
+    pass
+
+
+# A unit of the packing pipeline. action receives the results of all finished stages;
+# outputs are the files and directories it writes, used for the I/O numbers of the profile.
+@dataclass
+class Stage:
+    name: str
+    action: Callable[[dict[str, Any]], Any]
+    depends_on: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    after: tuple[str, ...] = ()  # Stages to wait for that may fail without skipping this one
+
+
+def _timed_action(stage: Stage, results: dict[str, Any]) -> tuple[Any, float]:
+    start = time.perf_counter()
+    with PROFILER.stage(stage.name, stage.outputs):
+        result = stage.action(results)
+    return result, time.perf_counter() - start
+
+
+# Run stages on a thread pool, starting each one as soon as its dependencies finished.
+# The first failing stage stops scheduling and its exception is re-raised. With a failures dict,
+# failures are recorded there instead, the stages depending on a failed one are skipped (and
+# recorded as a PackError) and all other stages still run.
+def run_stages(stages: list[Stage], failures: dict[str, BaseException] | None = None) -> dict[str, Any]:
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.depends_on + stage.after if dep not in names]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    results = {}
+    failed = {}
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, stage in list(pending.items()):
+                    if not all(dep in results or dep in failed for dep in stage.depends_on + stage.after):
+                        continue
+                    del pending[name]
+                    scheduled = True
+                    failed_dependency = next((dep for dep in stage.depends_on if dep in failed), None)
+                    if failed_dependency is not None:
+                        print(f"Stage '{name}' skipped, it depends on the failed stage '{failed_dependency}'")
+                        failed[name] = PackError(f"skipped, stage '{failed_dependency}' failed")
+                    else:
+                        running[executor.submit(_timed_action, stage, dict(results))] = stage
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle between stages: {', '.join(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name], elapsed = future.result()
+                except Exception as e:
+                    if failures is None:
+                        print(f"Stage '{stage.name}' failed, waiting for {len(running)} running stage(s) to stop...")
+                        pending.clear()
+                        raise
+                    print(f"Stage '{stage.name}' failed: {e}")
+                    failed[stage.name] = e
+                    continue
+                except BaseException:
+                    print(f"Stage '{stage.name}' failed, waiting for {len(running)} running stage(s) to stop...")
+                    pending.clear()
+                    raise
+                print(f"Stage '{stage.name}' finished in {elapsed:.2f}s")
+
+    if failures is not None:
+        failures.update(failed)
+    print(f"All stages finished in {time.perf_counter() - start:.2f}s wall time")
+    return results
+
+
+# Directory the dependencies of the app packed into pack_dir are mirrored to
+def app_dependency_dir(pack_dir: str) -> str:
+    return DEPENDENCY_DIR if pack_dir == PACK_DIR else os.path.join(pack_dir, "dependencies")
+
+
+# Stages that pack the Java process with the given PID into pack_dir, or into the archive under that path.
+# Stage names are prefixed with name_prefix; with shared_jre_dir the JRE is hardlinked from there
+# after the shared "jre" stage instead of being generated. With a snapshot taken earlier, the
+# process is not queried again.
+def app_stages(pid: str, main_class: str, pack_dir: str, name_prefix: str = "", shared_jre_dir: str | None = None, archive: PackageArchive | None = None, snapshot: JvmSnapshot | None = None) -> list[Stage]:
+    dependency_dir = app_dependency_dir(pack_dir)
+    if archive is None:
+        os.makedirs(pack_dir, exist_ok=True)
+
+    def stage_name(name: str) -> str:
+        return name_prefix + name
+
+    # 1. Get Java process startup parameters: classpath, JVM and program arguments, flags and properties
+    def query_process(results: dict[str, Any]) -> JvmSnapshot:
+        if snapshot is not None:
+            return snapshot
+        process_snapshot = collect_jvm_snapshot(pid)
+        if not process_snapshot.classpath:
+            raise PackError(f"No classpath found for PID {pid}.")
+
+        if process_snapshot.jvm_args:
+            print(f"Extracted JVM arguments: {process_snapshot.jvm_args}")
+        else:
+            print("No JVM arguments found, will use defaults.")
+        return process_snapshot
+
+    # 2. Generate the custom JRE, only jdeps mode needs the captured classpath
+    def build_jre(results: dict[str, Any]) -> None:
+        if shared_jre_dir:
+            place_jre(shared_jre_dir, pack_dir, archive)
+            return
+        classpath_list = results[stage_name("jcmd")].classpath if stage_name("jcmd") in results else None
+        generate_custom_jre(classpath_list, pack_dir, archive)
+
+    # Optionally decide which small jars are merged, used by the copy and launcher stages
+    def plan_merges(results: dict[str, Any]) -> dict[str, str]:
+        merged_jars = plan_jar_merges(results[stage_name("jcmd")].classpath, dependency_dir)
+        print(f"{len(merged_jars)} small jars will be merged into {len(set(merged_jars.values()))} jars")
+        return merged_jars
+
+    # 3. Copy dependency files from classpath
+    def copy_classpath(results: dict[str, Any]) -> CopyStats:
+        snapshot = results[stage_name("jcmd")]
+        if TRIM_JARS and snapshot.loaded_classes is None:
+            print("Loaded classes are not available, copying the jars untrimmed")
+        return copy_dependencies(snapshot.classpath, dependency_dir, archive, snapshot.loaded_classes,
+                                 results.get(stage_name("merge_plan")))
+
+    # 4. Copy additional files and directories
+    def copy_extra(results: dict[str, Any]) -> None:
+        copy_extra_files(EXTRA_FILES_AND_DIRS, pack_dir, archive)
+
+    # 5. Create .bat and .sh files with extracted JVM and program arguments
+    def write_launchers(results: dict[str, Any]) -> None:
+        snapshot = results[stage_name("jcmd")]
+        merged_jars = results.get(stage_name("merge_plan"))
+        write_classpath_files(snapshot.classpath, dependency_dir, pack_dir, merged_jars, archive)
+        if REPLAY_JVM_FLAGS:
+            write_jvm_options(snapshot, pack_dir, archive)
+        create_bat_file(main_class, snapshot.classpath, dependency_dir, snapshot.jvm_args, snapshot.program_args, pack_dir=pack_dir, archive=archive, merged_jars=merged_jars)
+        create_sh_file(main_class, snapshot.classpath, dependency_dir, snapshot.jvm_args, snapshot.program_args, pack_dir=pack_dir, archive=archive, merged_jars=merged_jars)
+
+    # 6. Optionally record an AppCDS archive with the packaged app and point the launchers at it
+    def train_cds(results: dict[str, Any]) -> str | None:
+        snapshot = results[stage_name("jcmd")]
+        merged_jars = results.get(stage_name("merge_plan"))
+        cds_archive = train_cds_archive(main_class, snapshot.classpath, dependency_dir, snapshot.jvm_args, snapshot.program_args, pack_dir, merged_jars)
+        if cds_archive:
+            create_bat_file(main_class, snapshot.classpath, dependency_dir, snapshot.jvm_args, snapshot.program_args, cds_archive, pack_dir, merged_jars=merged_jars)
+            create_sh_file(main_class, snapshot.classpath, dependency_dir, snapshot.jvm_args, snapshot.program_args, cds_archive, pack_dir, merged_jars=merged_jars)
+        return cds_archive
+
+    if shared_jre_dir:
+        jre_depends_on = ("jre",)
+    elif JRE_MODULES_MODE == "jdeps":
+        jre_depends_on = (stage_name("jcmd"),)
+    else:
+        jre_depends_on = ()
+
+    merge_depends_on = (stage_name("merge_plan"),) if MERGE_SMALL_JARS else ()
+    launchers = (os.path.join(pack_dir, "start_program.bat"), os.path.join(pack_dir, "start_program.sh"))
+    launchers += tuple(os.path.join(pack_dir, name) for name in ("classpath-windows.args", "classpath-unix.args", "classpath.jar", JVM_OPTIONS_FILE_NAME))
+    jre_stage = stage_name("jre") if shared_jre_dir else "jre"
+    extra_outputs = tuple(os.path.join(pack_dir, os.path.basename(item)) for item in EXTRA_FILES_AND_DIRS)
+    stages = [
+        Stage(stage_name("jcmd"), query_process),
+        Stage(jre_stage, build_jre, jre_depends_on,
+              (os.path.join(pack_dir, "custom-jre"),)),
+        Stage(stage_name("copy_dependencies"), copy_classpath, (stage_name("jcmd"),) + merge_depends_on, (dependency_dir,)),
+        Stage(stage_name("copy_extra_files"), copy_extra, (), extra_outputs),
+        # Written last, so a package whose JRE or dependencies failed has no launchers pointing at them
+        Stage(stage_name("launchers"), write_launchers,
+              (stage_name("jcmd"), jre_stage, stage_name("copy_dependencies")) + merge_depends_on, launchers),
+    ]
+    if MERGE_SMALL_JARS:
+        stages.append(Stage(stage_name("merge_plan"), plan_merges, (stage_name("jcmd"),)))
+    if CDS_TRAINING:
+        stages.append(Stage(stage_name("cds"), train_cds, (
+            jre_stage, stage_name("copy_dependencies"), stage_name("copy_extra_files"), stage_name("launchers")) + merge_depends_on,
+            (os.path.join(pack_dir, CDS_ARCHIVE_NAME),) + launchers))
+    return stages
+
+
+# Hardlink (or copy) a JRE built once into the custom-jre directory of an app.
+# With an archive, the JRE already added at source_jre_dir is added again (as hardlinks in tar).
+def place_jre(source_jre_dir: str, pack_dir: str, archive: PackageArchive | None = None) -> None:
+    output_jre_dir = os.path.join(pack_dir, "custom-jre")
+    if archive is not None:
+        archive.add_copy(source_jre_dir, output_jre_dir)
+        print(f"Custom JRE added to the archive at {archive.name(output_jre_dir)}")
+        return
+    if os.path.exists(output_jre_dir):
+        shutil.rmtree(output_jre_dir)
+    method = place_tree(source_jre_dir, output_jre_dir)
+    print(f"Custom JRE placed at {output_jre_dir} ({method})")
+
+
+# Processes selected by BATCH_PIDS or BATCH_MAIN_CLASS_REGEX, as (pid, main class, full command)
+def select_batch_processes() -> list[tuple[str, str, str]]:
+    processes = list_java_processes() or []
+    pids = {str(pid) for pid in BATCH_PIDS}
+    pattern = re.compile(BATCH_MAIN_CLASS_REGEX) if BATCH_MAIN_CLASS_REGEX else None
+    selected = [
+        process for process in processes
+        if process[0] in pids or (pattern is not None and pattern.search(process[1]))
+    ]
+    missing = pids - {process[0] for process in selected}
+    if missing:
+        print(f"Java processes not found: {', '.join(sorted(missing))}")
+    return selected
+
+
+# Subdirectory name of an app in batch mode, e.g. "OrderService-1234"
+def batch_app_name(pid: str, main_class: str) -> str:
+    simple_name = os.path.basename(main_class.replace("\\", "/"))
+    if simple_name.endswith(".jar"):
+        simple_name = simple_name[:-len(".jar")]
+    else:
+        simple_name = simple_name.rsplit('.', 1)[-1]
+    return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', simple_name)}-{pid}"
+
+
+# An app packed from a running JVM, kept for re-packing it in watch mode
+@dataclass
+class PackedApp:
+    pid: str
+    main_class: str
+    pack_dir: str
+    name_prefix: str
+    snapshot: JvmSnapshot
+
+
+# Pack several running JVMs at once into PACK_DIR/<app>-<pid>, sharing one JRE build
+# (PACK_DIR/custom-jre, hardlinked into every app) and the dependency store. A failing app does
+# not stop the others; returns the packed apps and {app name: error} of the failed ones.
+def pack_batch(processes: list[tuple[str, str, str]], archive: PackageArchive | None = None) -> tuple[list[PackedApp], dict[str, str]]:
+    global _concurrent_apps
+    shared_jre_dir = os.path.join(PACK_DIR, "custom-jre")
+    stages = []
+    jcmd_stages = []
+    apps = []
+    for pid, main_class, full_command in processes:
+        app_name = batch_app_name(pid, main_class)
+        print(f"Packing {full_command} (PID: {pid}) into {app_name}")
+        stages.extend(app_stages(pid, main_class, os.path.join(PACK_DIR, app_name), f"{app_name}/", shared_jre_dir, archive))
+        jcmd_stages.append(f"{app_name}/jcmd")
+        apps.append((pid, main_class, os.path.join(PACK_DIR, app_name), f"{app_name}/"))
+
+    # jdeps mode builds one JRE for the union of all classpaths
+    def build_shared_jre(results: dict[str, Any]) -> None:
+        classpath_list = [entry for name in jcmd_stages if name in results for entry in results[name].classpath]
+        generate_custom_jre(classpath_list if JRE_MODULES_MODE == "jdeps" else None, PACK_DIR, archive)
+
+    # An app whose jcmd query failed is left out of the union instead of failing the shared JRE
+    stages.append(Stage("jre", build_shared_jre, outputs=(shared_jre_dir,),
+                        after=tuple(jcmd_stages) if JRE_MODULES_MODE == "jdeps" else ()))
+    failures = {}
+    # The copy, jar and merge pools of all apps run at the same time, so they share their workers
+    _concurrent_apps = len(apps)
+    try:
+        results = run_stages(stages, failures)
+    finally:
+        _concurrent_apps = 1
+
+    packed = []
+    failed_apps = {}
+    for pid, main_class, pack_dir, prefix in apps:
+        app_failures = {name: error for name, error in failures.items() if name.startswith(prefix)}
+        if not app_failures:
+            packed.append(PackedApp(pid, main_class, pack_dir, prefix, results[f"{prefix}jcmd"]))
+            continue
+        # Report the cause, not the stages skipped because of it
+        causes = [f"{name[len(prefix):]}: {error}" for name, error in app_failures.items()
+                  if not str(error).startswith("skipped")]
+        if "jre" in failures:
+            causes.append(f"jre: {failures['jre']}")
+        failed_apps[prefix.rstrip("/")] = "; ".join(causes) or "; ".join(str(error) for error in app_failures.values())
+
+    print(f"\nPacked {len(packed)} of {len(apps)} apps")
+    for app_name, error in failed_apps.items():
+        print(f"  {app_name} failed: {error}")
+    if not packed:
+        raise PackError("No app could be packed.")
+    return packed, failed_apps
+
+
+# The watched path (classpath entry or extra file or directory) that path is, or lies below
+def watched_root(path: str, roots: list[str]) -> str | None:
+    for root in roots:
+        if path == root or path.startswith(root.rstrip("\\/") + os.sep):
+            return root
+    return None
+
+
+def _scan_tree(path: str, files: dict[str, tuple[int, int]], excluded: tuple[str, ...]) -> None:
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if os.path.abspath(entry.path) not in excluded:
+                    _scan_tree(entry.path, files, excluded)
+            else:
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            continue  # Removed while scanning, the next scan sees it gone
+
+
+# Kind of every watched path ("file", "dir" or None when missing), and size and modification time
+# of every file at or below them. The package and the dependency store are not scanned.
+def scan_watched_paths(roots: list[str]) -> tuple[dict[str, str | None], dict[str, tuple[int, int]]]:
+    excluded = tuple(os.path.abspath(path) for path in (PACK_DIR, DEPENDENCY_STORE_DIR) if path)
+    kinds = {}
+    files = {}
+    for root in roots:
+        kinds[root] = "dir" if os.path.isdir(root) else "file" if os.path.isfile(root) else None
+        if kinds[root] == "dir":
+            _scan_tree(root, files, excluded)
+        elif kinds[root] == "file":
+            try:
+                stat = os.stat(root)
+                files[root] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                kinds[root] = None
+    return kinds, files
+
+
+# Files added, modified or removed between two scans
+def diff_scans(previous: dict[str, tuple[int, int]], current: dict[str, tuple[int, int]]) -> dict[str, str]:
+    changes = {path: "removed" for path in previous.keys() - current.keys()}
+    for path, signature in current.items():
+        if path not in previous:
+            changes[path] = "added"
+        elif previous[path] != signature:
+            changes[path] = "modified"
+    return changes
+
+
+# Poll the watched paths until they changed and then stayed unchanged for WATCH_DEBOUNCE_SECONDS,
+# or WATCH_MAX_DELAY_SECONDS passed since the first change. Returns the new scan, the changed
+# files and the watched paths that appeared, disappeared or changed kind since the given scan.
+# With seen, a later scan, only changes after that one start the wait.
+def wait_for_changes(roots: list[str], kinds: dict[str, str | None], files: dict[str, tuple[int, int]],
+                     seen: tuple[dict, dict] | None = None) -> tuple[dict, dict, dict[str, str], set[str]]:
+    last_kinds, last_files = seen or (kinds, files)
+    first_change = last_change = None
+    while True:
+        time.sleep(WATCH_POLL_SECONDS)
+        current_kinds, current_files = scan_watched_paths(roots)
+        now = time.monotonic()
+        if current_kinds != last_kinds or current_files != last_files:
+            first_change = first_change or now
+            last_change = now
+            last_kinds, last_files = current_kinds, current_files
+        if first_change is None:
+            continue
+        if now - last_change >= WATCH_DEBOUNCE_SECONDS or now - first_change >= WATCH_MAX_DELAY_SECONDS:
+            changes = diff_scans(files, current_files)
+            changed_roots = {root for root in roots if current_kinds[root] != kinds[root]}
+            if changes or changed_roots:
+                return current_kinds, current_files, changes, changed_roots
+            first_change = None  # Changed back to the packed state
+
+
+# Copy added and modified files of EXTRA_FILES_AND_DIRS into pack_dir and remove the copies of removed ones
+def update_extra_files(changes: dict[str, str], pack_dir: str) -> None:
+    for path, change in sorted(changes.items()):
+        root = watched_root(path, EXTRA_FILES_AND_DIRS)
+        dest = os.path.normpath(os.path.join(pack_dir, os.path.basename(root.rstrip("\\/")), os.path.relpath(path, root)))
+        try:
+            if change == "removed":
+                if os.path.isfile(dest):
+                    os.remove(dest)
+                    print(f"Removed file: {dest}")
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                copy_file(path, dest)
+                print(f"Copied file: {path} -> {dest}")
+        except Exception as e:
+            print(f"Error updating {dest}: {e}")
+
+
+# Remove the mirrored copies of removed classpath files; jarred class directories are rebuilt instead
+def remove_stale_dependencies(changes: dict[str, str], classpath_list: list[str], target_directory: str) -> None:
+    for path, change in changes.items():
+        root = watched_root(path, classpath_list)
+        if change != "removed" or (JAR_CLASS_DIRECTORIES and root != path):
+            continue
+        target = mirror_path(path, target_directory)
+        if os.path.isfile(target):
+            os.remove(target)
+            print(f"Removed dependency: {target}")
+
+
+# The stages of app_stages that the changes affect, reusing the snapshot the app was packed from:
+# dependencies are copied again (the copy manifest skips unchanged files), changed extra files are
+# copied, launchers are written again when a classpath entry appeared, disappeared or changed kind,
+# and the CDS archive is trained again when the classpath changed
+def watch_stages(app: PackedApp, changes: dict[str, str], changed_roots: set[str]) -> list[Stage]:
+    stages = {stage.name: stage for stage in app_stages(app.pid, app.main_class, app.pack_dir, app.name_prefix, snapshot=app.snapshot)}
+    classpath_changes = {path: change for path, change in changes.items() if watched_root(path, app.snapshot.classpath)}
+    extra_changes = {path: change for path, change in changes.items() if watched_root(path, EXTRA_FILES_AND_DIRS)}
+    classpath_roots_changed = bool(changed_roots & set(app.snapshot.classpath))
+
+    selected = {app.name_prefix + "jcmd"}
+    if classpath_changes or classpath_roots_changed:
+        copy_stage = stages[app.name_prefix + "copy_dependencies"]
+
+        def copy_changed_dependencies(results: dict[str, Any]) -> CopyStats:
+            remove_stale_dependencies(classpath_changes, app.snapshot.classpath, app_dependency_dir(app.pack_dir))
+            return copy_stage.action(results)
+
+        stages[copy_stage.name] = replace(copy_stage, action=copy_changed_dependencies)
+        selected.add(copy_stage.name)
+        if MERGE_SMALL_JARS:
+            # Changed jar sizes or contents can regroup the merged jars the launchers reference
+            selected |= {app.name_prefix + "merge_plan", app.name_prefix + "launchers"}
+        if CDS_TRAINING:
+            selected.add(app.name_prefix + "cds")
+    if extra_changes:
+        extra_stage = stages[app.name_prefix + "copy_extra_files"]
+        stages[extra_stage.name] = replace(extra_stage, action=lambda results: update_extra_files(extra_changes, app.pack_dir))
+        selected.add(extra_stage.name)
+    if classpath_roots_changed:
+        selected.add(app.name_prefix + "launchers")
+    return [replace(stage, depends_on=tuple(name for name in stage.depends_on if name in selected))
+            for name, stage in stages.items() if name in selected]
+
+
+# Keep the packed apps up to date with their classpath and EXTRA_FILES_AND_DIRS: poll for changes,
+# debounce them, and run only the stages they affect, then rewrite the release manifest
+def watch_packages(apps: list[PackedApp]) -> None:
+    roots = list(dict.fromkeys([entry for app in apps for entry in app.snapshot.classpath] + EXTRA_FILES_AND_DIRS))
+    # kinds and files are the state last packed successfully; changes are always diffed against it,
+    # so the changes of a failed re-pack are packed again with the next change
+    kinds, files = scan_watched_paths(roots)
+    seen = None
+    print(f"Watching {len(roots)} paths ({len(files)} files) for changes, press Ctrl+C to stop...")
+    try:
+        while True:
+            current_kinds, current_files, changes, changed_roots = wait_for_changes(roots, kinds, files, seen)
+            print(f"\n{len(changes)} changed files, re-packing...")
+            start = time.perf_counter()
+            try:
+                stages = [stage for app in apps for stage in watch_stages(app, changes, changed_roots)]
+                run_stages(stages)
+                with PROFILER.stage("release", (os.path.join(PACK_DIR, RELEASE_MANIFEST_NAME),)):
+                    write_release()
+            except Exception as e:
+                print(f"Re-pack failed: {e}")
+                print("These changes are re-packed with the next change, watching for changes...")
+                seen = (current_kinds, current_files)
+                continue
+            kinds, files, seen = current_kinds, current_files, None
+            print(f"Re-packed in {time.perf_counter() - start:.2f}s, watching for changes...")
+    except KeyboardInterrupt:
+        print("Watch stopped.")
+
+
+# Pack the batch or the interactively selected process, into PACK_DIR or the archive.
+# Returns True when the package is complete.
+def pack_processes(archive: PackageArchive | None) -> bool:
+    # Batch mode packs every matching process without prompting
+    if BATCH_PIDS or BATCH_MAIN_CLASS_REGEX:
+        processes = select_batch_processes()
+        if not processes:
+            print("No matching Java processes found. Exiting.")
+            return False
+        if archive is None:
+            os.makedirs(PACK_DIR, exist_ok=True)
+        try:
+            apps, failed_apps = pack_batch(processes, archive)
+            with PROFILER.stage("release", (os.path.join(PACK_DIR, RELEASE_MANIFEST_NAME),)):
+                write_release(archive)
+        except PackError as e:
+            print(e)
+            return False
+        finally:
+            PROFILER.finish("packRunningJava", os.path.join(PACK_DIR, "pack-profile.json"))
+        if WATCH and archive is None:
+            watch_packages(apps)
+        return not failed_apps
     
     # Get user to select a Java process
-    selected_class = select_java_process()
-    if not selected_class:
+    selected = select_java_process()
+    if not selected:
         print("No process selected. Exiting.")
-        return
+        return False
+    selected_pid, selected_class = selected
     
     # Create necessary directories
-    if not os.path.exists(PACK_DIR):
+    if archive is None and not os.path.exists(PACK_DIR):
         os.makedirs(PACK_DIR)
-        
-    generate_custom_jre()
-    
-    # 1. Get Java process startup parameters
-    jcmd_output = get_java_process_info(selected_class)
-    if not jcmd_output:
-        print("Failed to retrieve Java process information.")
-        return
 
-    # 2. Extract classpath
-    classpath_list = parse_classpath(jcmd_output)
-    if not classpath_list:
-        print("No classpath found.")
-        return
+    try:
+        results = run_stages(app_stages(selected_pid, selected_class, PACK_DIR, archive=archive))
+        with PROFILER.stage("release", (os.path.join(PACK_DIR, RELEASE_MANIFEST_NAME),)):
+            write_release(archive)
+    except PackError as e:
+        print(e)
+        return False
+    finally:
+        PROFILER.finish("packRunningJava", os.path.join(PACK_DIR, "pack-profile.json"))
+    if WATCH and archive is None:
+        watch_packages([PackedApp(selected_pid, selected_class, PACK_DIR, "", results["jcmd"])])
+    return True
 
-    # 3. Copy dependency files from classpath
-    copy_dependencies(classpath_list, DEPENDENCY_DIR)
 
-    # 4. Extract JVM arguments
-    jvm_args = parse_jvm_args(jcmd_output)
-    if jvm_args:
-        print(f"Extracted JVM arguments: {jvm_args}")
-    else:
-        print("No JVM arguments found, will use defaults.")
+# Point file descriptor 1 at stderr for the duration: child processes inherit it, so redirect_stdout
+# alone would let their output into an archive streamed to stdout
+@contextlib.contextmanager
+def stdout_to_stderr():
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    try:
+        os.dup2(sys.stderr.fileno(), 1)
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
 
-    # 5. Extract program arguments
-    java_command_pattern = re.compile(r"java_command: (.+)")
-    match = java_command_pattern.search(jcmd_output)
-    if match:
-        java_command = match.group(1)
-        args = java_command.split()[1:]
-    else:
-        args = []
 
-    # 6. Copy additional files and directories
-    copy_extra_files(EXTRA_FILES_AND_DIRS, PACK_DIR)
+def main() -> None:
+    if PROFILE_STAGES:
+        PROFILER.enabled = True
 
-    # 7. Create .bat file with extracted JVM and program arguments
-    create_bat_file(selected_class, classpath_list, DEPENDENCY_DIR, jvm_args, args)
-    
-    # 8. Create .sh file for Linux with extracted JVM and program arguments
-    create_sh_file(selected_class, classpath_list, DEPENDENCY_DIR, jvm_args, args)
+    # Validate JDK_PATH and potentially update it
+    JDK_PATH = validate_jdk_path()
+
+    if not ARCHIVE_OUTPUT:
+        if not pack_processes(None):
+            exit(1)
+        return
+
+    if CDS_TRAINING or WATCH:
+        print(f"{'CDS_TRAINING' if CDS_TRAINING else 'WATCH'} needs the package on disk and cannot be combined with ARCHIVE_OUTPUT.")
+        exit(1)
+    archive = PackageArchive(ARCHIVE_OUTPUT, PACK_DIR, ARCHIVE_FORMAT, ARCHIVE_WORKERS)
+    # When the archive goes to stdout, progress messages and the output of jlink, jdeps and jcmd go to stderr
+    with stdout_to_stderr() if ARCHIVE_OUTPUT == "-" else contextlib.nullcontext():
+        try:
+            complete = pack_processes(archive)
+        except BaseException:
+            archive.abort()
+            raise
+        if complete:
+            archive.close()
+        else:
+            # A batch archive is only written when every app was packed
+            archive.abort()
+            exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
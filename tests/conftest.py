@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# The packers are scripts in the repository root rather than an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# packRunningJava configured to pack into tmp_path/pack without a JDK: jlink is replaced by a stub
+# that writes a tiny runtime image, and jcmd by snapshots registered with add_process
+@pytest.fixture
+def packer(tmp_path, monkeypatch):
+    import packRunningJava
+    from packRunningJava import JvmSnapshot
+
+    pack_dir = str(tmp_path / "pack")
+    for name, value in {
+        "PACK_DIR": pack_dir, "DEPENDENCY_DIR": os.path.join(pack_dir, "dependencies"), "EXTRA_FILES_AND_DIRS": [],
+        "JDK_PATH": str(tmp_path / "jdk"), "JRE_MODULES_MODE": "all", "DEPENDENCY_STORE_DIR": None,
+        "JAR_CLASS_DIRECTORIES": False, "CDS_TRAINING": False, "TRIM_JARS": False, "MERGE_SMALL_JARS": False,
+        "REPLAY_JVM_FLAGS": False, "LAUNCHER_CLASSPATH": "inline", "ARCHIVE_OUTPUT": None, "WATCH": False,
+        "PREVIOUS_RELEASE_MANIFEST": None, "DELTA_OUTPUT": None,
+    }.items():
+        monkeypatch.setattr(packRunningJava, name, value)
+
+    def fake_jre(jdk_path, modules, output_dir, jlink_options=None, archive=None):
+        os.makedirs(os.path.join(output_dir, "bin"))
+        with open(os.path.join(output_dir, "release"), "w") as f:
+            f.write('JAVA_VERSION="22.0.1"\n')
+
+    monkeypatch.setattr(packRunningJava, "resolve_jre_modules", lambda *args, **kwargs: ["java.base"])
+    monkeypatch.setattr(packRunningJava, "build_custom_jre", fake_jre)
+
+    processes = {}
+
+    def collect_jvm_snapshot(pid):
+        snapshot = processes[pid]
+        if isinstance(snapshot, BaseException):
+            raise snapshot
+        return snapshot
+
+    monkeypatch.setattr(packRunningJava, "collect_jvm_snapshot", collect_jvm_snapshot)
+
+    class Packer:
+        module = packRunningJava
+
+        # Register a fake JVM: a JvmSnapshot for classpath, or an exception its query raises
+        def add_process(self, pid, classpath=None, main_class="com.example.Main", error=None, **fields):
+            processes[pid] = error or JvmSnapshot(pid, main_class, fields.pop("jvm_args", "-Xmx1g"), list(classpath),
+                                                  fields.pop("program_args", []), **fields)
+            return pid
+
+    packer = Packer()
+    packer.pack_dir = pack_dir
+    return packer
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from packRunningJava import PackError, pack_batch
+
+
+def jar(tmp_path, name):
+    path = tmp_path / "repo" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(name.encode() * 10)
+    return str(path)
+
+
+def test_failed_app_does_not_stop_the_others(tmp_path, packer, capsys):
+    packer.add_process("101", [jar(tmp_path, "a.jar")], "com.example.A")
+    packer.add_process("102", error=packer.module.PackError("jcmd timed out"), main_class="com.example.Broken")
+    packer.add_process("103", [jar(tmp_path, "b.jar")], "com.example.B")
+
+    packed, failed = pack_batch([("101", "com.example.A", "A"), ("102", "com.example.Broken", "Broken"),
+                                 ("103", "com.example.B", "B")])
+
+    assert [app.pid for app in packed] == ["101", "103"]
+    assert list(failed) == ["Broken-102"]
+    assert "jcmd timed out" in failed["Broken-102"]
+    assert "Packed 2 of 3 apps" in capsys.readouterr().out
+    for app in packed:
+        assert os.path.isfile(os.path.join(app.pack_dir, "start_program.sh"))
+        assert os.path.isdir(os.path.join(app.pack_dir, "custom-jre", "bin"))
+    assert not os.path.exists(os.path.join(packer.pack_dir, "Broken-102", "start_program.sh"))
+
+
+def test_all_apps_failing_raises(packer):
+    packer.add_process("201", error=packer.module.PackError("gone"))
+    with pytest.raises(PackError, match="No app could be packed"):
+        pack_batch([("201", "com.example.Main", "Main")])
+
+
+def test_apps_split_the_worker_pools(tmp_path, packer, monkeypatch):
+    seen = []
+    copy_dependencies = packer.module.copy_dependencies
+
+    def recording_copy(*args, **kwargs):
+        seen.append(packer.module.app_workers(8))
+        return copy_dependencies(*args, **kwargs)
+
+    monkeypatch.setattr(packer.module, "copy_dependencies", recording_copy)
+    for pid in ("301", "302", "303", "304"):
+        packer.add_process(pid, [jar(tmp_path, f"{pid}.jar")])
+
+    pack_batch([(pid, "com.example.Main", "Main") for pid in ("301", "302", "303", "304")])
+
+    assert seen == [2, 2, 2, 2]
+    assert packer.module.app_workers(8) == 8
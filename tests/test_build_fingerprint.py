@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import packMavenProject
+from packMavenProject import compute_build_fingerprint, is_build_up_to_date, read_maven_module, save_build_fingerprint
+
+POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>com.example</groupId>
+  <artifactId>app</artifactId>
+  <version>1.0.0</version>
+</project>
+"""
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    project_dir = tmp_path / "project"
+    (project_dir / "src" / "main" / "java").mkdir(parents=True)
+    (project_dir / "pom.xml").write_text(POM)
+    (project_dir / "src" / "main" / "java" / "Main.java").write_text("class Main {}")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.delenv("MAVEN_OPTS", raising=False)
+    monkeypatch.delenv("MAVEN_HOME", raising=False)
+    for name, value in {
+        "PROJECT_DIR": str(project_dir), "NEW_POM_FILE": str(project_dir / "pom_executable.xml"),
+        "BUILD_FINGERPRINT_FILE": str(project_dir / "target" / ".pack-build-fingerprint"),
+        "CLASSPATH_FILE": str(project_dir / "target" / "pack-classpath.txt"),
+        "FAT_JAR_BUILDER": "shade", "REACTOR_MODULES": False, "JAR_FILE_NAME": None,
+    }.items():
+        monkeypatch.setattr(packMavenProject, name, value)
+    return project_dir
+
+
+def fingerprint(project):
+    return compute_build_fingerprint(b"<project/>", [read_maven_module(str(project))])
+
+
+def touch_later(path):
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_fingerprint_is_stable(project):
+    assert fingerprint(project) == fingerprint(project)
+
+
+def test_fingerprint_follows_sources_pom_and_maven_options(project, monkeypatch):
+    before = fingerprint(project)
+    touch_later(project / "src" / "main" / "java" / "Main.java")
+    after_source = fingerprint(project)
+    assert after_source != before
+
+    (project / "src" / "main" / "java" / "Added.java").write_text("class Added {}")
+    after_added = fingerprint(project)
+    assert after_added != after_source
+
+    assert compute_build_fingerprint(b"<project>changed</project>", [read_maven_module(str(project))]) != after_added
+
+    monkeypatch.setenv("MAVEN_OPTS", "-Xmx2g")
+    assert fingerprint(project) != after_added
+
+
+def test_fingerprint_follows_maven_settings(project, tmp_path):
+    before = fingerprint(project)
+    (tmp_path / "home" / ".m2").mkdir(parents=True)
+    (tmp_path / "home" / ".m2" / "settings.xml").write_text("<settings/>")
+    assert fingerprint(project) != before
+
+
+def test_build_outputs_and_generated_poms_are_ignored(project):
+    before = fingerprint(project)
+    (project / "target" / "classes").mkdir(parents=True)
+    (project / "target" / "classes" / "Main.class").write_bytes(b"class")
+    (project / ".git").mkdir()
+    (project / ".git" / "HEAD").write_text("ref: refs/heads/main")
+    (project / "pom_executable.xml").write_text("<project/>")
+    assert fingerprint(project) == before
+
+
+def test_build_is_up_to_date_only_with_matching_fingerprint_and_outputs(project):
+    packaged = [read_maven_module(str(project))]
+    current = compute_build_fingerprint(b"<project/>", packaged)
+    assert not is_build_up_to_date(current, packaged)
+
+    save_build_fingerprint(current)
+    assert not is_build_up_to_date(current, packaged)  # The jar is missing
+
+    (project / "target" / "app-1.0.0.jar").write_bytes(b"jar")
+    assert is_build_up_to_date(current, packaged)
+    assert not is_build_up_to_date("other", packaged)
@@ -0,0 +1,24 @@
+import os
+
+import packRunningJava
+from packRunningJava import packaged_java_command
+
+
+def test_packaged_java_command_works_from_the_pack_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(packRunningJava, "REPLAY_JVM_FLAGS", False)
+    monkeypatch.setattr(packRunningJava, "LAUNCHER_CLASSPATH", "inline")
+    monkeypatch.setattr(packRunningJava, "JAR_CLASS_DIRECTORIES", False)
+    (tmp_path / "libs").mkdir()
+    (tmp_path / "libs" / "a.jar").write_bytes(b"jar")
+    pack_dir = os.path.join("out", "app")
+    dependency_dir = os.path.join(pack_dir, "dependencies")
+
+    command = packaged_java_command("com.example.Main", [str(tmp_path / "libs" / "a.jar")], dependency_dir,
+                                    "-Xmx1g", ["--port", "8080"], ["-XX:ArchiveClassesAtExit=app.jsa"], pack_dir)
+
+    # The training process runs with cwd=pack_dir, so the executable must not be relative to it
+    assert command[0] == str(tmp_path / "out" / "app" / "custom-jre" / "bin" / "java")
+    assert command[command.index("-cp") + 1] == os.path.relpath(packRunningJava.mirror_path(str(tmp_path / "libs" / "a.jar"), dependency_dir), pack_dir)
+    assert command[-3:] == ["com.example.Main", "--port", "8080"]
+    assert "-Xmx1g" in command and "-XX:ArchiveClassesAtExit=app.jsa" in command
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+import packRunningJava
+from packRunningJava import COPY_MANIFEST_NAME, copy_files, mirror_path, plan_dependency_copies
+
+
+@pytest.fixture(autouse=True)
+def direct_copies(monkeypatch):
+    monkeypatch.setattr(packRunningJava, "DEPENDENCY_STORE_DIR", None)
+    monkeypatch.setattr(packRunningJava, "COPY_VERIFY_HASH", False)
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def touch_later(path, seconds=10):
+    mtime = os.stat(path).st_mtime + seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_plan_mirrors_files_and_directories(tmp_path):
+    jar = write(tmp_path / "repo" / "a.jar", b"jar")
+    write(tmp_path / "classes" / "com" / "example" / "Main.class", b"class")
+    target = str(tmp_path / "out")
+
+    jobs = plan_dependency_copies([jar, str(tmp_path / "classes"), str(tmp_path / "missing.jar")], target)
+
+    assert sorted(jobs) == sorted([
+        (jar, mirror_path(jar, target)),
+        (str(tmp_path / "classes" / "com" / "example" / "Main.class"),
+         os.path.join(mirror_path(str(tmp_path / "classes"), target), "com", "example", "Main.class")),
+    ])
+
+
+def test_copy_then_skip_unchanged(tmp_path):
+    source = write(tmp_path / "repo" / "a.jar", b"a" * 100)
+    target = str(tmp_path / "out" / "a.jar")
+    manifest_path = str(tmp_path / "out" / COPY_MANIFEST_NAME)
+
+    first = copy_files([(source, target)], manifest_path, workers=2)
+    second = copy_files([(source, target)], manifest_path, workers=2)
+
+    assert (first.copied_files, first.copied_bytes, first.skipped_files) == (1, 100, 0)
+    assert (second.copied_files, second.skipped_files, second.skipped_bytes) == (0, 1, 100)
+    with open(target, "rb") as f:
+        assert f.read() == b"a" * 100
+    with open(manifest_path) as f:
+        assert json.load(f)["a.jar"] == {"source": source, "size": 100, "mtime": os.stat(source).st_mtime_ns}
+
+
+def test_changed_or_missing_targets_are_copied_again(tmp_path):
+    changed = write(tmp_path / "repo" / "changed.jar", b"old")
+    removed = write(tmp_path / "repo" / "removed.jar", b"removed")
+    jobs = [(changed, str(tmp_path / "out" / "changed.jar")), (removed, str(tmp_path / "out" / "removed.jar"))]
+    manifest_path = str(tmp_path / "out" / COPY_MANIFEST_NAME)
+    copy_files(jobs, manifest_path)
+
+    write(tmp_path / "repo" / "changed.jar", b"new!")
+    touch_later(changed)
+    os.remove(tmp_path / "out" / "removed.jar")
+    stats = copy_files(jobs, manifest_path)
+
+    assert (stats.copied_files, stats.skipped_files) == (2, 0)
+    assert (tmp_path / "out" / "changed.jar").read_bytes() == b"new!"
+    assert (tmp_path / "out" / "removed.jar").read_bytes() == b"removed"
+
+
+def test_verify_hash_catches_same_size_and_mtime(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "COPY_VERIFY_HASH", True)
+    source = write(tmp_path / "repo" / "a.jar", b"aaaa")
+    target = str(tmp_path / "out" / "a.jar")
+    manifest_path = str(tmp_path / "out" / COPY_MANIFEST_NAME)
+    copy_files([(source, target)], manifest_path)
+
+    stat = os.stat(source)
+    write(tmp_path / "repo" / "a.jar", b"bbbb")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    stats = copy_files([(source, target)], manifest_path)
+
+    assert stats.copied_files == 1
+    assert (tmp_path / "out" / "a.jar").read_bytes() == b"bbbb"
+
+
+def test_failed_copies_are_reported_and_not_recorded(tmp_path):
+    source = write(tmp_path / "repo" / "a.jar", b"a")
+    manifest_path = str(tmp_path / "out" / COPY_MANIFEST_NAME)
+    missing = str(tmp_path / "repo" / "gone.jar")
+
+    stats = copy_files([(source, str(tmp_path / "out" / "a.jar")), (missing, str(tmp_path / "out" / "gone.jar"))], manifest_path)
+
+    assert stats.failed == [missing]
+    with open(manifest_path) as f:
+        assert list(json.load(f)) == ["a.jar"]
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import packRunningJava
+from packRunningJava import COPY_MANIFEST_NAME, copy_files, store_file
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    store = str(tmp_path / "store")
+    monkeypatch.setattr(packRunningJava, "DEPENDENCY_STORE_DIR", store)
+    monkeypatch.setattr(packRunningJava, "COPY_VERIFY_HASH", False)
+    return store
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_store_is_off_by_default():
+    assert packRunningJava.DEPENDENCY_STORE_DIR is None
+
+
+def test_store_file_keeps_one_copy_per_content(tmp_path):
+    first = write(tmp_path / "a" / "lib.jar", b"same content")
+    second = write(tmp_path / "b" / "lib.jar", b"same content")
+    store = str(tmp_path / "store")
+
+    stored, digest, is_new = store_file(first, store)
+    again, same_digest, again_new = store_file(second, store)
+
+    assert is_new and not again_new
+    assert stored == again == os.path.join(store, digest[:2], digest)
+    assert digest == same_digest
+    assert [name for _, _, names in os.walk(store) for name in names] == [digest]
+
+
+def test_duplicate_dependencies_are_hardlinked_from_the_store(tmp_path, store_dir):
+    first = write(tmp_path / "repo1" / "lib.jar", b"x" * 1000)
+    second = write(tmp_path / "repo2" / "lib.jar", b"x" * 1000)
+    jobs = [(first, str(tmp_path / "out" / "repo1" / "lib.jar")), (second, str(tmp_path / "out" / "repo2" / "lib.jar"))]
+
+    stats = copy_files(jobs, str(tmp_path / "out" / COPY_MANIFEST_NAME), workers=1)
+
+    assert (stats.copied_files, stats.linked_files, stats.linked_bytes) == (1, 1, 1000)
+    first_target, second_target = (os.stat(target) for _, target in jobs)
+    assert first_target.st_ino == second_target.st_ino
+    assert first_target.st_nlink == 3  # Both targets and the stored file
+
+
+def test_changed_dependency_does_not_modify_the_stored_file(tmp_path, store_dir):
+    source = write(tmp_path / "repo" / "lib.jar", b"version 1")
+    target = str(tmp_path / "out" / "lib.jar")
+    manifest_path = str(tmp_path / "out" / COPY_MANIFEST_NAME)
+    copy_files([(source, target)], manifest_path)
+    stored_v1, _, _ = store_file(source, store_dir)
+
+    write(tmp_path / "repo" / "lib.jar", b"version 2, longer")
+    copy_files([(source, target)], manifest_path)
+
+    with open(target, "rb") as f:
+        assert f.read() == b"version 2, longer"
+    with open(stored_v1, "rb") as f:
+        assert f.read() == b"version 1"
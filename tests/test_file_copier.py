@@ -0,0 +1,95 @@
+import errno
+import os
+
+import pytest
+
+import packCommon
+from packCommon import FileCopier
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.jar"
+    path.write_bytes(os.urandom(300 * 1024))
+    os.chmod(path, 0o640)
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    return path
+
+
+# Replace the copy methods with ones that record their calls and fail with the given errno, or copy
+def fake_methods(monkeypatch, errors):
+    calls = []
+
+    def method(name):
+        def copy(source_fd, target_fd, size):
+            calls.append(name)
+            if errors.get(name):
+                os.write(target_fd, b"partial output of a failed method")
+                raise OSError(errors[name], f"{name} failed")
+            packCommon._copy_buffered(source_fd, target_fd, size)
+        return copy
+
+    for name in packCommon.COPY_METHODS:
+        monkeypatch.setitem(packCommon._COPY_FUNCTIONS, name, method(name))
+    return calls
+
+
+def test_copy_keeps_content_mode_and_times(tmp_path, source):
+    target = tmp_path / "target.jar"
+    method = FileCopier().copy(str(source), str(target))
+    assert method in packCommon.COPY_METHODS
+    assert target.read_bytes() == source.read_bytes()
+    assert os.stat(target).st_mode & 0o777 == 0o640
+    assert os.stat(target).st_mtime == 1_000_000_000
+
+
+def test_unsupported_methods_fall_back_and_are_remembered(monkeypatch, tmp_path, source):
+    calls = fake_methods(monkeypatch, {"reflink": errno.EOPNOTSUPP, "copy_file_range": errno.EXDEV})
+    copier = FileCopier()
+
+    assert copier.copy(str(source), str(tmp_path / "first.jar")) == "sendfile"
+    assert copier.copy(str(source), str(tmp_path / "second.jar")) == "sendfile"
+
+    # The partial output of the failed methods is discarded
+    assert (tmp_path / "first.jar").read_bytes() == source.read_bytes()
+    assert calls == ["reflink", "copy_file_range", "sendfile", "sendfile"]
+    assert copier.files == {"sendfile": 2}
+    assert copier.summary() == "sendfile 2 files (600.0 KB)"
+
+
+def test_copy_errors_are_not_treated_as_unsupported(monkeypatch, tmp_path, source):
+    calls = fake_methods(monkeypatch, {"reflink": errno.ENOSPC})
+    with pytest.raises(OSError) as error:
+        FileCopier().copy(str(source), str(tmp_path / "target.jar"))
+    assert error.value.errno == errno.ENOSPC
+    assert calls == ["reflink"]
+
+
+def test_last_method_failure_is_raised(monkeypatch, tmp_path, source):
+    fake_methods(monkeypatch, {name: errno.ENOTSUP for name in packCommon.COPY_METHODS})
+    with pytest.raises(OSError) as error:
+        FileCopier().copy(str(source), str(tmp_path / "target.jar"))
+    assert error.value.errno == errno.ENOTSUP
+
+
+def test_copy_file_range_stopping_early_falls_back(monkeypatch, tmp_path, source):
+    if not hasattr(os, "copy_file_range"):
+        pytest.skip("os.copy_file_range is not available")
+    monkeypatch.setattr(packCommon, "COPY_METHODS", ["copy_file_range", "buffered"])
+    monkeypatch.setattr(os, "copy_file_range", lambda *args: 0)
+
+    assert FileCopier().copy(str(source), str(tmp_path / "target.jar")) == "buffered"
+    assert (tmp_path / "target.jar").read_bytes() == source.read_bytes()
+
+
+def test_short_buffered_copy_fails(tmp_path, source):
+    # The source shrank after its size was taken
+    source_fd = os.open(source, os.O_RDONLY)
+    target_fd = os.open(tmp_path / "target.jar", os.O_WRONLY | os.O_CREAT)
+    try:
+        with pytest.raises(OSError) as error:
+            packCommon._copy_buffered(source_fd, target_fd, os.path.getsize(source) + 1)
+    finally:
+        os.close(source_fd)
+        os.close(target_fd)
+    assert error.value.errno == errno.EIO
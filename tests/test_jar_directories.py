@@ -0,0 +1,69 @@
+import os
+import zipfile
+
+import pytest
+
+import packRunningJava
+from packRunningJava import JAR_MANIFEST_NAME, jar_class_directories, jar_directory, packaged_classpath_entry
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+@pytest.fixture
+def classes(tmp_path):
+    root = tmp_path / "target" / "classes"
+    write(root / "com" / "example" / "Main.class", b"main")
+    write(root / "com" / "example" / "util" / "Util.class", b"util")
+    write(root / "application.properties", b"port=8080")
+    return root
+
+
+def test_jar_directory_round_trip(classes, tmp_path):
+    jar_path = str(tmp_path / "out" / "classes.jar")
+
+    files, total_bytes = jar_directory(str(classes), jar_path)
+
+    assert (files, total_bytes) == (3, len(b"main") + len(b"util") + len(b"port=8080"))
+    with zipfile.ZipFile(jar_path) as jar:
+        assert jar.testzip() is None
+        names = jar.namelist()
+        assert names[0] == "META-INF/MANIFEST.MF"
+        assert jar.read("com/example/Main.class") == b"main"
+        assert jar.read("com/example/util/Util.class") == b"util"
+        assert jar.read("application.properties") == b"port=8080"
+        # Directory entries let ClassLoader.getResources find packages
+        assert {"com/", "com/example/", "com/example/util/"} <= set(names)
+    assert os.listdir(tmp_path / "out") == ["classes.jar"]
+
+
+def test_jar_directory_keeps_an_existing_manifest_first(classes, tmp_path):
+    write(classes / "META-INF" / "MANIFEST.MF", b"Manifest-Version: 1.0\r\nMain-Class: com.example.Main\r\n\r\n")
+    jar_path = str(tmp_path / "classes.jar")
+
+    jar_directory(str(classes), jar_path)
+
+    with zipfile.ZipFile(jar_path) as jar:
+        assert jar.namelist()[0] == "META-INF/MANIFEST.MF"
+        assert jar.namelist().count("META-INF/MANIFEST.MF") == 1
+        assert b"Main-Class: com.example.Main" in jar.read("META-INF/MANIFEST.MF")
+
+
+def test_unchanged_directories_are_not_jarred_again(classes, tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "JAR_CLASS_DIRECTORIES", True)
+    target = str(tmp_path / "out")
+    jar_path = packaged_classpath_entry(str(classes), target)
+    assert jar_path.endswith(os.path.join("target", "classes.jar"))
+
+    jar_class_directories([str(classes)], target)
+    first_mtime = os.stat(jar_path).st_mtime_ns
+    jar_class_directories([str(classes)], target)
+    assert os.stat(jar_path).st_mtime_ns == first_mtime
+    assert os.path.isfile(os.path.join(target, JAR_MANIFEST_NAME))
+
+    write(classes / "com" / "example" / "Added.class", b"added")
+    jar_class_directories([str(classes)], target)
+    with zipfile.ZipFile(jar_path) as jar:
+        assert jar.read("com/example/Added.class") == b"added"
@@ -0,0 +1,125 @@
+import os
+import zipfile
+
+import pytest
+
+import packRunningJava
+from packRunningJava import (JvmSnapshot, PackError, app_stages, manifest_main_attributes, mergeable_jar_resources, mirror_path,
+                             plan_jar_merges, run_stages, write_classpath_files)
+
+
+def write_jar(path, entries, manifest=b"Manifest-Version: 1.0\r\nCreated-By: Maven\r\n\r\n", padding=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as jar:
+        if manifest is not None:
+            jar.writestr("META-INF/MANIFEST.MF", manifest)
+        for name in entries:
+            jar.writestr(name, name.encode())
+        if padding:
+            jar.writestr("padding.bin", b"\0" * padding)
+    return str(path)
+
+
+def test_manifest_main_attributes():
+    manifest = (b"Manifest-Version: 1.0\r\nAutomatic-Module-Name: com.example.very.long.module.name.that.goes.past.seventy\r\n"
+                b" two.bytes\r\nMulti-Release: true\r\n\r\nName: com/example/\r\nSealed: true\r\n")
+    assert manifest_main_attributes(manifest) == {
+        "automatic-module-name": "com.example.very.long.module.name.that.goes.past.seventytwo.bytes",
+        "multi-release": "true",
+    }
+
+
+def test_mergeable_jar_resources(tmp_path):
+    plain = write_jar(tmp_path / "plain.jar", ["a/A.class", "a/messages.properties", "META-INF/services/a.Service",
+                                               "META-INF/LICENSE.txt", "META-INF/spring.factories"])
+    assert mergeable_jar_resources(plain) == {"a/messages.properties", "META-INF/spring.factories"}
+
+    multi_release = write_jar(tmp_path / "mr.jar", ["a/A.class"], manifest=b"Manifest-Version: 1.0\r\nMulti-Release: true\r\n\r\n")
+    assert mergeable_jar_resources(multi_release) == set()
+    assert mergeable_jar_resources(write_jar(tmp_path / "no-manifest.jar", ["a/A.class"], manifest=None)) == set()
+
+    # The merged jar's fresh manifest would lose these attributes, a signature or an index would be wrong
+    assert mergeable_jar_resources(write_jar(tmp_path / "module.jar", ["a/A.class"],
+                                             manifest=b"Manifest-Version: 1.0\r\nAutomatic-Module-Name: a\r\n\r\n")) is None
+    assert mergeable_jar_resources(write_jar(tmp_path / "signed.jar", ["a/A.class", "META-INF/KEY.SF", "META-INF/KEY.RSA"])) is None
+    assert mergeable_jar_resources(write_jar(tmp_path / "indexed.jar", ["a/A.class", "META-INF/INDEX.LIST"])) is None
+    (tmp_path / "broken.jar").write_bytes(b"not a zip")
+    assert mergeable_jar_resources(str(tmp_path / "broken.jar")) is None
+
+
+def test_plan_jar_merges_keeps_the_classpath_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "MERGE_JAR_MAX_BYTES", 16 * 1024)
+    monkeypatch.setattr(packRunningJava, "MERGED_JAR_MAX_BYTES", 20 * 1024)
+    repo = tmp_path / "repo"
+    a, b = write_jar(repo / "a.jar", ["a/A.class"]), write_jar(repo / "b.jar", ["b/B.class"])
+    large = write_jar(repo / "large.jar", ["l/L.class"], padding=20 * 1024)
+    c, d = write_jar(repo / "c.jar", ["c/C.class", "app.properties"]), write_jar(repo / "d.jar", ["d/D.class"])
+    # app.properties again: merging e into c's jar would hide one copy from ClassLoader.getResources
+    e, f = write_jar(repo / "e.jar", ["e/E.class", "app.properties"]), write_jar(repo / "f.jar", ["f/F.class"])
+    classes = repo / "classes"
+    classes.mkdir()
+    g = write_jar(repo / "g.jar", ["g/G.class"])
+    # Each would take a merged jar past MERGED_JAR_MAX_BYTES together with the next one
+    h, i, j = (write_jar(repo / f"{name}.jar", [f"{name}/X.class"], padding=12 * 1024) for name in ("h", "i", "j"))
+
+    merged = plan_jar_merges([a, b, large, c, d, e, f, str(classes), g, h, i, j], str(tmp_path / "dependencies"))
+
+    groups = {}
+    for source, merged_path in merged.items():
+        groups.setdefault(merged_path, []).append(source)
+    assert sorted(groups.values()) == [[a, b], [c, d], [e, f], [g, h]]
+    assert all(os.path.dirname(path) == str(tmp_path / "dependencies" / "merged") for path in groups)
+    assert plan_jar_merges([a, b], str(tmp_path / "dependencies")) != plan_jar_merges([a, b, large, c, d], str(tmp_path / "dependencies"))
+
+
+@pytest.fixture
+def classpath(tmp_path):
+    classes = tmp_path / "app" / "classes"
+    classes.mkdir(parents=True)
+    return [str(classes), write_jar(tmp_path / "repo" / "a b.jar", ["a/A.class"]), write_jar(tmp_path / "repo" / "c.jar", ["c/C.class"])]
+
+
+def test_write_classpath_files(tmp_path, classpath, monkeypatch):
+    pack_dir = tmp_path / "pack"
+    pack_dir.mkdir()
+    target_directory = str(pack_dir / "dependencies")
+    merged_jars = {classpath[1]: str(pack_dir / "dependencies" / "merged" / "merged-001.jar"),
+                   classpath[2]: str(pack_dir / "dependencies" / "merged" / "merged-001.jar")}
+    packaged_classes = os.path.relpath(mirror_path(classpath[0], target_directory), pack_dir).replace(os.sep, "/")
+    monkeypatch.setattr(packRunningJava, "JAR_CLASS_DIRECTORIES", False)
+
+    monkeypatch.setattr(packRunningJava, "LAUNCHER_CLASSPATH", "argfile")
+    write_classpath_files(classpath, target_directory, str(pack_dir), merged_jars)
+    assert (pack_dir / "classpath-unix.args").read_text() == f'-cp "{packaged_classes}:dependencies/merged/merged-001.jar"\n'
+    assert (pack_dir / "classpath-windows.args").read_text() == f'-cp "{packaged_classes};dependencies/merged/merged-001.jar"\n'
+
+    monkeypatch.setattr(packRunningJava, "LAUNCHER_CLASSPATH", "manifest")
+    write_classpath_files(classpath, target_directory, str(pack_dir))
+    with zipfile.ZipFile(pack_dir / "classpath.jar") as jar:
+        manifest = manifest_main_attributes(jar.read("META-INF/MANIFEST.MF"))
+    classes_url = packaged_classes.replace(" ", "%20")
+    a_url = os.path.relpath(mirror_path(classpath[1], target_directory), pack_dir).replace(os.sep, "/").replace(" ", "%20")
+    assert manifest["class-path"].split(" ")[:2] == [classes_url + "/", a_url]
+    first_jar = (pack_dir / "classpath.jar").read_bytes()
+    write_classpath_files(classpath, target_directory, str(pack_dir))
+    assert (pack_dir / "classpath.jar").read_bytes() == first_jar
+
+    monkeypatch.setattr(packRunningJava, "LAUNCHER_CLASSPATH", "bogus")
+    with pytest.raises(PackError, match="Unknown LAUNCHER_CLASSPATH"):
+        write_classpath_files(classpath, target_directory, str(pack_dir))
+
+
+def test_merged_jars_are_packed_and_launched(tmp_path, classpath, packer, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "MERGE_SMALL_JARS", True)
+    monkeypatch.setattr(packRunningJava, "LAUNCHER_CLASSPATH", "argfile")
+    snapshot = JvmSnapshot("42", "com.example.Main", "", classpath, [])
+
+    results = run_stages(app_stages("42", "com.example.Main", packer.pack_dir, snapshot=snapshot))
+
+    merged_path = results["merge_plan"][classpath[1]]
+    assert results["merge_plan"] == {classpath[1]: merged_path, classpath[2]: merged_path}
+    with zipfile.ZipFile(merged_path) as jar:
+        assert {"a/A.class", "c/C.class"} <= set(jar.namelist())
+    with open(os.path.join(packer.pack_dir, "classpath-unix.args")) as f:
+        assert f.read().endswith(":dependencies/merged/" + os.path.basename(merged_path) + '"\n')
+    assert not os.path.exists(mirror_path(classpath[1], packRunningJava.DEPENDENCY_DIR))
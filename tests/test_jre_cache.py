@@ -0,0 +1,86 @@
+import os
+import time
+
+import pytest
+
+import packCommon
+from packCommon import build_custom_jre, jre_cache_key
+
+
+@pytest.fixture
+def jdk(tmp_path):
+    jdk_dir = tmp_path / "jdk"
+    (jdk_dir / "jmods").mkdir(parents=True)
+    (jdk_dir / "jmods" / "java.base.jmod").write_bytes(b"jmod")
+    (jdk_dir / "release").write_text('JAVA_VERSION="22.0.1"\n')
+    return str(jdk_dir)
+
+
+@pytest.fixture
+def jlink_runs(tmp_path, monkeypatch):
+    runs = []
+
+    def fake_jlink(jdk_path, modules, output_dir, jlink_options):
+        runs.append(sorted(modules))
+        os.makedirs(os.path.join(output_dir, "lib"))
+        with open(os.path.join(output_dir, "lib", "modules"), "wb") as f:
+            f.write(b"m" * 1000 * len(modules))
+
+    monkeypatch.setattr(packCommon, "run_jlink", fake_jlink)
+    monkeypatch.setattr(packCommon, "JRE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(packCommon, "JRE_CACHE_MAX_BYTES", 10 ** 9)
+    return runs
+
+
+def test_cache_key_depends_on_jdk_modules_and_options(jdk, tmp_path):
+    key = jre_cache_key(jdk, ["java.sql", "java.base"], ["--strip-debug"])
+    assert jre_cache_key(jdk, ["java.base", "java.sql", "java.base"], ["--strip-debug"]) == key
+    assert jre_cache_key(jdk, ["java.base"], ["--strip-debug"]) != key
+    assert jre_cache_key(jdk, ["java.sql", "java.base"], []) != key
+
+    with open(os.path.join(jdk, "release"), "w") as f:
+        f.write('JAVA_VERSION="22.0.2"\n')
+    assert jre_cache_key(jdk, ["java.sql", "java.base"], ["--strip-debug"]) != key
+
+
+def test_cache_key_changes_when_the_jdk_is_upgraded_in_place(jdk):
+    key = jre_cache_key(jdk, ["java.base"], [])
+    java_base = os.path.join(jdk, "jmods", "java.base.jmod")
+    mtime = os.stat(java_base).st_mtime + 10
+    os.utime(java_base, (mtime, mtime))
+    assert jre_cache_key(jdk, ["java.base"], []) != key
+
+
+def test_cached_image_is_reused(jdk, jlink_runs, tmp_path):
+    build_custom_jre(jdk, ["java.base"], str(tmp_path / "app1" / "custom-jre"), [])
+    build_custom_jre(jdk, ["java.base"], str(tmp_path / "app2" / "custom-jre"), [])
+    build_custom_jre(jdk, ["java.base", "java.sql"], str(tmp_path / "app3" / "custom-jre"), [])
+
+    assert jlink_runs == [["java.base"], ["java.base", "java.sql"]]
+    first = os.stat(tmp_path / "app1" / "custom-jre" / "lib" / "modules")
+    second = os.stat(tmp_path / "app2" / "custom-jre" / "lib" / "modules")
+    assert first.st_ino == second.st_ino
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+
+def test_least_recently_used_images_are_evicted(jdk, jlink_runs, tmp_path, monkeypatch):
+    # Each image is about 1000 bytes per module, the limit keeps two of them
+    monkeypatch.setattr(packCommon, "JRE_CACHE_MAX_BYTES", 2500)
+    cache = tmp_path / "cache"
+    for i, modules in enumerate((["a"], ["b"], ["a"], ["c"])):
+        build_custom_jre(jdk, modules, str(tmp_path / f"app{i}" / "custom-jre"), [])
+        # Spread the last use times, so the order does not depend on the timer resolution
+        stamp = cache / jre_cache_key(jdk, modules, []) / "last_used"
+        os.utime(stamp, (time.time() - 100 + i,) * 2)
+
+    keys = set(os.listdir(cache))
+    assert keys == {jre_cache_key(jdk, ["a"], []), jre_cache_key(jdk, ["c"], [])}
+    assert jlink_runs == [["a"], ["b"], ["c"]]
+
+
+def test_cache_disabled(jdk, jlink_runs, tmp_path, monkeypatch):
+    monkeypatch.setattr(packCommon, "JRE_CACHE_MAX_BYTES", 0)
+    build_custom_jre(jdk, ["java.base"], str(tmp_path / "app1" / "custom-jre"), [])
+    build_custom_jre(jdk, ["java.base"], str(tmp_path / "app1" / "custom-jre"), [])
+    assert jlink_runs == [["java.base"], ["java.base"]]
+    assert not os.path.exists(tmp_path / "cache")
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+import packRunningJava
+from packRunningJava import (PackError, collect_jvm_snapshot, module_path_launch, parse_classpath, parse_java_command, parse_jvm_args,
+                             parse_system_properties, parse_vm_flags)
+
+# Output of jcmd 12345 VM.flags on JDK 17
+VM_FLAGS = """12345:
+-XX:CICompilerCount=3 -XX:ConcGCThreads=1 -XX:G1ConcRefinementThreads=4 -XX:G1HeapRegionSize=1048576 \
+-XX:GCDrainStackTargetSize=64 -XX:InitialHeapSize=130023424 -XX:MarkStackSize=4194304 -XX:MaxHeapSize=536870912 \
+-XX:MaxNewSize=321912832 -XX:MinHeapDeltaBytes=1048576 -XX:MinHeapSize=8388608 -XX:NonNMethodCodeHeapSize=5836300 \
+-XX:NonProfiledCodeHeapSize=122910970 -XX:ProfiledCodeHeapSize=122910970 -XX:ReservedCodeCacheSize=251658240 \
+-XX:+SegmentedCodeCache -XX:SoftMaxHeapSize=536870912 -XX:+UseCompressedClassPointers -XX:+UseCompressedOops \
+-XX:+UseG1GC -XX:-UseLargePages
+"""
+
+# Output of jcmd 12345 VM.system_properties on JDK 17, written by Properties.store
+SYSTEM_PROPERTIES = r"""12345:
+#Fri Oct 17 10:00:00 CEST 2026
+java.specification.version=17
+sun.jnu.encoding=UTF-8
+java.class.path=/app/classes\:/home/dev/.m2/repository/org/slf4j/slf4j-api/2.0.9/slf4j-api-2.0.9.jar
+java.vm.vendor=Eclipse Adoptium
+path.separator=\:
+line.separator=\n
+user.dir=C\:\\Users\\dev\\app
+java.vendor.url=https\://adoptium.net/
+app.greeting=caf\u00E9 \u00FC
+app\:key\=with\ separators=value
+sun.java.command=com.example.Main --port 8080
+"""
+
+# Output of jcmd 12345 VM.command_line; the classpath uses this host's separator
+COMMAND_LINE = f"""12345:
+VM Arguments:
+jvm_args: -Xmx512m -Dfile.encoding=UTF-8 -javaagent:/opt/idea/lib/idea_rt.jar=41231:/opt/idea/bin
+java_command: com.example.Main --port 8080 --verbose
+java_class_path (initial): {os.pathsep.join(["/app/classes", "/app/lib/a.jar", "/app/lib/b.jar"])}
+Launcher Type: SUN_STANDARD
+"""
+
+# VM.command_line of java -p mods -m com.example/com.example.Main, as the launcher passes it on
+MODULE_COMMAND_LINE = """12345:
+VM Arguments:
+jvm_args: -Xmx512m -Djdk.module.path=/app/mods -Djdk.module.main=com.example -Djdk.module.main.class=com.example.Main
+java_command: com.example/com.example.Main
+Launcher Type: SUN_STANDARD
+"""
+
+
+def test_parse_vm_flags():
+    flags = parse_vm_flags(VM_FLAGS)
+    assert flags["CICompilerCount"] == "3"
+    assert flags["MaxHeapSize"] == "536870912"
+    assert flags["UseG1GC"] == "true"
+    assert flags["UseLargePages"] == "false"
+    assert "12345" not in flags
+
+
+def test_parse_system_properties():
+    properties = parse_system_properties(SYSTEM_PROPERTIES)
+    assert properties["java.specification.version"] == "17"
+    assert properties["java.class.path"] == "/app/classes:/home/dev/.m2/repository/org/slf4j/slf4j-api/2.0.9/slf4j-api-2.0.9.jar"
+    assert properties["path.separator"] == ":"
+    assert properties["line.separator"] == "\n"
+    assert properties["user.dir"] == "C:\\Users\\dev\\app"
+    assert properties["java.vendor.url"] == "https://adoptium.net/"
+    assert properties["app.greeting"] == "caf\u00e9 \u00fc"
+    assert properties["app:key=with separators"] == "value"
+    assert properties["sun.java.command"] == "com.example.Main --port 8080"
+    assert not any(key.startswith(("#", "12345")) for key in properties)
+
+
+def test_command_line_parsers():
+    assert parse_jvm_args(COMMAND_LINE) == "-Xmx512m -Dfile.encoding=UTF-8 -javaagent:/opt/idea/lib/idea_rt.jar=41231:/opt/idea/bin"
+    assert parse_java_command(COMMAND_LINE) == ("com.example.Main", ["--port", "8080", "--verbose"])
+    assert parse_classpath(COMMAND_LINE) == ["/app/classes", "/app/lib/a.jar", "/app/lib/b.jar"]
+
+
+@pytest.fixture
+def jvm(monkeypatch):
+    outputs = {"VM.flags": VM_FLAGS, "VM.system_properties": SYSTEM_PROPERTIES.replace(r"\:", os.pathsep)}
+    state = {"command_line": COMMAND_LINE}
+
+    def run_jcmd(pid, *command):
+        output = outputs[" ".join(command)]
+        if isinstance(output, BaseException):
+            raise output
+        return output
+
+    monkeypatch.setattr(packRunningJava, "run_jcmd", run_jcmd)
+    monkeypatch.setattr(packRunningJava, "get_java_process_info", lambda pid: state["command_line"])
+    monkeypatch.setattr(packRunningJava, "TRIM_JARS", False)
+    monkeypatch.setattr(packRunningJava, "REPLAY_JVM_FLAGS", False)
+    return outputs, state
+
+
+def test_snapshot_takes_the_classpath_from_java_class_path(jvm):
+    snapshot = collect_jvm_snapshot("12345")
+    assert snapshot.classpath == ["/app/classes", "/home/dev/.m2/repository/org/slf4j/slf4j-api/2.0.9/slf4j-api-2.0.9.jar"]
+    assert snapshot.main_class == "com.example.Main"
+    assert snapshot.program_args == ["--port", "8080", "--verbose"]
+    assert snapshot.flags["UseG1GC"] == "true"
+    assert snapshot.system_properties["java.vm.vendor"] == "Eclipse Adoptium"
+
+
+def test_snapshot_survives_failed_optional_queries(jvm):
+    outputs, _ = jvm
+    outputs["VM.flags"] = OSError("jcmd failed")
+    outputs["VM.system_properties"] = OSError("jcmd failed")
+
+    snapshot = collect_jvm_snapshot("12345")
+
+    assert snapshot.classpath == ["/app/classes", "/app/lib/a.jar", "/app/lib/b.jar"]
+    assert snapshot.flags == {} and snapshot.system_properties == {}
+
+
+def test_snapshot_without_command_line_fails(jvm):
+    jvm[1]["command_line"] = None
+    with pytest.raises(PackError, match="Failed to retrieve"):
+        collect_jvm_snapshot("12345")
+
+
+def test_module_path_launches_are_refused(jvm):
+    outputs, state = jvm
+    state["command_line"] = MODULE_COMMAND_LINE
+    outputs["VM.system_properties"] = "12345:\njdk.module.path=/app/mods\njdk.module.main=com.example\n"
+    with pytest.raises(PackError, match="main module com.example"):
+        collect_jvm_snapshot("12345")
+
+    # From the JVM arguments alone, when the properties query failed
+    outputs["VM.system_properties"] = OSError("jcmd failed")
+    with pytest.raises(PackError, match="module path"):
+        collect_jvm_snapshot("12345")
+
+
+def test_module_path_launch_detection():
+    assert module_path_launch({}, COMMAND_LINE) is None
+    assert module_path_launch({"jdk.module.path": "/opt/javafx/lib"}, COMMAND_LINE) == "module path /opt/javafx/lib"
+    assert module_path_launch({}, MODULE_COMMAND_LINE) == "main module com.example"
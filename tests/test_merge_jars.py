@@ -0,0 +1,217 @@
+import os
+import zipfile
+
+import packMavenProject
+from packCommon import jar_manifest, merge_jars, read_manifest_attributes
+
+
+def write_jar(path, entries, manifest=b"Manifest-Version: 1.0\r\n\r\n"):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as jar:
+        if manifest is not None:
+            jar.writestr("META-INF/MANIFEST.MF", manifest)
+        for name, data in entries.items():
+            jar.writestr(name, data)
+    return str(path)
+
+
+def write_files(root, files):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return str(root)
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as jar:
+        assert jar.testzip() is None
+        return {info.filename: jar.read(info) for info in jar.infolist()}
+
+
+def test_merge_keeps_first_entry_and_drops_signatures(tmp_path):
+    first = write_jar(tmp_path / "a.jar", {"a/A.class": b"A1", "shared.properties": b"first", "META-INF/A.SF": b"sig"})
+    second = write_jar(tmp_path / "b.jar", {"a/A.class": b"A2", "b/B.class": b"B", "META-INF/B.RSA": b"sig"})
+    output = str(tmp_path / "merged.jar")
+
+    stats = merge_jars([first, second], output, {"Main-Class": "a.A"})
+
+    entries = read_zip(output)
+    assert entries["a/A.class"] == b"A1"
+    assert entries["shared.properties"] == b"first"
+    assert entries["b/B.class"] == b"B"
+    assert not any(name.endswith((".SF", ".RSA")) for name in entries)
+    assert entries["META-INF/MANIFEST.MF"] == jar_manifest({"Main-Class": "a.A"})
+    assert list(entries)[:2] == ["META-INF/", "META-INF/MANIFEST.MF"]
+    assert stats.duplicates == 1
+
+
+def test_merge_services(tmp_path):
+    service = "META-INF/services/java.sql.Driver"
+    first = write_jar(tmp_path / "a.jar", {service: b"a.Driver"})
+    second = write_jar(tmp_path / "b.jar", {service: b"b.Driver\n"})
+    classes = write_files(tmp_path / "classes", {service: b"c.Driver\n"})
+
+    merge_jars([first, second, classes], str(tmp_path / "concatenated.jar"), {}, merge_services=True)
+    merge_jars([first, second, classes], str(tmp_path / "first.jar"), {})
+
+    assert read_zip(tmp_path / "concatenated.jar")[service] == b"a.Driver\nb.Driver\nc.Driver\n"
+    assert read_zip(tmp_path / "first.jar")[service] == b"a.Driver"
+
+
+def test_merge_multi_release(tmp_path):
+    versioned = write_jar(tmp_path / "mr.jar", {"m/M.class": b"base", "META-INF/versions/17/m/M.class": b"17"},
+                          manifest=b"Manifest-Version: 1.0\r\nMulti-Release: true\r\n\r\n")
+    plain = write_jar(tmp_path / "plain.jar", {"p/P.class": b"base", "META-INF/versions/17/p/P.class": b"inert"})
+    earlier = write_jar(tmp_path / "earlier.jar", {"q/Q.class": b"earlier"})
+    later = write_jar(tmp_path / "later.jar", {"q/Q.class": b"later", "META-INF/versions/17/q/Q.class": b"later 17"},
+                      manifest=b"Manifest-Version: 1.0\r\nMulti-Release: true\r\n\r\n")
+    output = str(tmp_path / "merged.jar")
+
+    merge_jars([versioned, plain, earlier, later], output, {})
+
+    entries = read_zip(output)
+    assert b"Multi-Release: true" in entries["META-INF/MANIFEST.MF"]
+    assert entries["META-INF/versions/17/m/M.class"] == b"17"
+    # Versioned entries of a jar that is not multi-release are never used
+    assert "META-INF/versions/17/p/P.class" not in entries
+    # A versioned entry of a later jar must not override the base entry of an earlier jar
+    assert entries["q/Q.class"] == b"earlier"
+    assert "META-INF/versions/17/q/Q.class" not in entries
+
+
+def test_merge_without_multi_release_input(tmp_path):
+    output = str(tmp_path / "merged.jar")
+    merge_jars([write_jar(tmp_path / "a.jar", {"a/A.class": b"A"})], output, {})
+    assert b"Multi-Release" not in read_zip(output)["META-INF/MANIFEST.MF"]
+
+
+def test_merge_incremental_rebuild(tmp_path):
+    dependency = write_jar(tmp_path / "dependency.jar", {f"d/D{i}.class": bytes([i]) * 100 for i in range(20)})
+    classes = write_files(tmp_path / "classes", {"app/Main.class": b"main v1", "app/Util.class": b"util"})
+    output = str(tmp_path / "app.jar")
+    state_file = str(tmp_path / "app.jar.state.json")
+
+    first = merge_jars([classes, dependency], output, {"Main-Class": "app.Main"}, state_file=state_file)
+    assert first.written and first.reused == 0
+
+    unchanged = merge_jars([classes, dependency], output, {"Main-Class": "app.Main"}, state_file=state_file)
+    assert not unchanged.written and unchanged.reused == unchanged.entries
+
+    main_class = tmp_path / "classes" / "app" / "Main.class"
+    main_class.write_bytes(b"main v2, changed")
+    mtime = main_class.stat().st_mtime + 10
+    os.utime(main_class, (mtime, mtime))
+    rebuilt = merge_jars([classes, dependency], output, {"Main-Class": "app.Main"}, state_file=state_file)
+
+    assert rebuilt.written
+    assert rebuilt.compressed == 1
+    assert rebuilt.reused == rebuilt.entries - 1
+    entries = read_zip(output)
+    assert entries["app/Main.class"] == b"main v2, changed"
+    assert entries["app/Util.class"] == b"util"
+    assert entries["d/D7.class"] == bytes([7]) * 100
+
+
+def test_merge_rebuild_after_dependency_change(tmp_path):
+    dependency = tmp_path / "dependency.jar"
+    write_jar(dependency, {"d/D.class": b"v1"})
+    classes = write_files(tmp_path / "classes", {"app/Main.class": b"main"})
+    output = str(tmp_path / "app.jar")
+    state_file = str(tmp_path / "app.jar.state.json")
+    merge_jars([classes, str(dependency)], output, {}, state_file=state_file)
+
+    write_jar(dependency, {"d/D.class": b"v2", "d/E.class": b"new"})
+    merge_jars([classes, str(dependency)], output, {}, state_file=state_file)
+
+    entries = read_zip(output)
+    assert entries["d/D.class"] == b"v2"
+    assert entries["d/E.class"] == b"new"
+    assert entries["app/Main.class"] == b"main"
+
+
+def test_merge_keeps_the_first_manifest(tmp_path):
+    classes = write_files(tmp_path / "classes", {
+        "META-INF/MANIFEST.MF": b"Manifest-Version: 1.0\r\nCreated-By: Maven\r\nMain-Class: old.Main\r\n"
+                                b"Add-Opens: java.base/java.lang java.base/java.util java.base/java.nio java.base/jav\r\n"
+                                b" a.io\r\nLauncher-Agent-Class: app.Agent\r\n\r\nName: app/\r\nSealed: true\r\n\r\n",
+        "app/Main.class": b"main"})
+    dependency = write_jar(tmp_path / "dependency.jar", {"d/D.class": b"D"},
+                           manifest=b"Manifest-Version: 1.0\r\nAutomatic-Module-Name: dependency\r\n\r\n")
+    output = str(tmp_path / "app.jar")
+
+    merge_jars([classes, dependency], output, {"main-class": "app.Main"}, keep_first_manifest=True)
+
+    assert read_manifest_attributes(read_zip(output)["META-INF/MANIFEST.MF"]) == {
+        "Add-Opens": "java.base/java.lang java.base/java.util java.base/java.nio java.base/java.io",
+        "Launcher-Agent-Class": "app.Agent",
+        "main-class": "app.Main",
+    }
+
+    merge_jars([classes, dependency], output, {"Main-Class": "app.Main"})
+    assert read_zip(output)["META-INF/MANIFEST.MF"] == jar_manifest({"Main-Class": "app.Main"})
+
+
+POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>com.example</groupId>
+  <artifactId>app</artifactId>
+  <version>1.2.0</version>
+  <name>Example App</name>
+  <properties><agent.class>app.Agent</agent.class></properties>
+  <build>
+    <plugins>
+      <plugin>
+        <artifactId>maven-jar-plugin</artifactId>
+        <configuration>
+          <archive>
+            <manifestFile>src/main/resources/extra.mf</manifestFile>
+            <manifest><addDefaultImplementationEntries>true</addDefaultImplementationEntries></manifest>
+            <manifestEntries>
+              <Launcher-Agent-Class>${agent.class}</Launcher-Agent-Class>
+              <Main-Class>from.the.Pom</Main-Class>
+            </manifestEntries>
+          </archive>
+        </configuration>
+      </plugin>
+      <plugin>
+        <artifactId>maven-shade-plugin</artifactId>
+        <configuration>
+          <transformers>
+            <transformer implementation="org.apache.maven.plugins.shade.resource.ManifestResourceTransformer">
+              <manifestEntries><Enable-Native-Access>ALL-UNNAMED</Enable-Native-Access></manifestEntries>
+            </transformer>
+          </transformers>
+        </configuration>
+      </plugin>
+    </plugins>
+  </build>
+</project>
+"""
+
+
+def test_native_fat_jar_manifest_follows_the_pom(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    write_files(project, {"pom.xml": POM.encode(), "src/main/resources/extra.mf": b"Add-Opens: java.base/java.lang\n",
+                          "target/classes/app/Main.class": b"main"})
+    dependency = write_jar(tmp_path / "dependency.jar", {"d/D.class": b"D"})
+    (project / "target" / "pack-classpath.txt").write_text(dependency)
+    monkeypatch.setattr(packMavenProject, "CLASSPATH_FILE", str(project / "target" / "pack-classpath.txt"))
+    monkeypatch.setattr(packMavenProject, "FAT_JAR_STATE_FILE", str(project / "target" / ".pack-fat-jar.json"))
+    monkeypatch.setattr(packMavenProject, "REACTOR_MODULES", False)
+    module = packMavenProject.read_maven_module(str(project))
+    module.main_class = "app.Main"
+
+    packMavenProject.build_fat_jar(module)
+
+    entries = read_zip(packMavenProject.module_jar(module))
+    assert read_manifest_attributes(entries["META-INF/MANIFEST.MF"]) == {
+        "Add-Opens": "java.base/java.lang",
+        "Implementation-Title": "Example App",
+        "Implementation-Version": "1.2.0",
+        "Launcher-Agent-Class": "app.Agent",
+        "Enable-Native-Access": "ALL-UNNAMED",
+        "Main-Class": "app.Main",
+        "Multi-Release": "true",
+    }
+    assert entries["d/D.class"] == b"D"
@@ -0,0 +1,149 @@
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+
+import pytest
+
+import packCommon
+import packRunningJava
+from packCommon import PackageArchive, ZipEntry, write_zip_directory, zip_data_descriptor, zip_local_header
+
+
+def write_files(root, files):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return str(root)
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as jar:
+        assert jar.testzip() is None
+        return {info.filename: jar.read(info) for info in jar.infolist()}
+
+
+def test_archive_zip_round_trip(tmp_path):
+    root = tmp_path / "package"
+    source = write_files(tmp_path / "source", {"lib/a.jar": os.urandom(3000), "lib/sub/b.txt": b"b" * 5000, "empty": b""})
+    script = tmp_path / "start.sh"
+    script.write_bytes(b"#!/bin/sh\n")
+    output = str(tmp_path / "package.zip")
+
+    archive = PackageArchive(output, str(root), workers=2)
+    archive.add_tree(source, str(root / "dependencies"))
+    archive.add_file(str(script), str(root / "start_program.sh"), mode=0o755)
+    archive.add_bytes(b"release", str(root / "release.txt"))
+    archive.close()
+
+    with zipfile.ZipFile(output) as package:
+        assert package.testzip() is None
+        assert sorted(package.namelist()) == ["dependencies/empty", "dependencies/lib/a.jar", "dependencies/lib/sub/b.txt",
+                                              "release.txt", "start_program.sh"]
+        assert package.read("dependencies/lib/a.jar") == (tmp_path / "source" / "lib" / "a.jar").read_bytes()
+        assert package.read("dependencies/lib/sub/b.txt") == b"b" * 5000
+        assert package.read("dependencies/empty") == b""
+        assert package.read("release.txt") == b"release"
+        assert (package.getinfo("start_program.sh").external_attr >> 16) & 0o777 == 0o755
+    assert archive.digests["release.txt"]["size"] == len(b"release")
+    assert not os.path.exists(f"{output}.{os.getpid()}.tmp")
+
+
+def test_archive_zip_chunked_entry(tmp_path, monkeypatch):
+    # Entries larger than a chunk are deflated in pieces that must join into one stream
+    monkeypatch.setattr(packCommon, "ARCHIVE_CHUNK_BYTES", 64 * 1024)
+    data = os.urandom(100 * 1024) + bytes(300 * 1024) + os.urandom(50 * 1024)
+    output = str(tmp_path / "package.zip")
+
+    archive = PackageArchive(output, str(tmp_path), workers=4)
+    archive.add_bytes(data, str(tmp_path / "big.bin"))
+    archive.close()
+
+    assert read_zip(output)["big.bin"] == data
+
+
+def test_archive_tar_round_trip_with_hardlinks(tmp_path):
+    root = tmp_path / "package"
+    jre = write_files(tmp_path / "jre", {"lib/modules": os.urandom(10000), "bin/java": b"#!/bin/sh\n"})
+    output = str(tmp_path / "package.tar.gz")
+
+    archive = PackageArchive(output, str(root), workers=2)
+    archive.add_tree(jre, str(root / "a" / "custom-jre"))
+    archive.add_copy(str(root / "a" / "custom-jre"), str(root / "b" / "custom-jre"))
+    archive.close()
+
+    with tarfile.open(output, "r:gz") as package:
+        members = {member.name: member for member in package.getmembers()}
+        assert members["b/custom-jre/lib/modules"].islnk()
+        assert members["b/custom-jre/lib/modules"].linkname == "a/custom-jre/lib/modules"
+        assert package.extractfile("a/custom-jre/lib/modules").read() == (tmp_path / "jre" / "lib" / "modules").read_bytes()
+        assert package.extractfile("b/custom-jre/bin/java").read() == b"#!/bin/sh\n"
+
+
+def test_archive_zip64_entry_count(tmp_path):
+    output = str(tmp_path / "many.zip")
+    archive = PackageArchive(output, str(tmp_path), workers=4)
+    for i in range(0x10000):
+        archive.add_bytes(str(i).encode(), str(tmp_path / "files" / f"{i}.txt"))
+    archive.close()
+
+    with zipfile.ZipFile(output) as package:
+        assert len(package.infolist()) == 0x10000
+        assert package.read("files/0.txt") == b"0"
+        assert package.read("files/65535.txt") == b"65535"
+
+
+def test_zip64_offsets_and_sizes(tmp_path):
+    # An entry that starts past 4 GiB, in a sparse file, and one written with zip64 data descriptors
+    data = b"zip64 " * 1000
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    output = tmp_path / "large.zip"
+    with open(output, "wb") as f:
+        first = ZipEntry(b"first.txt", 0o644, time.time(), zip64=True)
+        f.write(zip_local_header(first))
+        first.crc, first.size, first.compressed_size = zlib.crc32(data), len(data), len(compressed)
+        f.write(compressed)
+        f.write(zip_data_descriptor(first))
+
+        far = ZipEntry(b"far.txt", 0o644, time.time(), zip64=False, offset=0x100000000 + 100, crc=zlib.crc32(data),
+                       size=len(data), compressed_size=len(compressed), flags=0x0800)
+        f.seek(far.offset)
+        f.write(zip_local_header(far))
+        f.write(compressed)
+        write_zip_directory(f, [first, far], f.tell())
+
+    with zipfile.ZipFile(output) as package:
+        assert package.getinfo("far.txt").header_offset == 0x100000000 + 100
+        assert package.read("first.txt") == data
+        assert package.read("far.txt") == data
+
+
+def test_archive_on_stdout_keeps_child_output_out(tmp_path, capfdbinary):
+    archive = PackageArchive("-", str(tmp_path), workers=2)
+    with packRunningJava.stdout_to_stderr():
+        print("progress")
+        subprocess.run([sys.executable, "-c", "print('output of a child process')"], check=True)
+        archive.add_bytes(b"content", str(tmp_path / "a.txt"))
+        archive.close()
+    print("after")
+
+    out, err = capfdbinary.readouterr()
+    assert out.endswith(b"after\n")
+    assert read_zip(io.BytesIO(out[:-len(b"after\n")])) == {"a.txt": b"content"}
+    assert b"progress" in err and b"output of a child process" in err and b"Archive written to stdout" in err
+
+
+@pytest.mark.parametrize("option", ["CDS_TRAINING", "WATCH"])
+def test_archive_output_rejects_options_that_need_the_package_on_disk(monkeypatch, option):
+    monkeypatch.setattr(packRunningJava, "validate_jdk_path", lambda: None)
+    monkeypatch.setattr(packRunningJava, "ARCHIVE_OUTPUT", "-")
+    monkeypatch.setattr(packRunningJava, option, True)
+    with pytest.raises(SystemExit) as exit_info:
+        packRunningJava.main()
+    assert exit_info.value.code == 1
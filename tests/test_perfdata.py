@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+import packRunningJava
+from benchPackaging import write_perfdata
+from packRunningJava import (PERFDATA_TRUNCATED_BYTES, discover_jvms_from_perfdata, get_java_process_info, list_java_processes,
+                             parse_classpath, parse_java_command, parse_jvm_args, perfdata_command_line, read_perfdata,
+                             truncated_perfdata_counters)
+
+COUNTERS = {
+    "sun.rt.javaCommand": "com.example.Main --port 8080",
+    "java.rt.vmArgs": "-Xmx512m -Dfile.encoding=UTF-8",
+    "java.rt.vmFlags": "",
+    "java.property.java.class.path": os.pathsep.join(["/app/classes", "/app/lib/a.jar"]),
+    "sun.rt.createVmBeginTime": 1760688000000,
+}
+
+
+@pytest.fixture
+def hsperfdata(tmp_path, monkeypatch):
+    directory = tmp_path / "hsperfdata_dev"
+    directory.mkdir()
+    monkeypatch.setattr(packRunningJava, "HSPERFDATA_DIRS", [str(directory)])
+    return directory
+
+
+@pytest.fixture
+def no_jcmd(monkeypatch):
+    calls = []
+
+    def run_jcmd(pid, *command):
+        calls.append(command)
+        raise OSError("jcmd is not installed")
+
+    monkeypatch.setattr(packRunningJava, "run_jcmd", run_jcmd)
+    return calls
+
+
+def test_read_perfdata_round_trip(tmp_path):
+    path = str(tmp_path / "1234")
+    write_perfdata(path, COUNTERS)
+    assert read_perfdata(path) == COUNTERS
+
+
+def test_read_perfdata_rejects_other_files(tmp_path):
+    path = tmp_path / "1234"
+    path.write_bytes(b"not perf-data" * 4)
+    with pytest.raises(ValueError):
+        read_perfdata(str(path))
+
+
+def test_discovery_skips_dead_processes_and_other_files(hsperfdata):
+    pid = str(os.getpid())
+    write_perfdata(str(hsperfdata / pid), COUNTERS)
+    write_perfdata(str(hsperfdata / "999999999"), COUNTERS)
+    (hsperfdata / "12.lock").write_text("")
+    (hsperfdata / "4321").write_bytes(b"broken")
+
+    assert discover_jvms_from_perfdata() == {pid: COUNTERS}
+
+
+def test_list_java_processes_from_perfdata(hsperfdata, no_jcmd):
+    write_perfdata(str(hsperfdata / str(os.getpid())), COUNTERS)
+    assert list_java_processes() == [(str(os.getpid()), "com.example.Main", "com.example.Main --port 8080")]
+
+
+def test_command_line_from_perfdata_without_jcmd(hsperfdata, no_jcmd):
+    write_perfdata(str(hsperfdata / str(os.getpid())), COUNTERS)
+
+    command_line = get_java_process_info(str(os.getpid()))
+
+    assert no_jcmd == []
+    assert parse_jvm_args(command_line) == "-Xmx512m -Dfile.encoding=UTF-8"
+    assert parse_java_command(command_line) == ("com.example.Main", ["--port", "8080"])
+    assert parse_classpath(command_line) == ["/app/classes", "/app/lib/a.jar"]
+
+
+def test_truncated_perfdata_falls_back_to_jcmd(hsperfdata, monkeypatch):
+    classpath = os.pathsep.join(f"/app/lib/dependency-{i}.jar" for i in range(100))
+    write_perfdata(str(hsperfdata / str(os.getpid())),
+                   {**COUNTERS, "java.property.java.class.path": classpath[:PERFDATA_TRUNCATED_BYTES]})
+    jcmd_output = f"{os.getpid()}:\nVM Arguments:\njava_command: com.example.Main\njava_class_path (initial): {classpath}\n"
+    monkeypatch.setattr(packRunningJava, "run_jcmd", lambda pid, *command: jcmd_output)
+
+    command_line = get_java_process_info(str(os.getpid()))
+
+    assert len(parse_classpath(command_line)) == 100
+
+
+def test_perfdata_command_line_without_arguments():
+    command_line = perfdata_command_line({"sun.rt.javaCommand": "app.jar"})
+    assert "jvm_flags" not in command_line
+    assert parse_jvm_args(command_line) == ""
+    assert parse_java_command(command_line) == ("app.jar", [])
+    assert parse_classpath(command_line) == []
+
+
+def test_truncated_perfdata_counters():
+    # HotSpot stores at most PERFDATA_TRUNCATED_BYTES bytes of these strings
+    assert truncated_perfdata_counters(COUNTERS) == []
+    long_args = "-Dx=" + "y" * PERFDATA_TRUNCATED_BYTES
+    counters = {**COUNTERS, "java.rt.vmArgs": long_args[:PERFDATA_TRUNCATED_BYTES]}
+    assert truncated_perfdata_counters(counters) == ["java.rt.vmArgs"]
@@ -0,0 +1,101 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import packMavenProject
+from benchPackaging import create_maven_reactor
+from packMavenProject import (POM_NAMESPACE, discover_reactor_modules, generate_reactor_poms, maven_package_command, module_jar,
+                              module_output_dir, modules_to_package)
+
+
+@pytest.fixture
+def reactor(tmp_path, monkeypatch):
+    project_dir = str(tmp_path / "reactor")
+    create_maven_reactor(project_dir)
+    for name, value in {
+        "PROJECT_DIR": project_dir, "NEW_POM_FILE": os.path.join(project_dir, "pom_executable.xml"),
+        "OUTPUT_DIR": str(tmp_path / "pack"), "CLASSPATH_FILE": os.path.join(project_dir, "target", "pack-classpath.txt"),
+        "MAVEN_EXECUTABLE": "mvn", "MAVEN_THREADS": "1C", "FAT_JAR_BUILDER": "shade", "REACTOR_MODULES": True,
+        "MODULE_MAIN_CLASSES": {}, "JAR_FILE_NAME": None,
+    }.items():
+        monkeypatch.setattr(packMavenProject, name, value)
+    return project_dir
+
+
+def test_discover_reactor_modules(reactor):
+    modules = discover_reactor_modules(reactor)
+
+    assert [module.artifact_id for module in modules] == ["bench-reactor", "bench-lib", "bench-services", "orders", "billing"]
+    assert [module.packaging for module in modules] == ["pom", "jar", "pom", "jar", "jar"]
+    orders, billing = modules[3:]
+    assert orders.directory == os.path.join(reactor, "services", "orders")
+    # The version comes from the parent's revision property, the billing jar from its finalName
+    assert orders.jar_file_name == "orders-2.1.0.jar"
+    assert billing.jar_file_name == "billing-service.jar"
+    assert (orders.main_class, billing.main_class) == ("com.example.orders.Main", "com.example.billing.Main")
+
+
+def test_modules_to_package(reactor, monkeypatch):
+    assert [module.artifact_id for module in modules_to_package(discover_reactor_modules(reactor))] == ["orders", "billing"]
+
+    monkeypatch.setattr(packMavenProject, "MODULE_MAIN_CLASSES", {"bench-lib": "com.example.lib.Tool"})
+    packaged = modules_to_package(discover_reactor_modules(reactor))
+    assert [module.artifact_id for module in packaged] == ["bench-lib", "orders", "billing"]
+    assert module_jar(packaged[0]) == os.path.join(reactor, "bench-lib", "target", "bench-lib-2.1.0.jar")
+    assert module_output_dir(packaged[2]) == os.path.join(packMavenProject.OUTPUT_DIR, "billing")
+
+
+def test_modules_to_package_needs_a_main_class(reactor):
+    modules = [module for module in discover_reactor_modules(reactor) if module.artifact_id not in ("orders", "billing")]
+    with pytest.raises(SystemExit):
+        modules_to_package(modules)
+
+
+def read_pom(path):
+    return ET.parse(path).getroot()
+
+
+def test_generate_reactor_poms(reactor, capsys):
+    modules = discover_reactor_modules(reactor)
+    packaged = modules_to_package(modules)
+
+    content = generate_reactor_poms({module.directory: module for module in modules}, reactor, packaged)
+
+    written = sorted(os.path.relpath(os.path.join(dir_path, "pom_executable.xml"), reactor)
+                     for dir_path, _, names in os.walk(reactor) if "pom_executable.xml" in names)
+    assert written == sorted(["pom_executable.xml", os.path.join("services", "pom_executable.xml"),
+                              os.path.join("services", "orders", "pom_executable.xml"),
+                              os.path.join("services", "billing", "pom_executable.xml")])
+    # Aggregators point at the generated POMs of the packaged modules only
+    root_modules = [node.text for node in read_pom(os.path.join(reactor, "pom_executable.xml")).iterfind("mvn:modules/mvn:module", POM_NAMESPACE)]
+    assert root_modules == ["bench-lib", "services/pom_executable.xml"]
+    services_modules = [node.text for node in read_pom(os.path.join(reactor, "services", "pom_executable.xml"))
+                        .iterfind("mvn:modules/mvn:module", POM_NAMESPACE)]
+    assert services_modules == ["orders/pom_executable.xml", "billing/pom_executable.xml"]
+
+    billing = read_pom(os.path.join(reactor, "services", "billing", "pom_executable.xml"))
+    main_class = billing.find(".//mvn:plugin[mvn:artifactId='maven-shade-plugin']//mvn:manifestEntries/mvn:Main-Class", POM_NAMESPACE)
+    assert main_class.text == "com.example.billing.Main"
+    assert content.count(b"maven-shade-plugin") == 2
+
+    # Unchanged POMs are not written again, so their modification times do not trigger a rebuild
+    capsys.readouterr()
+    modules = discover_reactor_modules(reactor)
+    assert generate_reactor_poms({module.directory: module for module in modules}, reactor, modules_to_package(modules)) == content
+    assert capsys.readouterr().out.count("POM file is up to date") == 4
+
+
+def test_maven_package_command(reactor, monkeypatch):
+    packaged = modules_to_package(discover_reactor_modules(reactor))
+
+    assert maven_package_command(packaged) == ["mvn", "-f", os.path.join(reactor, "pom_executable.xml"), "-T", "1C",
+                                               "-pl", ":orders,:billing", "-am", "package", "-DskipTests"]
+
+    monkeypatch.setattr(packMavenProject, "FAT_JAR_BUILDER", "native")
+    assert maven_package_command(packaged) == ["mvn", "-f", os.path.join(reactor, "pom.xml"), "-T", "1C", "-pl", ":orders,:billing",
+                                               "-am", "compile", "dependency:build-classpath",
+                                               f"-Dmdep.outputFile={os.path.join('target', 'pack-classpath.txt')}", "-DincludeScope=runtime"]
+
+    monkeypatch.setattr(packMavenProject, "REACTOR_MODULES", False)
+    assert maven_package_command(packaged[:1])[:4] == ["mvn", "-f", os.path.join(reactor, "pom.xml"), "compile"]
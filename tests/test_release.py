@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import zipfile
+
+import pytest
+
+import packRunningJava
+from packRunningJava import (COPY_MANIFEST_NAME, RELEASE_MANIFEST_NAME, PackError, build_release_manifest, diff_release_manifests,
+                             prune_dependencies, release_manifest_json, write_delta_package)
+
+
+def write_files(root, files):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def read_files(root):
+    return {path.relative_to(root).as_posix(): path.read_bytes() for path in root.rglob("*") if path.is_file()}
+
+
+def write_release(pack_dir):
+    files = build_release_manifest(str(pack_dir))
+    content = release_manifest_json(files)
+    (pack_dir / RELEASE_MANIFEST_NAME).write_bytes(content)
+    return files, content
+
+
+RELEASE_1 = {"dependencies/a.jar": b"a v1", "dependencies/b.jar": b"b", "dependencies/old.jar": b"old", "start_program.sh": b"#!/bin/sh\n"}
+RELEASE_2 = {"dependencies/a.jar": b"a v2", "dependencies/b.jar": b"b", "dependencies/new/c.jar": b"c", "start_program.sh": b"#!/bin/sh\n"}
+
+
+def test_release_manifest_skips_packer_files_and_reuses_hashes(tmp_path, monkeypatch):
+    write_files(tmp_path, {**RELEASE_1, f"dependencies/{COPY_MANIFEST_NAME}": b"{}", "pack-profile.json": b"{}"})
+    files, _ = write_release(tmp_path)
+    assert sorted(files) == sorted(RELEASE_1)
+    assert files["dependencies/b.jar"]["size"] == 1
+
+    hashed = []
+    original_hash_file = packRunningJava.hash_file
+    monkeypatch.setattr(packRunningJava, "hash_file", lambda path: hashed.append(path) or original_hash_file(path))
+    (tmp_path / "dependencies" / "a.jar").write_bytes(b"a v1, changed")
+    rebuilt = build_release_manifest(str(tmp_path))
+
+    assert hashed == [os.path.join(str(tmp_path), "dependencies/a.jar")]
+    assert rebuilt["dependencies/b.jar"] == files["dependencies/b.jar"]
+    assert rebuilt["dependencies/a.jar"]["sha256"] != files["dependencies/a.jar"]["sha256"]
+
+
+def test_diff_release_manifests():
+    previous = {"a": {"sha256": "1"}, "b": {"sha256": "2"}, "gone": {"sha256": "3"}}
+    current = {"a": {"sha256": "1"}, "b": {"sha256": "changed"}, "new": {"sha256": "4"}}
+    assert diff_release_manifests(previous, current) == (["b", "new"], ["gone"])
+
+
+@pytest.fixture
+def releases(tmp_path):
+    installed = tmp_path / "installed"
+    write_files(installed, RELEASE_1)
+    write_release(installed)
+    pack_dir = tmp_path / "package"
+    write_files(pack_dir, RELEASE_2)
+    files, content = write_release(pack_dir)
+    return installed, pack_dir, files, content
+
+
+def test_delta_directory_updates_an_installed_release(tmp_path, releases):
+    installed, pack_dir, files, content = releases
+    output = tmp_path / "delta"
+
+    write_delta_package(str(pack_dir), str(installed / RELEASE_MANIFEST_NAME), files, content, str(output))
+
+    assert read_files(output / "files") == {"dependencies/a.jar": b"a v2", "dependencies/new/c.jar": b"c", RELEASE_MANIFEST_NAME: content}
+    assert (output / "removed.txt").read_text() == "dependencies/old.jar\n"
+    assert b"\r\n" in (output / "apply_delta.bat").read_bytes()
+
+    subprocess.run(["bash", str(output / "apply_delta.sh"), str(installed)], check=True, capture_output=True)
+    assert read_files(installed) == read_files(pack_dir)
+
+    # The installed release is no longer the one the delta was made for
+    result = subprocess.run(["bash", str(output / "apply_delta.sh"), str(installed)], capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "is not the release this delta was made for" in result.stderr
+
+
+def test_delta_replaces_an_earlier_delta_only(tmp_path, releases):
+    installed, pack_dir, files, content = releases
+    output = tmp_path / "delta"
+    write_delta_package(str(pack_dir), str(installed / RELEASE_MANIFEST_NAME), files, content, str(output))
+    write_delta_package(str(pack_dir), str(installed / RELEASE_MANIFEST_NAME), files, content, str(output))
+    assert (output / "removed.txt").exists()
+
+    (tmp_path / "other" / "keep.txt").parent.mkdir()
+    (tmp_path / "other" / "keep.txt").write_bytes(b"keep")
+    with pytest.raises(PackError, match="not a delta package"):
+        write_delta_package(str(pack_dir), str(installed / RELEASE_MANIFEST_NAME), files, content, str(tmp_path / "other"))
+    assert (tmp_path / "other" / "keep.txt").read_bytes() == b"keep"
+
+
+def test_delta_archive(tmp_path, releases):
+    installed, pack_dir, files, content = releases
+    output = tmp_path / "delta.zip"
+
+    write_delta_package(str(pack_dir), str(installed / RELEASE_MANIFEST_NAME), files, content, str(output))
+
+    with zipfile.ZipFile(output) as delta:
+        assert sorted(delta.namelist()) == ["apply_delta.bat", "apply_delta.sh", "files/dependencies/a.jar",
+                                            "files/dependencies/new/c.jar", f"files/{RELEASE_MANIFEST_NAME}", "removed.txt"]
+        assert json.loads(delta.read(f"files/{RELEASE_MANIFEST_NAME}"))["files"] == files
+
+
+def test_delta_without_previous_manifest(tmp_path, releases):
+    _, pack_dir, files, content = releases
+    write_delta_package(str(pack_dir), str(tmp_path / "missing.json"), files, content, str(tmp_path / "delta"))
+    assert not (tmp_path / "delta").exists()
+
+
+def test_prune_dependencies(tmp_path):
+    write_files(tmp_path, {"lib/a.jar": b"a", "lib/stale/b.jar": b"b", "c.jar": b"c", COPY_MANIFEST_NAME: b"{}"})
+
+    prune_dependencies(str(tmp_path), {str(tmp_path / "lib" / "a.jar")})
+
+    assert sorted(read_files(tmp_path)) == [COPY_MANIFEST_NAME, "lib/a.jar"]
+    assert not (tmp_path / "lib" / "stale").exists()
@@ -0,0 +1,102 @@
+import pytest
+
+import packRunningJava
+from packRunningJava import JvmSnapshot, explicit_flag_names, parse_vm_flags_all, replayed_jvm_flags, write_jvm_options
+
+
+# Output of jcmd 12345 VM.flags -all on JDK 17 (PrintFlagsFinal format), shortened
+VM_FLAGS_ALL_17 = """12345:
+[Global flags]
+      int ActiveProcessorCount                     = -1                                        {product} {default}
+    uint ConcGCThreads                             = 1                                         {product} {ergonomic}
+   ccstr ErrorFile                                 =                                           {product} {default}
+   size_t MaxHeapSize                              = 536870912                                 {product} {command line}
+    bool PrintConcurrentLocks                      = true                                   {manageable} {management}
+    bool UseG1GC                                   = true                                      {product} {ergonomic}
+    bool UseSerialGC                               = false                                     {product} {default}
+  double G1ConcMarkStepDurationMillis              = 10.000000                                 {product} {default}
+"""
+
+# Output of jcmd 12345 VM.flags -all on JDK 8, which has no origin column
+VM_FLAGS_ALL_8 = """12345:
+[Global flags]
+    uintx ConcGCThreads                             = 0                                   {product}
+     intx CICompilerCount                          := 3                                   {product}
+    uintx MaxHeapSize                              := 4164943872                          {product}
+     bool UseParallelGC                            := true                                {product}
+"""
+
+
+def test_parse_vm_flags_all():
+    flags = parse_vm_flags_all(VM_FLAGS_ALL_17)
+    assert flags["ActiveProcessorCount"] == ("-1", "default")
+    assert flags["ConcGCThreads"] == ("1", "ergonomic")
+    assert flags["ErrorFile"] == ("", "default")
+    assert flags["MaxHeapSize"] == ("536870912", "command line")
+    assert flags["PrintConcurrentLocks"] == ("true", "management")
+    assert flags["UseG1GC"] == ("true", "ergonomic")
+    assert flags["G1ConcMarkStepDurationMillis"] == ("10.000000", "default")
+
+
+def test_parse_vm_flags_all_jdk8():
+    flags = parse_vm_flags_all(VM_FLAGS_ALL_8)
+    assert flags["ConcGCThreads"] == ("0", "default")
+    assert flags["CICompilerCount"] == ("3", "ergonomic")
+    assert flags["UseParallelGC"] == ("true", "ergonomic")
+
+
+# Flags a JDK 21 JVM on a 16 GB, 8 CPU host chose, as parse_vm_flags_all returns them
+FLAG_ORIGINS = {
+    "UseG1GC": ("true", "ergonomic"),
+    "UseSerialGC": ("false", "default"),
+    "MaxHeapSize": ("4294967296", "ergonomic"),
+    "InitialHeapSize": ("268435456", "ergonomic"),
+    "MinHeapSize": ("8388608", "ergonomic"),
+    "ConcGCThreads": ("2", "ergonomic"),
+    "ParallelGCThreads": ("8", "ergonomic"),
+    "CICompilerCount": ("4", "ergonomic"),
+    "MaxGCPauseMillis": ("100", "management"),
+    "ThreadStackSize": ("1024", "command line"),
+    "SoftMaxHeapSize": ("4294967296", "ergonomic"),
+}
+
+
+def snapshot(jvm_args, flag_origins=FLAG_ORIGINS):
+    return JvmSnapshot("12345", "com.example.Main", jvm_args, ["/app/app.jar"], [], flag_origins=flag_origins)
+
+
+def test_explicit_flag_names():
+    assert explicit_flag_names(["-Xmx1g", "-Xms256m", "-Xss512k", "-XX:+UseZGC", "-XX:-UseCompressedOops",
+                                "-XX:CICompilerCount=2", "-Dfoo=bar"]) == {
+        "MaxHeapSize", "InitialHeapSize", "MinHeapSize", "ThreadStackSize", "UseZGC", "UseCompressedOops", "CICompilerCount"}
+    assert explicit_flag_names(["-Xmn128m"]) == {"NewSize", "MaxNewSize"}
+
+
+@pytest.mark.parametrize("arg", ["-XX:MaxRAMPercentage=75.0", "-XX:InitialRAMPercentage=10", "-XX:MinRAMPercentage=50",
+                                 "-XX:MaxRAM=8g", "-XX:MaxRAMFraction=2"])
+def test_heap_sizes_relative_to_the_ram_are_explicit(arg):
+    assert {"MaxHeapSize", "InitialHeapSize", "MinHeapSize"} <= explicit_flag_names([arg])
+    replayed = replayed_jvm_flags(snapshot(arg))
+    assert not any("HeapSize=" in flag for flag in replayed)
+    assert "-XX:+UseG1GC" in replayed
+
+
+def test_replayed_jvm_flags():
+    replayed = replayed_jvm_flags(snapshot("-Xmx2g -XX:CICompilerCount=2 -javaagent:/opt/idea/lib/idea_rt.jar=1:/opt/idea/bin"))
+    # Flags the command line sets, defaults and flags outside REPLAY_JVM_FLAG_PATTERNS are not replayed
+    assert replayed == ["-XX:ConcGCThreads=2", "-XX:InitialHeapSize=268435456", "-XX:MaxGCPauseMillis=100",
+                        "-XX:MinHeapSize=8388608", "-XX:ParallelGCThreads=8", "-XX:+UseG1GC"]
+    assert replayed_jvm_flags(snapshot(None, flag_origins=None)) == []
+
+
+def test_write_jvm_options(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava.platform, "node", lambda: "build-host")
+    write_jvm_options(snapshot("-Xms1g -Xmx1g"), str(tmp_path))
+    lines = (tmp_path / "jvm.options").read_text().splitlines()
+    assert lines[1] == "# Flags the JVM ergonomics chose on build-host (PID 12345), from jcmd VM.flags -all."
+    assert [line for line in lines if not line.startswith("#")] == [
+        "-XX:CICompilerCount=4", "-XX:ConcGCThreads=2", "-XX:MaxGCPauseMillis=100", "-XX:ParallelGCThreads=8", "-XX:+UseG1GC"]
+
+    # Written even without the flags, so the launchers can always read it
+    write_jvm_options(snapshot("", flag_origins=None), str(tmp_path))
+    assert all(line.startswith("#") for line in (tmp_path / "jvm.options").read_text().splitlines())
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+import packRunningJava
+from packRunningJava import PackError, Stage, app_stages, run_stages
+
+
+def test_stages_see_the_results_of_their_dependencies():
+    stages = [
+        Stage("sum", lambda results: results["a"] + results["b"], ("a", "b")),
+        Stage("a", lambda results: 1),
+        Stage("b", lambda results: 2),
+    ]
+    assert run_stages(stages) == {"a": 1, "b": 2, "sum": 3}
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    stages = [Stage("a", lambda results: barrier.wait()), Stage("b", lambda results: barrier.wait())]
+    assert set(run_stages(stages)) == {"a", "b"}
+
+
+def test_dependent_stage_starts_after_its_dependency_finished():
+    order = []
+
+    def slow(results):
+        time.sleep(0.05)
+        order.append("slow")
+
+    stages = [Stage("later", lambda results: order.append("later"), ("slow",)), Stage("slow", slow)]
+    run_stages(stages)
+    assert order == ["slow", "later"]
+
+
+def test_first_failure_is_raised_without_failures():
+    def fail(results):
+        raise PackError("broken")
+
+    with pytest.raises(PackError, match="broken"):
+        run_stages([Stage("fail", fail), Stage("after", lambda results: None, ("fail",))])
+
+
+def test_failures_skip_dependents_and_keep_the_rest_running():
+    def fail(results):
+        raise PackError("broken")
+
+    ran = []
+    stages = [
+        Stage("fail", fail),
+        Stage("dependent", lambda results: ran.append("dependent"), ("fail",)),
+        Stage("transitive", lambda results: ran.append("transitive"), ("dependent",)),
+        Stage("independent", lambda results: ran.append("independent")),
+        Stage("tolerant", lambda results: ran.append("tolerant"), after=("fail",)),
+    ]
+    failures = {}
+    results = run_stages(stages, failures)
+
+    assert sorted(ran) == ["independent", "tolerant"]
+    assert set(results) == {"independent", "tolerant"}
+    assert str(failures["fail"]) == "broken"
+    assert str(failures["dependent"]) == "skipped, stage 'fail' failed"
+    assert str(failures["transitive"]) == "skipped, stage 'dependent' failed"
+
+
+def test_base_exceptions_are_always_raised():
+    def interrupt(results):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_stages([Stage("interrupt", interrupt)], {})
+
+
+def test_unknown_dependencies_and_cycles_are_rejected():
+    with pytest.raises(ValueError, match="unknown stages: missing"):
+        run_stages([Stage("a", lambda results: None, ("missing",))])
+    with pytest.raises(ValueError, match="cycle"):
+        run_stages([Stage("a", lambda results: None, ("b",)), Stage("b", lambda results: None, ("a",))])
+
+
+def test_launchers_wait_for_the_jre_and_dependencies(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "MERGE_SMALL_JARS", False)
+    monkeypatch.setattr(packRunningJava, "CDS_TRAINING", False)
+    stages = {stage.name: stage for stage in app_stages("1", "Main", str(tmp_path / "app"), "app/",
+                                                        shared_jre_dir=str(tmp_path / "jre"))}
+    assert set(stages["app/launchers"].depends_on) == {"app/jcmd", "app/jre", "app/copy_dependencies"}
+    assert stages["app/jre"].depends_on == ("jre",)
@@ -0,0 +1,105 @@
+import os
+import zipfile
+
+import pytest
+
+import packRunningJava
+from packCommon import PackageArchive
+from packRunningJava import jar_entry_class, mirror_path, parse_loaded_classes, trim_jars, trimmed_entries
+
+CLASS_HIERARCHY = """java.lang.Object/null
+|--com.example.Main/0x0000000801001000
+|  |--com.example.Outer$Inner$Deep/0x0000000801001400
+|  |  implements java.io.Serializable/null (declared intf)
+"""
+
+ENTRIES = ["META-INF/MANIFEST.MF", "com/example/Main.class", "com/example/Unused.class", "com/example/Outer.class",
+           "com/example/Outer$Inner.class", "com/example/Outer$Inner$Deep.class", "com/example/Outer$Other.class",
+           "com/example/package-info.class", "module-info.class", "META-INF/versions/17/com/example/Main.class",
+           "com/example/messages.properties", "com/example/plugins/Plugin.class"]
+
+
+def write_jar(path, names, signed=False):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as jar:
+        for name in names + (["META-INF/SIGNER.SF", "META-INF/SIGNER.RSA"] if signed else []):
+            jar.writestr(name, name.encode())
+    return str(path)
+
+
+def test_jar_entry_class():
+    assert jar_entry_class("a/B$C.class") == "a.B$C"
+    assert jar_entry_class("META-INF/versions/17/a/B$C.class") == "a.B$C"
+    assert jar_entry_class("a/b.properties") is None
+
+
+def test_parse_loaded_classes():
+    assert parse_loaded_classes(CLASS_HIERARCHY) == {"java.lang.Object", "com.example.Main", "com.example.Outer$Inner$Deep",
+                                                    "java.io.Serializable"}
+
+
+def test_trimmed_entries_keep_loaded_and_enclosing_classes(monkeypatch):
+    monkeypatch.setattr(packRunningJava, "TRIM_KEEP_PATTERNS", ["com/example/plugins/*"])
+    kept = trimmed_entries(ENTRIES, parse_loaded_classes(CLASS_HIERARCHY))
+    assert kept == ["META-INF/MANIFEST.MF", "com/example/Main.class", "com/example/Outer.class", "com/example/Outer$Inner.class",
+                    "com/example/Outer$Inner$Deep.class", "com/example/package-info.class", "module-info.class",
+                    "META-INF/versions/17/com/example/Main.class", "com/example/messages.properties",
+                    "com/example/plugins/Plugin.class"]
+
+
+@pytest.fixture
+def jars(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "TRIM_KEEP_PATTERNS", [])
+    plain = write_jar(tmp_path / "app.jar", ENTRIES)
+    signed = write_jar(tmp_path / "signed.jar", ENTRIES, signed=True)
+    target_directory = str(tmp_path / "dependencies")
+    return [(jar, mirror_path(jar, target_directory)) for jar in (plain, signed)], target_directory
+
+
+def test_trim_jars(jars):
+    jobs, target_directory = jars
+    loaded_classes = {"com.example.Main"}
+
+    stats = trim_jars(jobs, loaded_classes, target_directory)
+
+    assert stats.copied_files == 2 and not stats.failed
+    with zipfile.ZipFile(jobs[0][1]) as trimmed:
+        assert trimmed.testzip() is None
+        assert sorted(trimmed.namelist()) == sorted(["META-INF/MANIFEST.MF", "com/example/Main.class", "com/example/package-info.class",
+                                                     "module-info.class", "META-INF/versions/17/com/example/Main.class",
+                                                     "com/example/messages.properties"])
+        assert trimmed.read("com/example/Main.class") == b"com/example/Main.class"
+    # Removing classes from a signed jar would break its signature
+    with open(jobs[1][0], "rb") as source, open(jobs[1][1], "rb") as target:
+        assert source.read() == target.read()
+
+    # Unchanged sources and kept classes are skipped; loading another class rewrites the jars
+    assert trim_jars(jobs, loaded_classes, target_directory).skipped_files == 2
+    assert trim_jars(jobs, loaded_classes | {"com.example.Unused"}, target_directory).copied_files == 2
+    with zipfile.ZipFile(jobs[0][1]) as trimmed:
+        assert "com/example/Unused.class" in trimmed.namelist()
+
+
+def test_trim_jars_into_archive(tmp_path, jars):
+    jobs, target_directory = jars
+    archive = PackageArchive(str(tmp_path / "package.zip"), str(tmp_path))
+
+    trim_jars(jobs[:1], {"com.example.Main"}, target_directory, archive)
+    archive.close()
+
+    with zipfile.ZipFile(tmp_path / "package.zip") as package:
+        name = os.path.relpath(jobs[0][1], tmp_path).replace(os.sep, "/")
+        with zipfile.ZipFile(package.open(name)) as trimmed:
+            assert "com/example/Main.class" in trimmed.namelist()
+            assert "com/example/Unused.class" not in trimmed.namelist()
+    assert not os.path.exists(jobs[0][1])
+
+
+def test_unreadable_jar_fails_alone(tmp_path, jars):
+    jobs, target_directory = jars
+    broken = tmp_path / "broken.jar"
+    broken.write_bytes(b"not a zip")
+
+    stats = trim_jars(jobs[:1] + [(str(broken), mirror_path(str(broken), target_directory))], {"com.example.Main"}, target_directory)
+
+    assert stats.failed == [str(broken)]
+    assert stats.copied_files == 1
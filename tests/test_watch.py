@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+import packRunningJava
+from packRunningJava import JvmSnapshot, PackedApp, app_stages, diff_scans, mirror_path, run_stages, scan_watched_paths, wait_for_changes, watch_stages
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_scan_skips_the_package(tmp_path, monkeypatch):
+    monkeypatch.setattr(packRunningJava, "PACK_DIR", str(tmp_path / "work" / "pack"))
+    monkeypatch.setattr(packRunningJava, "DEPENDENCY_STORE_DIR", None)
+    source = write(tmp_path / "work" / "src" / "A.class", b"A")
+    write(tmp_path / "work" / "pack" / "dependencies" / "A.class", b"A")
+    jar = write(tmp_path / "lib.jar", b"jar")
+
+    kinds, files = scan_watched_paths([str(tmp_path / "work"), jar, str(tmp_path / "missing.jar")])
+
+    assert kinds == {str(tmp_path / "work"): "dir", jar: "file", str(tmp_path / "missing.jar"): None}
+    assert sorted(files) == sorted([source, jar])
+    assert files[jar] == (3, os.stat(jar).st_mtime_ns)
+
+
+def test_diff_scans():
+    assert diff_scans({"a": (1, 1), "b": (1, 1), "c": (1, 1)}, {"a": (1, 1), "b": (2, 2), "d": (1, 1)}) == {
+        "b": "modified", "c": "removed", "d": "added"}
+
+
+# A clock for wait_for_changes: each poll advances it and runs the next scripted edit
+@pytest.fixture
+def polls(monkeypatch):
+    monkeypatch.setattr(packRunningJava, "WATCH_POLL_SECONDS", 1.0)
+    monkeypatch.setattr(packRunningJava, "WATCH_DEBOUNCE_SECONDS", 2.0)
+    monkeypatch.setattr(packRunningJava, "WATCH_MAX_DELAY_SECONDS", 5.0)
+    monkeypatch.setattr(packRunningJava, "PACK_DIR", "/nonexistent/pack")
+    clock = {"now": 0.0, "edits": []}
+
+    def sleep(seconds):
+        clock["now"] += seconds
+        if clock["edits"]:
+            clock["edits"].pop(0)()
+
+    monkeypatch.setattr(packRunningJava.time, "sleep", sleep)
+    monkeypatch.setattr(packRunningJava.time, "monotonic", lambda: clock["now"])
+    return clock
+
+
+def test_wait_for_changes_debounces(tmp_path, polls):
+    jar = tmp_path / "lib.jar"
+    write(jar, b"v1")
+    kinds, files = scan_watched_paths([str(tmp_path)])
+    signature = os.stat(jar)
+
+    def restore():
+        write(jar, b"v1")
+        os.utime(jar, ns=(signature.st_atime_ns, signature.st_mtime_ns))
+
+    # A change that is undone is not reported; the next one is once the files stayed unchanged for 2s
+    def unchanged():
+        pass
+
+    polls["edits"] = [lambda: write(jar, b"v2, longer"), restore, unchanged, unchanged, unchanged,
+                      lambda: write(tmp_path / "added.jar", b"added"), unchanged]
+
+    _, current_files, changes, changed_roots = wait_for_changes([str(tmp_path)], kinds, files)
+
+    assert changes == {str(tmp_path / "added.jar"): "added"}
+    assert changed_roots == set()
+    assert polls["now"] == 8.0
+    assert str(tmp_path / "added.jar") in current_files
+
+
+def test_wait_for_changes_gives_up_debouncing(tmp_path, polls):
+    jar = tmp_path / "lib.jar"
+    write(jar, b"0")
+    kinds, files = scan_watched_paths([str(jar)])
+    # The jar changes on every poll, so it is reported after WATCH_MAX_DELAY_SECONDS
+    polls["edits"] = [lambda i=i: write(jar, b"changed" * (i + 1)) for i in range(20)]
+
+    _, _, changes, _ = wait_for_changes([str(jar)], kinds, files)
+
+    assert changes == {str(jar): "modified"}
+    assert polls["now"] == 6.0
+
+
+@pytest.fixture
+def packed(tmp_path, packer, monkeypatch):
+    extra = tmp_path / "config"
+    write(extra / "app.conf", b"v1")
+    monkeypatch.setattr(packRunningJava, "EXTRA_FILES_AND_DIRS", [str(extra)])
+    classpath = [write(tmp_path / "repo" / "a.jar", b"a"), write(tmp_path / "repo" / "b.jar", b"b")]
+    snapshot = JvmSnapshot("42", "com.example.Main", "-Xmx1g", classpath, [])
+    app = PackedApp("42", "com.example.Main", packer.pack_dir, "", snapshot)
+    run_stages(app_stages(app.pid, app.main_class, app.pack_dir, snapshot=snapshot))
+    return app, extra
+
+
+def test_watch_repacks_changed_dependencies(packed):
+    app, _ = packed
+    changed, removed = app.snapshot.classpath
+    target = mirror_path(changed, packRunningJava.DEPENDENCY_DIR)
+    with open(changed, "wb") as f:
+        f.write(b"a v2")
+    os.remove(removed)
+
+    stages = watch_stages(app, {changed: "modified", removed: "removed"}, {removed})
+
+    assert sorted(stage.name for stage in stages) == ["copy_dependencies", "jcmd", "launchers"]
+    run_stages(stages)
+    with open(target, "rb") as f:
+        assert f.read() == b"a v2"
+    assert not os.path.exists(mirror_path(removed, packRunningJava.DEPENDENCY_DIR))
+
+
+def test_watch_updates_changed_extra_files(packed):
+    app, extra = packed
+    write(extra / "app.conf", b"v2")
+    added = write(extra / "sub" / "added.conf", b"added")
+
+    stages = watch_stages(app, {str(extra / "app.conf"): "modified", added: "added"}, set())
+
+    assert sorted(stage.name for stage in stages) == ["copy_extra_files", "jcmd"]
+    run_stages(stages)
+    with open(os.path.join(app.pack_dir, "config", "app.conf"), "rb") as f:
+        assert f.read() == b"v2"
+    assert os.path.isfile(os.path.join(app.pack_dir, "config", "sub", "added.conf"))
+
+
+def test_failed_repack_is_retried_with_the_next_change(packed, monkeypatch, capsys):
+    app, _ = packed
+    jar = app.snapshot.classpath[0]
+    packed_state = scan_watched_paths(app.snapshot.classpath + packRunningJava.EXTRA_FILES_AND_DIRS)
+    first = ({"first": "scan"}, {"first": (1, 1)})
+    second = ({"second": "scan"}, {"second": (2, 2)})
+    waits = []
+
+    def wait(roots, kinds, files, seen=None):
+        waits.append(((kinds, files), seen))
+        if len(waits) == 1:
+            return (*first, {jar: "modified"}, set())
+        if len(waits) == 2:
+            return (*second, {jar: "modified"}, set())
+        raise KeyboardInterrupt
+
+    runs = []
+
+    def run(stages):
+        runs.append([stage.name for stage in stages])
+        if len(runs) == 1:
+            raise packRunningJava.PackError("jar is being written")
+
+    monkeypatch.setattr(packRunningJava, "wait_for_changes", wait)
+    monkeypatch.setattr(packRunningJava, "run_stages", run)
+    monkeypatch.setattr(packRunningJava, "write_release", lambda archive=None: None)
+
+    packRunningJava.watch_packages([app])
+
+    # The failed re-pack is diffed against the last packed state again, after the changes it saw
+    assert waits == [(packed_state, None), (packed_state, first), (second, None)]
+    assert runs == [["jcmd", "copy_dependencies"]] * 2
+    output = capsys.readouterr().out
+    assert "Re-pack failed: jar is being written" in output
+    assert "Watch stopped." in output